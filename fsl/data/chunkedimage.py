@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+#
+# chunkedimage.py - Support for images stored in chunked HDF5 files.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module provides functions for storing image data in chunked,
+compressed HDF5 files, and the :class:`ChunkedProxy` class, which provides
+random access to the data in such files.
+
+.. autosummary::
+   :nosignatures:
+
+   looksLikeChunkedImage
+   saveChunkedImage
+   loadChunkedImage
+   niftiToChunked
+   chunkedToNifti
+   ChunkedProxy
+
+
+A ``.nii.gz`` file must be decompressed from the start (or from the nearest
+seek point - see :mod:`.gzindex`) in order to read any part of it, and an
+uncompressed ``.nii`` file can be very large. In a chunked file, the image
+is split into small blocks which are compressed independently, so any
+sub-region of the image can be read or written by accessing only the blocks
+which overlap it.
+
+The :class:`.Image` class will load and save files which have a ``.h5`` or
+``.hdf5`` extension in this format. A chunked image may be opened in
+write-through mode, in which case the :class:`.ImageWrapper` uses a
+:class:`ChunkedProxy` to read and write the file directly::
+
+    import fsl.data.image as fslimage
+
+    img = fslimage.Image('bold.h5', writeThrough=True)
+    img[..., 10] = 0
+    img.save()
+
+
+.. note:: The HDF5 library does not allow a file to be opened for writing
+          while it is already open within the same process - the
+          :meth:`ChunkedProxy.close` method can be used to close a file
+          before it is re-opened. The :meth:`.Image.save` method closes
+          the file that an ``Image`` was previously accessing.
+
+
+File format
+-----------
+
+
+A chunked image file is a HDF5 file which contains:
+
+  - A dataset called ``data``, containing the image data, with the same
+    shape (and axis ordering) as the corresponding ``nibabel`` image.
+
+  - An attribute of the ``data`` dataset called ``header``, containing the
+    NIFTI1, NIFTI2 or ANALYZE header block, which is parsed with
+    :func:`.imageheader.parseHeader`. Header extensions are not stored.
+
+The data is stored unscaled - any scaling parameters are applied when the
+file is created, and the ``scl_slope`` and ``scl_inter`` header fields are
+cleared.
+"""
+
+
+import logging
+
+import numpy                as np
+import nibabel              as nib
+import h5py
+
+import fsl.data.imageheader as imageheader
+
+
+log = logging.getLogger(__name__)
+
+
+EXTENSIONS = ['.h5', '.hdf5']
+"""File extensions which are interpreted as chunked image files. """
+
+
+CHUNK_SIZE = 1048576
+"""Default (uncompressed) size in bytes of each chunk - see
+:func:`defaultChunks`.
+"""
+
+
+def looksLikeChunkedImage(filename):
+    """Returns ``True`` if ``filename`` has a chunked image file extension,
+    ``False`` otherwise.
+    """
+    return any(filename.lower().endswith(e) for e in EXTENSIONS)
+
+
+def defaultChunks(shape, itemsize, nbytes=None):
+    """Returns a default chunk shape for an image of the given ``shape``.
+
+    Each chunk contains complete slices in the first two dimensions, and a
+    slab of slices along the third dimension, up to ``nbytes`` bytes.  Each
+    chunk contains a single element along the fourth and higher dimensions,
+    so volumes can be read and written independently.
+
+    :arg shape:    Image shape
+    :arg itemsize: Number of bytes per voxel
+    :arg nbytes:   Target chunk size in bytes. Defaults to :data:`CHUNK_SIZE`.
+    :returns:      A tuple containing the chunk shape.
+    """
+
+    if nbytes is None:
+        nbytes = CHUNK_SIZE
+
+    shape  = [max(1, s) for s in shape]
+    chunks = shape[:2] + [1] * (len(shape) - 2)
+
+    if len(shape) >= 3:
+        slcbytes  = itemsize * shape[0] * shape[1]
+        chunks[2] = min(shape[2], max(1, nbytes // slcbytes))
+
+    return tuple(chunks)
+
+
+def saveChunkedImage(nibImage,
+                     filename,
+                     chunks=None,
+                     compression='gzip',
+                     level=None):
+    """Saves the given ``nibabel`` image to a chunked HDF5 file.
+
+    The data is read from ``nibImage`` and written to the file one slab at a
+    time, so the full image is never loaded into memory if ``nibImage`` is
+    file-backed.
+
+    :arg nibImage:    ``nibabel`` image to save
+    :arg filename:    File to save to
+    :arg chunks:      Chunk shape - defaults to the shape returned by
+                      :func:`defaultChunks`.
+    :arg compression: HDF5 compression filter - defaults to ``'gzip'``. May
+                      be ``None`` to disable compression.
+    :arg level:       Compression level, for ``'gzip'`` compression.
+                      Defaults to ``4``.
+    """
+
+    shape   = nibImage.shape
+    dataobj = nibImage.dataobj
+
+    # The data type is not known until we read
+    # some data, as nibabel will apply any
+    # scaling parameters to file-backed data.
+    if nib.is_proxy(dataobj): dtype = dataobj[(0,) * len(shape)].dtype
+    else:                     dtype = np.asanyarray(dataobj).dtype
+
+    if chunks is None:
+        chunks = defaultChunks(shape, dtype.itemsize)
+
+    opts = {'chunks' : chunks}
+
+    if compression is not None:
+        opts['compression'] = compression
+        opts['shuffle']     = True
+        if compression == 'gzip':
+            if level is None: level = 4
+            opts['compression_opts'] = level
+
+    header = nibImage.header.copy()
+    header.set_data_dtype(dtype)
+    header.set_data_shape(shape)
+    header.set_slope_inter(1, 0)
+
+    log.debug('Saving %s to chunked file %s (chunks: %s)',
+              shape, filename, chunks)
+
+    with h5py.File(filename, 'w') as f:
+
+        dset = f.create_dataset('data', shape=shape, dtype=dtype, **opts)
+        dset.attrs['header'] = np.void(header.binaryblock)
+
+        # Write one row of chunks along the
+        # last axis at a time, so each chunk
+        # is only compressed once.
+        axis = len(shape) - 1
+        step = chunks[axis]
+
+        for start in range(0, shape[axis], step):
+            slc       = [slice(None)] * len(shape)
+            slc[axis] = slice(start, min(start + step, shape[axis]))
+            slc       = tuple(slc)
+            dset[slc] = np.asanyarray(dataobj[slc], dtype=dtype)
+
+
+def loadChunkedImage(filename, writeable=False):
+    """Loads a chunked image file created by :func:`saveChunkedImage`.
+
+    The image data is not loaded - the returned ``nibabel`` image uses a
+    :class:`ChunkedProxy` as its ``dataobj``.
+
+    :arg filename:  File to load
+    :arg writeable: If ``True``, the file is opened for reading and writing.
+                    Otherwise (the default) it is opened read-only.
+    :returns:       A ``nibabel.Nifti1Image``, ``nibabel.Nifti2Image`` or
+                    ``nibabel.Spm2AnalyzeImage``.
+    """
+
+    f = h5py.File(filename, 'r+' if writeable else 'r')
+
+    try:
+        dset   = f['data']
+        header = imageheader.parseHeader(dset.attrs['header'].tobytes(),
+                                         filename)
+    except Exception:
+        f.close()
+        raise
+
+    if   isinstance(header, nib.nifti2.Nifti2Header):
+        ctr = nib.nifti2.Nifti2Image
+    elif isinstance(header, nib.nifti1.Nifti1Header):
+        ctr = nib.nifti1.Nifti1Image
+    else:
+        ctr = nib.spm2analyze.Spm2AnalyzeImage
+
+    # Pair headers are converted into
+    # single-file headers by the
+    # image class
+    return ctr(ChunkedProxy(dset), None, header=header)
+
+
+def niftiToChunked(src, dest, **kwargs):
+    """Converts the NIFTI/ANALYZE image file ``src`` into a chunked image
+    file ``dest``. All other arguments are passed to
+    :func:`saveChunkedImage`.
+    """
+    saveChunkedImage(nib.load(src), dest, **kwargs)
+
+
+def chunkedToNifti(src, dest):
+    """Converts the chunked image file ``src`` into a NIFTI/ANALYZE image
+    file ``dest``.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import fsl.data.image as fslimage
+
+    nibImage = loadChunkedImage(src)
+
+    try:
+        fslimage.saveNibImage(nibImage, dest)
+    finally:
+        nibImage.dataobj.close()
+
+
+class ChunkedProxy(object):
+    """The ``ChunkedProxy`` provides read/write access to the data in a
+    chunked image file. It is used as the ``dataobj`` of ``nibabel`` images
+    created by :func:`loadChunkedImage`, and as the storage backend of
+    :class:`.ImageWrapper` instances in write-through mode (see the
+    :class:`.ImageWrapper` documentation).
+
+    Data written to a ``ChunkedProxy`` is cast to the data type of the file,
+    being rounded and clipped to the data type range for integer types.
+    """
+
+
+    def __init__(self, dataset):
+        """Create a ``ChunkedProxy``.
+
+        :arg dataset: ``h5py.Dataset`` containing the image data.
+        """
+        self.__dataset = dataset
+        self.__file    = dataset.file
+
+
+    @property
+    def filename(self):
+        """Returns the name of the file that this ``ChunkedProxy`` is
+        accessing.
+        """
+        return self.__file.filename
+
+
+    @property
+    def shape(self):
+        """Returns the image shape. """
+        return self.__dataset.shape
+
+
+    @property
+    def ndim(self):
+        """Returns the number of image dimensions. """
+        return self.__dataset.ndim
+
+
+    @property
+    def dtype(self):
+        """Returns the data type. """
+        return self.__dataset.dtype
+
+
+    @property
+    def chunks(self):
+        """Returns the chunk shape. """
+        return self.__dataset.chunks
+
+
+    @property
+    def is_proxy(self):
+        """Always returns ``True`` - this tells ``nibabel`` that the data is
+        not in memory.
+        """
+        return True
+
+
+    def close(self):
+        """Closes the file. Has no effect if the file is already closed. """
+        self.__file.close()
+
+
+    def flush(self):
+        """Makes sure that all changes to the image data have been written
+        to disk.
+        """
+        if self.__file:
+            self.__file.flush()
+
+
+    def writeHeader(self, header):
+        """Stores the given ``nibabel`` header in the file. """
+        self.__dataset.attrs['header'] = np.void(header.binaryblock)
+
+
+    def __array__(self, dtype=None):
+        """Reads and returns all of the image data. """
+        data = self.__dataset[()]
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
+
+
+    def __normalise(self, sliceobj):
+        """Converts ``sliceobj`` into a form that can be passed to ``h5py``.
+
+        :returns: A tuple containing:
+
+                   - A slice object which can be passed to ``h5py``
+                   - A slice object which must be applied to the data
+                     returned by ``h5py``, or ``None``.
+        """
+
+        # Boolean masks are passed
+        # through as-is to h5py
+        if isinstance(sliceobj, np.ndarray):
+            return sliceobj, None
+
+        sliceobj = nib.fileslice.canonical_slicers(sliceobj, self.shape)
+        post     = [slice(None)] * len(sliceobj)
+        postproc = False
+
+        # h5py does not accept negative
+        # steps or newaxis - we read
+        # the data in order, and then
+        # flip/expand it afterwards.
+        hslices = []
+        for i, slc in enumerate(sliceobj):
+            if slc is None:
+                post[i]  = None
+                postproc = True
+            elif isinstance(slc, slice) and \
+                 slc.step is not None   and \
+                 slc.step < 0:
+                start, stop, step = slc.indices(self.shape[len(hslices)])
+                n = len(range(start, stop, step))
+                if n == 0: slc = slice(0, 0)
+                else:      slc = slice(start + (n - 1) * step, start + 1, -step)
+                hslices.append(slc)
+                post[i]  = slice(None, None, -1)
+                postproc = True
+            else:
+                hslices.append(slc)
+
+        # Integer indices drop dimensions
+        post = [p for p, s in zip(post, sliceobj) if not isinstance(s, int)]
+
+        if postproc: return tuple(hslices), tuple(post)
+        else:        return tuple(hslices), None
+
+
+    def __getitem__(self, sliceobj):
+        """Read data from the file. """
+        hslices, post = self.__normalise(sliceobj)
+        data          = self.__dataset[hslices]
+        if post is not None:
+            data = data[post]
+        return data
+
+
+    def __setitem__(self, sliceobj, values):
+        """Write data to the file. """
+
+        dtype = self.__dataset.dtype
+
+        values = np.asanyarray(values)
+
+        if isinstance(sliceobj, np.ndarray):
+            hslices = sliceobj
+            shape   = (int(np.count_nonzero(sliceobj)),)
+        else:
+            hslices, post = self.__normalise(sliceobj)
+
+            # Use a zero-strided dummy array to
+            # figure out the selection shape
+            dummy = np.lib.stride_tricks.as_strided(
+                np.zeros(1, dtype=np.uint8),
+                shape=self.shape,
+                strides=(0,) * self.ndim)
+            shape = dummy[hslices].shape
+
+            # Undo any flips/new axes, so the
+            # values are in the order h5py expects
+            if post is not None:
+                values = np.broadcast_to(values, dummy[sliceobj].shape)
+                values = values[tuple(0 if p is None else p for p in post)]
+
+        if np.issubdtype(dtype, np.integer) and \
+           not np.issubdtype(values.dtype, np.integer):
+            dmin, dmax = np.iinfo(dtype).min, np.iinfo(dtype).max
+            values     = np.clip(np.round(values), dmin, dmax)
+
+        values = np.broadcast_to(values.astype(dtype, copy=False), shape)
+        self.__dataset[hslices] = values
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+#
+# headercache.py - Persistent on-disk cache of image headers and metadata.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module provides the :class:`HeaderCache` class, a persistent cache
+of image headers and sidecar metadata which can be shared by many processes.
+
+
+The cache is disabled by default. It can be enabled via the :func:`enable`
+function, and disabled via the :func:`disable` function::
+
+    import fsl.data.headercache as headercache
+    headercache.enable()
+
+While the cache is enabled, the following functions will use it:
+
+  - :func:`.imageheader.readHeader` caches the raw header block of each
+    image file.
+
+  - :func:`.image.loadMetadata` caches the metadata loaded from JSON sidecar
+    files (including merged BIDS metadata).
+
+By default the cache is stored in an SQLite database in the
+:mod:`fsl.utils.settings` configuration directory. Each entry is keyed by the
+file path, and stores the size and modification time (in nanoseconds) of the
+file at the time the entry was created. An entry is discarded if the file
+has changed when it is looked up. Entries may also depend on other files and
+directories - for example, cached metadata depends on the JSON files and
+directories that were searched.
+
+
+.. note:: The ``Nifti`` affines are not cached - they are calculated from the
+          header in a few microseconds, which is less than the cost of a
+          cache lookup.
+"""
+
+
+import os.path as op
+import            os
+import            pickle
+import            sqlite3
+import            logging
+import            threading
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_FILE = 'headercache.db'
+"""File name of the cache database, within the :mod:`fsl.utils.settings`
+configuration directory.
+"""
+
+
+CACHE = None
+"""The :class:`HeaderCache` which is currently in use, or ``None`` if the
+cache is disabled. Use :func:`enable`, :func:`disable` and :func:`getCache`
+rather than accessing this directly.
+"""
+
+
+def enable(filename=None):
+    """Enable the header cache.
+
+    :arg filename: Cache database file. Defaults to :data:`DEFAULT_FILE`,
+                   within the :mod:`fsl.utils.settings` configuration
+                   directory.  A ``ValueError`` is raised if ``filename`` is
+                   not given, and the ``settings`` module has not been
+                   initialised.
+    :returns:      The :class:`HeaderCache`.
+    """
+
+    import fsl.utils.settings as fslsettings  # pylint: disable=import-outside-toplevel
+
+    global CACHE  # pylint: disable=global-statement
+
+    if filename is None:
+        filename = fslsettings.filePath(DEFAULT_FILE)
+
+    if filename is None:
+        raise ValueError('A file name must be specified if fsl.utils.'
+                         'settings has not been initialised')
+
+    disable()
+    CACHE = HeaderCache(filename)
+    return CACHE
+
+
+def disable():
+    """Disable the header cache. """
+    global CACHE  # pylint: disable=global-statement
+    if CACHE is not None:
+        CACHE.close()
+    CACHE = None
+
+
+def getCache():
+    """Returns the :class:`HeaderCache` if it is enabled, ``None`` otherwise.
+    """
+    return CACHE
+
+
+def fileStamp(path):
+    """Returns a ``(size, mtime_ns)`` tuple for the given file or directory,
+    or ``None`` if it does not exist.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class HeaderCache(object):
+    """A persistent cache of values associated with files, stored in an
+    SQLite database.
+
+    Values are stored and retrieved with :meth:`store` and :meth:`lookup`.
+    Each value is identified by a file path, and a ``kind`` string, which
+    describes the type of value (e.g. ``'header'`` or ``'metadata'``). Any
+    value which can be pickled may be stored.
+
+    A ``HeaderCache`` may be shared by multiple threads, and the database may
+    be shared by multiple processes.
+    """
+
+
+    def __init__(self, filename):
+        """Create a ``HeaderCache``.
+
+        :arg filename: Database file - created if it does not exist.
+        """
+
+        dirname = op.dirname(op.abspath(filename))
+        os.makedirs(dirname, exist_ok=True)
+
+        self.__filename = filename
+        self.__lock     = threading.Lock()
+        self.__hits     = 0
+        self.__misses   = 0
+        self.__conn     = sqlite3.connect(filename,
+                                          timeout=30,
+                                          check_same_thread=False)
+
+        # WAL mode allows reads to occur
+        # concurrently with a write
+        with self.__lock, self.__conn as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                         'path  TEXT    NOT NULL, '
+                         'kind  TEXT    NOT NULL, '
+                         'size  INTEGER NOT NULL, '
+                         'mtime INTEGER NOT NULL, '
+                         'deps  BLOB, '
+                         'value BLOB, '
+                         'PRIMARY KEY (path, kind))')
+
+
+    def close(self):
+        """Close the database connection. """
+        with self.__lock:
+            if self.__conn is not None:
+                self.__conn.close()
+            self.__conn = None
+
+
+    @property
+    def filename(self):
+        """Returns the cache database file name. """
+        return self.__filename
+
+
+    @property
+    def hits(self):
+        """Returns the number of :meth:`lookup` calls which have returned a
+        value.
+        """
+        return self.__hits
+
+
+    @property
+    def misses(self):
+        """Returns the number of :meth:`lookup` calls which have not returned
+        a value, either because the entry did not exist, or was stale.
+        """
+        return self.__misses
+
+
+    def lookup(self, path, kind):
+        """Retrieve a value from the cache.
+
+        :arg path: File path
+        :arg kind: Value type
+        :returns:  The cached value, or ``None`` if there is no entry for
+                   ``path`` and ``kind``, or if the entry is out of date.
+        """
+
+        path = op.abspath(path)
+
+        with self.__lock:
+            row = self.__conn.execute(
+                'SELECT size, mtime, deps, value FROM cache '
+                'WHERE path = ? AND kind = ?', (path, kind)).fetchone()
+
+        value = None
+
+        if row is not None:
+            size, mtime, deps, value = row
+            try:
+                deps  = pickle.loads(deps)
+                value = pickle.loads(value)
+            except Exception as e:
+                log.debug('Invalid cache entry for %s [%s]: %s',
+                          path, kind, e)
+                deps  = None
+                value = None
+
+            stale = deps is None                     or \
+                    fileStamp(path) != (size, mtime) or \
+                    any(fileStamp(p) != s for p, s in deps)
+
+            if stale:
+                value = None
+                with self.__lock, self.__conn as conn:
+                    conn.execute('DELETE FROM cache WHERE path = ? AND '
+                                 'kind = ? AND mtime = ?', (path, kind, mtime))
+
+        with self.__lock:
+            if value is None: self.__misses += 1
+            else:             self.__hits   += 1
+
+        return value
+
+
+    def store(self, path, kind, value, deps=None):
+        """Store a value in the cache.
+
+        :arg path:  File path
+        :arg kind:  Value type
+        :arg value: Value to store - must not be ``None``.
+        :arg deps:  Sequence of paths to other files/directories. If any of
+                    these are changed, created or deleted, the entry will be
+                    discarded.
+        """
+
+        path  = op.abspath(path)
+        stamp = fileStamp(path)
+
+        if stamp is None:
+            return
+
+        if deps is None:
+            deps = []
+
+        deps = [(op.abspath(p), fileStamp(p)) for p in deps]
+
+        with self.__lock, self.__conn as conn:
+            conn.execute('INSERT OR REPLACE INTO cache VALUES '
+                         '(?, ?, ?, ?, ?, ?)',
+                         (path, kind, stamp[0], stamp[1],
+                          pickle.dumps(deps), pickle.dumps(value)))
+
+
+    def clear(self):
+        """Remove all entries from the cache, and reset the hit/miss
+        counters.
+        """
+        with self.__lock, self.__conn as conn:
+            conn.execute('DELETE FROM cache')
+            self.__hits   = 0
+            self.__misses = 0
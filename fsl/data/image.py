@@ -23,6 +23,11 @@ and file names:
    :nosignatures:
 
    canonicalShape
+   prefetchExecutor
+   loadSeekIndexedImage
+   closeNibImage
+   saveNibImage
+   saveNibImageAtomic
    looksLikeImage
    addExt
    splitExt
@@ -35,10 +40,18 @@ and file names:
 import                      os
 import os.path           as op
 import itertools         as it
+import concurrent.futures as futures
+import                      asyncio
+import                      collections
+import                      contextlib
 import                      json
+import                      glob
+import                      struct
 import                      string
 import                      logging
-import                      tempfile
+import                      shutil
+import                      threading
+import                      uuid
 
 import                      six
 import numpy             as np
@@ -88,6 +101,25 @@ Made available in this module for convenience.
 """
 
 
+DEFAULT_CHUNK_SIZE = 128 * 1048576
+"""Default maximum size, in bytes, of the chunks read by the
+:meth:`Image.iterSlabs` and :meth:`Image.maskedData` methods.
+"""
+
+
+PREFETCH_BUFFER_SIZE = 8
+"""Maximum number of prefetched reads which are held by an :class:`Image`
+(see :meth:`Image.prefetch`). If more reads are prefetched, the oldest
+ones are discarded.
+"""
+
+
+PREFETCH_THREADS = 2
+"""Number of threads used by the executor returned by
+:func:`prefetchExecutor`.
+"""
+
+
 class Nifti(notifier.Notifier, meta.Meta):
     """The ``Nifti`` class is intended to be used as a base class for
     things which either are, or are associated with, a NIFTI image.
@@ -987,6 +1019,49 @@ class Image(Nifti):
     ``'dataRange'`` This topic is notified whenever the image data range
                     is changed/adjusted.
     =============== ======================================================
+
+
+    *Prefetching*
+
+
+    The :meth:`prefetch` method can be used to read image data on a
+    background thread, so that it is ready by the time it is needed, e.g.::
+
+        img = Image('bold.nii.gz', loadData=False)
+
+        for vol in range(img.shape[3]):
+            img.prefetch([(Ellipsis, vol + 1)])
+            process(img[..., vol])
+
+    Prefetched data is held in a small read-ahead buffer (see
+    :data:`PREFETCH_BUFFER_SIZE`), and is returned by :meth:`__getitem__`
+    when the same ``sliceobj`` is requested. Each prefetched read is only
+    returned once. The :meth:`aread` method can be used to read data from
+    ``asyncio`` code. Reads are performed on a thread pool which is shared
+    by all ``Image`` instances (see :func:`prefetchExecutor`), but only one
+    read is performed on a given ``Image`` at any one time.
+
+
+    *Batch updates*
+
+
+    Every call to :meth:`__setitem__` updates the data range, and notifies
+    listeners on the ``'data'``, ``'saveState'`` and ``'dataRange'`` topics.
+    When many small edits are made, e.g. in a region growing loop, this
+    bookkeeping can be more expensive than the edits themselves. The
+    :meth:`batchUpdate` method returns a context manager which defers the
+    bookkeeping until the context exits::
+
+        img = Image('mask.nii.gz')
+
+        with img.batchUpdate():
+            for x, y, z in voxels:
+                img[x, y, z] = 1
+
+    When the context exits, the data range is updated once, and at most one
+    notification is emitted on each topic. The ``'data'`` notification value
+    is a tuple of ``slice`` objects which covers all of the regions that
+    were modified.
     """
 
 
@@ -1000,6 +1075,10 @@ class Image(Nifti):
                  threaded=False,
                  dataSource=None,
                  loadMeta=False,
+                 writeThrough=False,
+                 seekIndex=False,
+                 lazyScaling=False,
+                 volumeCache=None,
                  **kwargs):
         """Create an ``Image`` object with the given image data or file name.
 
@@ -1038,8 +1117,10 @@ class Image(Nifti):
                          incrementally updated as more data is read from memory
                          or disk.
 
-        :arg threaded:   If ``True``, the :class:`.ImageWrapper` will use a
-                         separate thread for data range calculation. Defaults
+        :arg threaded:   If ``True``, the :class:`.ImageWrapper` will
+                         calculate the data range on a background thread
+                         pool which is shared by all images (see
+                         :func:`.imagewrapper.rangeTaskPool`). Defaults
                          to ``False``. Ignored if ``loadData`` is ``True``.
 
         :arg dataSource: If ``image`` is not a file name, this argument may be
@@ -1052,13 +1133,54 @@ class Image(Nifti):
                          can be loaded at a later stage via the
                          :func:`loadMeta` function. Defaults to ``False``.
 
+        :arg writeThrough: If ``True``, the image data is accessed through a
+                         writable memory-map of the image file, so that
+                         modifications are written directly to the file
+                         without the image data being loaded into memory.
+                         Only supported for uncompressed image files, and
+                         for chunked image files (see the
+                         :mod:`.chunkedimage` module). If ``True``,
+                         ``loadData`` is ignored. See the
+                         :class:`.ImageWrapper` for more details.
+
+        :arg seekIndex:  Defaults to ``False``. If ``True``, and ``image`` is
+                         the name of a ``.nii.gz`` file which is not loaded
+                         into memory, the file is accessed via a seek point
+                         index (see the :mod:`.gzindex` module), so that
+                         reads from arbitrary locations in the file do not
+                         require it to be decompressed from the beginning.
+                         This is only useful if ``indexed_gzip`` is not
+                         installed - otherwise ``nibabel`` already uses it to
+                         access ``.nii.gz`` files. See
+                         :func:`loadSeekIndexedImage`.
+
+        :arg lazyScaling: If ``True``, and the image data has scaling
+                         parameters, the raw data is kept in memory when it
+                         is loaded, and scaling is applied as the data is
+                         accessed. This can greatly reduce memory usage for
+                         e.g. ``int16`` images with scaling parameters. Note
+                         that in this case, the array returned by
+                         :meth:`data` is a read-only copy of the data. See
+                         the :class:`.ImageWrapper` for more details.
+
+        :arg volumeCache: If provided, and the image data is not loaded into
+                         memory, the most recently read volumes are cached.
+                         May be either a :class:`.Cache`, which may be shared
+                         with other images, or the maximum size, in bytes,
+                         of a cache to create. See the
+                         :class:`.ImageWrapper` for more details.
+
         All other arguments are passed through to the ``nibabel.load`` function
         (if it is called).
         """
 
         nibImage = None
+        backend  = None
         saved    = False
 
+        if writeThrough:
+            loadData = False
+
         if loadData:
             threaded = False
 
@@ -1084,8 +1206,27 @@ class Image(Nifti):
 
         # The image parameter may be the name of an image file
         if isinstance(image, six.string_types):
-            image      = op.abspath(addExt(image))
-            nibImage   = nib.load(image, **kwargs)
+
+            # pylint: disable=import-outside-toplevel
+            import fsl.data.chunkedimage as chunkedimage
+
+            # Chunked HDF5 files are accessed
+            # through a ChunkedProxy, which is
+            # used directly by the ImageWrapper
+            # in write-through mode.
+            if chunkedimage.looksLikeChunkedImage(image):
+                image    = op.abspath(image)
+                nibImage = chunkedimage.loadChunkedImage(
+                    image, writeable=writeThrough)
+                if writeThrough:
+                    backend = nibImage.dataobj
+
+            else:
+                image = op.abspath(addExt(image))
+                if seekIndex and not loadData and image.endswith('.nii.gz'):
+                    nibImage = loadSeekIndexedImage(image, **kwargs)
+                else:
+                    nibImage = nib.load(image, **kwargs)
             dataSource = image
             saved      = True
 
@@ -1139,7 +1280,10 @@ class Image(Nifti):
             # If this image was loaded
             # from disk, use the file name.
             if isinstance(image, six.string_types):
-                name = removeExt(op.basename(image))
+                if chunkedimage.looksLikeChunkedImage(image):
+                    name = op.splitext(op.basename(image))[0]
+                else:
+                    name = removeExt(op.basename(image))
 
             # Or the image was created from a numpy array
             elif isinstance(image, np.ndarray):
@@ -1155,12 +1299,37 @@ class Image(Nifti):
         self.__lName        = '{}_{}'.format(id(self), self.name)
         self.__dataSource   = dataSource
         self.__threaded     = threaded
+        self.__seekIndex    = seekIndex
         self.__nibImage     = nibImage
         self.__saveState    = saved
-        self.__imageWrapper = imagewrapper.ImageWrapper(self.nibImage,
-                                                        self.name,
-                                                        loadData=loadData,
-                                                        threaded=threaded)
+        self.__dataLock     = threading.RLock()
+        self.__prefetched   = collections.OrderedDict()
+
+        # True if the nibabel image was loaded
+        # from file by us, in which case we are
+        # responsible for closing any files that
+        # it holds open (see closeNibImage).
+        self.__ownsNibImage = saved
+
+        # Used by batchUpdate - the number of
+        # nested batchUpdate contexts, the data
+        # range when the outermost context was
+        # entered, and the region that has been
+        # written, as (low, high) tuples.
+        self.__batchDepth   = 0
+        self.__batchRange   = None
+        self.__batchSlices  = None
+
+        self.__imageWrapper = imagewrapper.ImageWrapper(
+            self.nibImage,
+            self.name,
+            loadData=loadData,
+            threaded=threaded,
+            writeThrough=writeThrough,
+            backend=backend,
+            lazyScaling=lazyScaling,
+            volumeCache=volumeCache,
+            priority=self.__hasRangeListeners)
 
         # Listen to ourself for changes
         # to header attributse so we
@@ -1240,11 +1409,35 @@ class Image(Nifti):
     def data(self):
         """Returns the image data as a ``numpy`` array.
 
+        If the image data is being lazily scaled (see the ``lazyScaling``
+        argument to :meth:`__init__`), the returned array is a scaled copy of
+        the data, so it is marked as read-only - modifying it would not
+        modify the image. Use :meth:`__setitem__` to modify the image data
+        instead.
+
+        Otherwise the returned array is a view of the in-memory image data,
+        so the data is pinned in memory (see :meth:`.ImageWrapper.pinData`),
+        and will not be unloaded by the :mod:`.memorymanager`.
+
         .. warning:: Calling this method will cause the entire image to be
                      loaded into memory.
         """
-        self.__imageWrapper.loadData()
-        return self[:]
+        wrapper = self.__imageWrapper
+
+        wrapper.loadData()
+        lazy = wrapper.lazyScaling
+
+        if not lazy:
+            wrapper.pinData()
+
+        # The data may have been unloaded and
+        # re-loaded (with lazy scaling) before
+        # it was pinned
+        data = self[:]
+        if lazy or wrapper.lazyScaling:
+            data.flags.writeable = False
+
+        return data
 
 
     @property
@@ -1335,6 +1528,15 @@ class Image(Nifti):
             self.notify(topic='saveState')
 
 
+    def __hasRangeListeners(self):
+        """Passed as the ``priority`` function to the
+        :class:`.ImageWrapper`. Returns ``True`` if any listeners are
+        registered on the ``'dataRange'`` topic, so that the data range
+        updates of images which are in use are prioritised.
+        """
+        return self.hasListeners('dataRange')
+
+
     def __dataRangeChanged(self, *args, **kwargs):
         """Called when the :class:`.ImageWrapper` data range changes.
         Notifies any listeners of this ``Image`` (registered through the
@@ -1355,9 +1557,10 @@ class Image(Nifti):
 
         # The ImageWrapper automatically calculates
         # the range of the specified slice, whenever
-        # it gets indexed. All we have to do is
-        # access a portion of the data to trigger the
-        # range calculation.
+        # it gets indexed. So to calculate the range
+        # of a sample, all we have to do is access a
+        # portion of the data. The full range is
+        # calculated in parallel by the ImageWrapper.
         nbytes = np.prod(self.shape) * self.dtype.itemsize
 
         # If an image size threshold has not been specified,
@@ -1365,7 +1568,7 @@ class Image(Nifti):
         if sizethres is None or nbytes < sizethres:
             log.debug('%s: Forcing calculation of full '
                       'data range', self.name)
-            self.__imageWrapper[:]
+            self.__imageWrapper.calcRange()
 
         else:
             log.debug('%s: Calculating data range '
@@ -1384,16 +1587,315 @@ class Image(Nifti):
         self.__imageWrapper.loadData()
 
 
-    def save(self, filename=None):
+    def iterVolumes(self, prefetch=0):
+        """Iterate over the 3D volumes of this ``Image``, one volume at a time.
+        For a 3D image, the entire image is returned as a single volume.
+
+        Volumes are read on demand, so this method can be used to process
+        a large 4D image which has not been loaded into memory, while only
+        requiring enough memory for a single volume. The image data range
+        is updated as each volume is read.
+
+        :arg prefetch: Number of volumes to read ahead on a background
+                       thread (see :meth:`prefetch`), so that they can be
+                       read while the current volume is being processed.
+                       Defaults to ``0``.
+
+        :returns:      A generator which yields ``(slc, data)`` tuples, where
+                       ``slc`` is a tuple of ``slice`` objects and integers,
+                       specifying the location of ``data`` within the image.
+        """
+
+        shape  = self.shape
+        slices = [(slice(None),) * 3 + idx
+                  for idx in np.ndindex(*shape[3:])]
+
+        for i, slc in enumerate(slices):
+            if prefetch > 0:
+                self.prefetch(slices[i + 1:i + 1 + prefetch])
+            yield slc, self[slc]
+
+
+    def iterSlabs(self, axis=2, nbytes=None):
+        """Iterate over the data of this ``Image`` in slabs along the given
+        ``axis``.
+
+        Each slab will contain as many slices along ``axis`` (and all
+        volumes, for a 4D image) as will fit into ``nbytes`` bytes. Slabs are
+        read on demand, so peak memory usage is bounded by the size of a
+        single slab, and the image data range is updated as each slab is
+        read.
+
+        :arg axis:   Axis along which to split the image. Defaults to ``2``
+                     (the Z axis).
+
+        :arg nbytes: Maximum size, in bytes, of each slab. Defaults to
+                     :data:`DEFAULT_CHUNK_SIZE`. A slab will always contain
+                     at least one slice, so may exceed this size.
+
+        :returns:    A generator which yields ``(slc, data)`` tuples, where
+                     ``slc`` is a tuple of ``slice`` objects specifying the
+                     location of ``data`` within the image.
+        """
+
+        if nbytes is None:
+            nbytes = DEFAULT_CHUNK_SIZE
+
+        slices = imagewrapper.chunkSlices(self.shape,
+                                          axis,
+                                          nbytes,
+                                          self.dtype.itemsize)
+
+        for slc in slices:
+            yield slc, self[slc]
+
+
+    def maskedData(self, mask, nbytes=None):
+        """Returns the data of this ``Image`` within the given ``mask``.
+
+        The ``mask`` may have fewer dimensions than this ``Image`` - for
+        example, a 3D mask may be used to extract the time series of every
+        voxel within the mask from a 4D image::
+
+            mask = Image('brain_mask.nii.gz').data > 0
+            ts   = Image('bold.nii.gz').maskedData(mask)
+            # ts has shape (nvoxels, ntimepoints)
+
+        If the image data is not in memory, it is read in slabs, and only
+        the bounding box of the mask voxels within each slab is read, so
+        peak memory usage is bounded by the slab size, and the size of the
+        result. See :meth:`.ImageWrapper.maskedData`.
+
+        Note that, unlike :meth:`__getitem__`, the image data range is not
+        updated.
+
+        :arg mask:   Boolean ``numpy`` array or ``Image``, with the same
+                     shape as the leading dimensions of this ``Image``.
+        :arg nbytes: Maximum size, in bytes, of each slab. Defaults to
+                     :data:`DEFAULT_CHUNK_SIZE`.
+        :returns:    A ``numpy`` array of shape ``(nvoxels, ...)``.
+        """
+
+        if isinstance(mask, Image):
+            mask = mask[:]
+
+        return self.__imageWrapper.maskedData(mask, nbytes)
+
+
+    def sample(self, coords, space='world', order=0, fill=np.nan,
+               nbytes=None):
+        """Samples the data of this ``Image`` at the given points.
+
+        All of the points are transformed into voxel coordinates at once,
+        and the voxels which are needed are read in slabs, with each voxel
+        only being read once (see :meth:`.ImageWrapper.voxelData`). This is
+        much faster than sampling each point separately via
+        :meth:`__getitem__`, especially for images which are not loaded into
+        memory. Note that the image data range is not updated.
+
+        Voxel coordinates are assumed to correspond to voxel centres - a
+        point is inside the image if it is within half a voxel of a voxel
+        centre.
+
+        :arg coords: ``(N, 3)`` array of point coordinates.
+
+        :arg space:  Coordinate system of ``coords`` - one of ``'world'``
+                     (the default), ``'voxel'`` or ``'fsl'`` (see
+                     :meth:`.Nifti.getAffine`).
+
+        :arg order:  Interpolation - ``0`` (the default) for nearest
+                     neighbour, or ``1`` for trilinear.
+
+        :arg fill:   Value to use for points which are outside of the image.
+                     Defaults to ``nan``.
+
+        :arg nbytes: Maximum size, in bytes, of each slab. Defaults to
+                     :data:`DEFAULT_CHUNK_SIZE`.
+
+        :returns:    A ``float64`` ``numpy`` array of shape ``(N, ...)``,
+                     containing the value at each point - for a 4D image,
+                     the shape is ``(N, T)``.
+        """
+
+        if order not in (0, 1):
+            raise ValueError('Invalid interpolation order: {}'.format(order))
+
+        coords = np.asarray(coords, dtype=np.float64)
+
+        if coords.ndim != 2 or coords.shape[1] != 3:
+            raise ValueError('coords must be a (N, 3) array')
+
+        if space != 'voxel':
+            coords = affine.transform(coords, self.getAffine(space, 'voxel'))
+
+        shape  = np.array(self.shape[:3])
+        inside = np.all((coords >= -0.5) & (coords < shape - 0.5), axis=1)
+        coords = coords[inside]
+
+        # Generate the voxel coordinates
+        # (clamped to the image bounds for
+        # trilinear interpolation), and
+        # weights for each corner
+        if order == 0:
+            corners = np.floor(coords[np.newaxis] + 0.5).astype(np.intp)
+            weights = np.ones((1, len(coords)))
+        else:
+            base    = np.floor(coords)
+            frac    = coords - base
+            offsets = np.array(list(it.product((0, 1), repeat=3)))
+            corners = base.astype(np.intp)[np.newaxis] + offsets[:, None, :]
+            corners = np.clip(corners, 0, shape - 1)
+            weights = np.where(offsets[:, None, :] == 1, frac, 1 - frac)
+            weights = weights.prod(axis=2)
+
+        # Read each voxel once, in order of its
+        # location within the image file (NIFTI
+        # images are stored in Fortran order).
+        flat      = corners.reshape(-1, 3).T
+        flat      = np.ravel_multi_index(flat, shape, order='F')
+        flat, inv = np.unique(flat, return_inverse=True)
+        voxels    = np.unravel_index(flat, shape, order='F')
+        values    = self.__imageWrapper.voxelData(voxels, nbytes)
+        trailing  = values.shape[1:]
+        values    = values[inv].reshape(weights.shape + trailing)
+        weights   = weights.reshape(weights.shape + (1,) * len(trailing))
+        result    = np.full((len(inside),) + trailing, fill, dtype=np.float64)
+
+        result[inside] = (weights * values).sum(axis=0)
+
+        return result
+
+
+    def prefetch(self, sliceobjs):
+        """Read the image data at each of the given ``sliceobjs`` on a
+        background thread. The data is stored in a read-ahead buffer, and
+        is returned by the next call to :meth:`__getitem__` with the same
+        ``sliceobj``. See the *Prefetching* section in the class
+        documentation.
+
+        Reads which have already been prefetched, and not yet retrieved,
+        are not performed again.
+
+        :arg sliceobjs: Sequence of things which can slice the image data.
+        :returns:       A list of ``concurrent.futures.Future`` objects,
+                        one for each ``sliceobj``, which will contain the
+                        image data.
+        """
+
+        results = []
+
+        with self.__dataLock:
+            for sliceobj in sliceobjs:
+
+                key    = self.__prefetchKey(sliceobj)
+                future = self.__prefetched.get(key)
+
+                if future is None:
+                    future = prefetchExecutor().submit(self.__read, sliceobj)
+
+                    # Advanced indexing is not buffered
+                    if key is not None:
+                        self.__prefetched[key] = future
+
+                results.append(future)
+
+            # Discard the oldest reads
+            while len(self.__prefetched) > PREFETCH_BUFFER_SIZE:
+                _, future = self.__prefetched.popitem(last=False)
+                future.cancel()
+
+        return results
+
+
+    async def aread(self, sliceobj):
+        """Read the image data at ``sliceobj`` on a background thread,
+        for use from an ``asyncio`` coroutine, e.g.::
+
+            data = await img.aread((Ellipsis, 0))
+
+        Data which has been prefetched (see :meth:`prefetch`) is returned
+        from the read-ahead buffer.
+
+        :arg sliceobj: Something which can slice the image data.
+        :returns:      The image data.
+        """
+
+        with self.__dataLock:
+            future = self.__prefetched.pop(self.__prefetchKey(sliceobj), None)
+
+        if future is None:
+            future = prefetchExecutor().submit(self.__read, sliceobj)
+
+        return await asyncio.wrap_future(future)
+
+
+    def __prefetchKey(self, sliceobj):
+        """Used by :meth:`prefetch`. Returns a hashable key for ``sliceobj``,
+        or ``None`` if ``sliceobj`` cannot be converted into a key (e.g. it
+        contains index arrays).
+        """
+
+        try:
+            sliceobj = fileslice.canonical_slicers(sliceobj, self.shape)
+        except Exception:
+            return None
+
+        key = []
+        for slc in sliceobj:
+            if isinstance(slc, slice):
+                key.append((slc.start, slc.stop, slc.step))
+            elif isinstance(slc, (int, np.integer)) or slc is None:
+                key.append(slc if slc is None else int(slc))
+            else:
+                return None
+
+        return tuple(key)
+
+
+    def __clearPrefetched(self):
+        """Discards all prefetched data. Called when the image data is
+        modified.
+        """
+        with self.__dataLock:
+            for future in self.__prefetched.values():
+                future.cancel()
+            self.__prefetched.clear()
+
+
+    def __read(self, sliceobj):
+        """Reads and returns the image data at ``sliceobj`` from the
+        :class:`.ImageWrapper`.
+        """
+        with self.__dataLock:
+            return self.__imageWrapper.__getitem__(sliceobj)
+
+
+    def save(self, filename=None, threads=None, level=None):
         """Saves this ``Image`` to the specifed file, or the :attr:`dataSource`
         if ``filename`` is ``None``.
 
+        :arg filename: File to save to.
+
+        :arg threads:  Number of threads to use when compressing a ``.gz``
+                       file - see :func:`saveNibImage`.
+
+        :arg level:    Compression level to use when saving a ``.gz`` file.
+
         Note that calling ``save`` on an image with modified data will cause
         the entire image data to be loaded into memory if it has not already
         been loaded.
-        """
 
-        import fsl.utils.imcp as imcp
+        The image is written to a temporary file alongside ``filename``, which
+        is then renamed into place (see :func:`saveNibImageAtomic`). If the
+        image data is in memory, it is kept in memory, and the known data
+        range is retained, so the file is not re-loaded after it has been
+        saved.
+
+        If the image is in write-through mode (see :meth:`__init__`), and is
+        being saved to the file from which it was loaded, the data is already
+        on disk, so all that is done is to flush any pending changes, and to
+        update the image header in place.
+        """
 
         if self.__dataSource is None and filename is None:
             raise ValueError('A file name must be specified')
@@ -1403,66 +1905,151 @@ class Image(Nifti):
 
         filename = op.abspath(filename)
 
+        # pylint: disable=import-outside-toplevel
+        import fsl.data.chunkedimage as chunkedimage
+
         # make sure the extension is specified
-        if not looksLikeImage(filename):
+        chunked = chunkedimage.looksLikeChunkedImage(filename)
+        if not (chunked or looksLikeImage(filename)):
             filename = addExt(filename, mustExist=False)
 
         log.debug('Saving %s to %s', self.name, filename)
 
-        # We save the image out to a temp file,
-        # then close the old image, move the
-        # temp file to the real destination,
-        # then re-open the file. This is done
-        # to ensure that all references to the
-        # old file are destroyed.
-        tmphd, tmpfname = tempfile.mkstemp(suffix=getExt(filename))
-        os.close(tmphd)
-
-        try:
-            # First of all, the nibabel object won't know
-            # about any image data modifications, so if
-            # any have occurred, we need to create a new
-            # nibabel image using the data managed by the
-            # imagewrapper, and the old header.
-            #
-            # Assuming here that analyze/nifti1/nifti2
-            # nibabel classes have an __init__ which
-            # expects (data, affine, header)
-            if not self.saveState:
-                self.__nibImage = type(self.__nibImage)(self[:],
+        if self.__imageWrapper.writeThrough and \
+           self.__dataSource is not None    and \
+           op.exists(filename)              and \
+           op.samefile(filename, self.__dataSource):
+            self.__flush()
+            return
+
+        wrapper     = self.__imageWrapper
+        inMemory    = wrapper.inMemory
+        oldNibImage = self.__nibImage
+        ownsOld     = self.__ownsNibImage
+
+        # The nibabel object won't know about any
+        # image data modifications, so if any have
+        # occurred (or if the data is in memory,
+        # but the nibabel image would read it from
+        # disk), we create a new nibabel image
+        # using the data managed by the
+        # imagewrapper, and the old header.
+        #
+        # Assuming here that analyze/nifti1/nifti2
+        # nibabel classes have an __init__ which
+        # expects (data, affine, header)
+        if not self.saveState or \
+           (inMemory and not self.__nibImage.in_memory):
+            self.__nibImage     = type(self.__nibImage)(self[:],
                                                         None,
                                                         self.header)
-                self.header     = self.__nibImage.header
+            self.header         = self.__nibImage.header
+            self.__ownsNibImage = False
+
+        # We save the image to a temp file in the
+        # destination directory, and then rename it
+        # into place. The rename is atomic, so other
+        # processes will never see a partially
+        # written file, and as the temp file is on
+        # the same file system as the destination,
+        # no data is copied.
+        saveNibImageAtomic(self.__nibImage, filename, threads, level)
+
+        # In write-through mode, we need to create
+        # a new ImageWrapper, which memory-maps the
+        # new file. Write-through mode is only
+        # possible if the new file is uncompressed,
+        # or is a chunked file.
+        if wrapper.writeThrough:
+            self.__nibImage     = self.__loadNibImage(filename,
+                                                      writeable=True)
+            self.header         = self.__nibImage.header
+            self.__ownsNibImage = True
+            backend             = None
+            writeThrough        = not filename.endswith('.gz')
+            if chunked:
+                backend = self.__nibImage.dataobj
+
+            # The old ImageWrapper is discarded,
+            # so its backend (e.g. an open chunked
+            # image file) is closed.
+            wrapper.deregister(self.__lName)
+            wrapper.clearVolumeCache()
+            wrapper.close()
+            self.__imageWrapper = imagewrapper.ImageWrapper(
+                self.nibImage,
+                self.name,
+                loadData=False,
+                dataRange=self.dataRange,
+                threaded=self.__threaded,
+                writeThrough=writeThrough,
+                backend=backend,
+                volumeCache=wrapper.volumeCache,
+                priority=self.__hasRangeListeners)
+            self.__imageWrapper.register(self.__lName,
+                                         self.__dataRangeChanged)
+
+        # Otherwise, if the data is in memory, we
+        # keep it there, and just keep the in-memory
+        # nibabel image we have just saved. If the
+        # data is not in memory, it has not been
+        # modified, so we re-open the file (only
+        # the header is read) to make sure that all
+        # references to the old file are destroyed.
+        # We also do this if the data is being
+        # lazily scaled, as the in-memory nibabel
+        # image contains a scaled copy of the data.
+        # Either way, the ImageWrapper retains its
+        # known data range and coverage.
+        else:
+            if not inMemory or wrapper.lazyScaling:
+                self.__nibImage     = self.__loadNibImage(filename)
+                self.header         = self.__nibImage.header
+                self.__ownsNibImage = True
+            wrapper.setImage(self.__nibImage)
+            wrapper.waitUntilIdle()
+
+        # Close any files held open by the
+        # old nibabel image if we opened
+        # them, as nothing will use it again.
+        if ownsOld and oldNibImage is not self.__nibImage:
+            closeNibImage(oldNibImage)
 
-            nib.save(self.__nibImage, tmpfname)
+        self.__dataSource = filename
+        self.__saveState  = True
 
-            # Copy to final destination,
-            # and reload from there
-            imcp.imcp(tmpfname, filename, overwrite=True)
+        self.notify(topic='saveState')
 
-            self.__nibImage = nib.load(filename)
-            self.header     = self.__nibImage.header
 
-        finally:
-            os.remove(tmpfname)
-
-        # Because we've created a new nibabel image,
-        # we have to create a new ImageWrapper
-        # instance too, as we have just destroyed
-        # the nibabel image we gave to the last
-        # one.
-        self.__imageWrapper.deregister(self.__lName)
-        self.__imageWrapper = imagewrapper.ImageWrapper(
-            self.nibImage,
-            self.name,
-            loadData=False,
-            dataRange=self.dataRange,
-            threaded=self.__threaded)
-        self.__imageWrapper.register(self.__lName, self.__dataRangeChanged)
+    def __loadNibImage(self, filename, writeable=False):
+        """Called by :meth:`save`. Loads the ``nibabel`` image from the given
+        file, through a seek point index if necessary (see
+        :func:`loadSeekIndexedImage`). Chunked image files are opened for
+        writing if ``writeable`` is ``True`` (see :mod:`.chunkedimage`).
+        """
 
-        self.__dataSource = filename
-        self.__saveState  = True
+        # pylint: disable=import-outside-toplevel
+        import fsl.data.chunkedimage as chunkedimage
+
+        if chunkedimage.looksLikeChunkedImage(filename):
+            return chunkedimage.loadChunkedImage(filename, writeable)
+        elif self.__seekIndex and filename.endswith('.nii.gz'):
+            return loadSeekIndexedImage(filename)
+        else:
+            return nib.load(filename)
 
+
+    def __flush(self):
+        """Called by :meth:`save` for images in write-through mode which are
+        being saved to their original file. Flushes any changes to the image
+        data, and writes the image header in place (see
+        :meth:`.MemmapProxy.writeHeader`).
+        """
+
+        self.__imageWrapper.flush()
+        self.__imageWrapper.backend.writeHeader(self.header)
+
+        self.__saveState = True
         self.notify(topic='saveState')
 
 
@@ -1474,7 +2061,17 @@ class Image(Nifti):
 
         log.debug('%s: __getitem__ [%s]', self.name, sliceobj)
 
-        return self.__imageWrapper.__getitem__(sliceobj)
+        # Return prefetched data if
+        # it is available/in progress
+        if len(self.__prefetched) > 0:
+            with self.__dataLock:
+                key    = self.__prefetchKey(sliceobj)
+                future = self.__prefetched.pop(key, None)
+
+            if future is not None and not future.cancelled():
+                return future.result()
+
+        return self.__read(sliceobj)
 
 
     def __setitem__(self, sliceobj, values):
@@ -1484,29 +2081,98 @@ class Image(Nifti):
         :arg values:   New image data.
 
         .. note:: Modifying image data will force the entire image to be
-                  loaded into memory if it has not already been loaded.
+                  loaded into memory if it has not already been loaded,
+                  unless the image is in write-through mode.
         """
-        values = np.array(values)
+        values = np.asanyarray(values)
 
         log.debug('%s: __setitem__ [%s = %s]',
                   self.name, sliceobj, values.shape)
 
-        with self.__imageWrapper.skip(self.__lName):
+        with self.__dataLock, self.__imageWrapper.skip(self.__lName):
+
+            self.__clearPrefetched()
 
             oldRange = self.__imageWrapper.dataRange
             self.__imageWrapper.__setitem__(sliceobj, values)
             newRange = self.__imageWrapper.dataRange
 
-        if values.size > 0:
+        if values.size == 0:
+            return
+
+        # Notification is deferred
+        # in a batch update
+        if self.__batchDepth > 0:
+            shape  = self.__nibImage.shape
+            slices = imagewrapper.canonicalSliceObj(sliceobj, shape)
+            slices = imagewrapper.sliceObjToSliceTuple(slices, shape)
+
+            if self.__batchSlices is not None:
+                slices = imagewrapper.unionSlices(self.__batchSlices, slices)
+            self.__batchSlices = slices
+            return
+
+        self.__notifyWrite(sliceobj, oldRange, newRange)
+
+
+    @contextlib.contextmanager
+    def batchUpdate(self):
+        """Context manager which defers data range updates and
+        notifications for changes made via :meth:`__setitem__` until the
+        context exits. See the *Batch updates* section in the class
+        documentation. Contexts may be nested - the data range is updated,
+        and listeners notified, when the outermost context exits.
+
+        .. note:: The :attr:`dataRange` may be out of date until the context
+                  exits.
+        """
+
+        wrapper = self.__imageWrapper
 
-            self.notify(topic='data', value=sliceobj)
+        if self.__batchDepth == 0:
+            self.__batchRange  = wrapper.dataRange
+            self.__batchSlices = None
 
-            if self.__saveState:
-                self.__saveState = False
-                self.notify(topic='saveState')
+        self.__batchDepth += 1
+
+        try:
+            # The wrapper data range is updated
+            # when its batch context exits, so
+            # it must be exited before the skip
+            # context
+            with wrapper.skip(self.__lName), wrapper.batchUpdate():
+                yield
+
+        finally:
+            self.__batchDepth -= 1
+
+            if self.__batchDepth == 0 and self.__batchSlices is not None:
+                slices             = self.__batchSlices
+                oldRange           = self.__batchRange
+                sliceobj           = imagewrapper.sliceTupleToSliceObj(slices)
+                self.__batchSlices = None
+                self.__batchRange  = None
+                self.__notifyWrite(sliceobj, oldRange, wrapper.dataRange)
+
+
+    def __notifyWrite(self, sliceobj, oldRange, newRange):
+        """Called by :meth:`__setitem__` and :meth:`batchUpdate` when the
+        image data has been modified. Notifies listeners on the ``'data'``,
+        ``'saveState'`` and ``'dataRange'`` topics as needed.
+
+        :arg sliceobj: The region that was modified.
+        :arg oldRange: The data range before the data was modified.
+        :arg newRange: The data range after the data was modified.
+        """
+
+        self.notify(topic='data', value=sliceobj)
+
+        if self.__saveState:
+            self.__saveState = False
+            self.notify(topic='saveState')
 
-            if not np.all(np.isclose(oldRange, newRange)):
-                self.notify(topic='dataRange')
+        if not np.all(np.isclose(oldRange, newRange)):
+            self.notify(topic='dataRange')
 
 
 def canonicalShape(shape):
@@ -1532,6 +2198,34 @@ def canonicalShape(shape):
     return shape
 
 
+PREFETCH_EXECUTOR = None
+"""The ``concurrent.futures.ThreadPoolExecutor`` returned by
+:func:`prefetchExecutor`.
+"""
+
+
+PREFETCH_EXECUTOR_LOCK = threading.Lock()
+"""Used by :func:`prefetchExecutor` to protect access to
+:data:`PREFETCH_EXECUTOR`.
+"""
+
+
+def prefetchExecutor():
+    """Returns a ``concurrent.futures.ThreadPoolExecutor`` which is used by
+    all :class:`Image` instances to perform prefetched reads (see
+    :meth:`Image.prefetch`). The executor is created on the first call,
+    with :data:`PREFETCH_THREADS` threads.
+    """
+
+    global PREFETCH_EXECUTOR  # pylint: disable=global-statement
+
+    with PREFETCH_EXECUTOR_LOCK:
+        if PREFETCH_EXECUTOR is None:
+            PREFETCH_EXECUTOR = futures.ThreadPoolExecutor(
+                PREFETCH_THREADS, thread_name_prefix='fslpy-prefetch')
+        return PREFETCH_EXECUTOR
+
+
 def loadMetadata(image):
     """Searches for and loads any sidecar JSON files associated with the given
     :class:`.Image`.
@@ -1540,27 +2234,248 @@ def loadMetadata(image):
     :func:`.bids.loadMetadata` is used. Otherwise, if a JSON file with the same
     file prefix is present alongside the image, it is directly loaded.
 
+    The metadata is cached if the :mod:`.headercache` is enabled.
+
     :arg image: :class:`.Image` instance
     :returns:   Dict containing any metadata that was loaded.
     """
 
+    import fsl.data.headercache as headercache  # pylint: disable=import-outside-toplevel
+
     if image.dataSource is None:
         return {}
 
     filename = image.dataSource
     basename = op.basename(removeExt(filename))
     dirname  = op.dirname(filename)
+    cache    = headercache.getCache()
+
+    if cache is not None:
+        metadata = cache.lookup(filename, 'metadata')
+        if metadata is not None:
+            return metadata
 
+    # The metadata depends on the JSON files
+    # which are loaded, and also on the
+    # directories which are searched, as
+    # JSON files may be added or removed.
     if fslbids.isBIDSFile(image.dataSource) and \
        fslbids.inBIDSDir( image.dataSource):
-        return fslbids.loadMetadata(image.dataSource)
+        metadata = fslbids.loadMetadata(image.dataSource)
+        deps     = fslbids.metadataDirs(image.dataSource)
+        deps     = deps + list(it.chain(*[
+            glob.glob(op.join(d, '*.json')) for d in deps]))
+
+    else:
+        jsonfile = op.join(dirname, '{}.json'.format(basename))
+        deps     = [dirname, jsonfile]
+        metadata = {}
+        if op.exists(jsonfile):
+            with open(jsonfile, 'rt') as f:
+                metadata = json.load(f)
+
+    if cache is not None:
+        cache.store(filename, 'metadata', metadata, deps)
+
+    return metadata
+
+
+def closeNibImage(nibImage):
+    """Closes any files which are held open by the given ``nibabel`` image.
+    This is only necessary for images whose ``dataobj`` keeps a file open,
+    such as the :class:`.ChunkedProxy` used for chunked image files. The
+    image data cannot be accessed after this function has been called.
+
+    :arg nibImage: ``nibabel`` image to close.
+    """
+    close = getattr(nibImage.dataobj, 'close', None)
+    if callable(close):
+        close()
+
+
+def saveNibImage(nibImage, filename, threads=None, level=None):
+    """Saves the given ``nibabel`` image to ``filename``.
+
+    If ``filename`` is a ``.gz`` file, the data is compressed in parallel with
+    a :class:`.pgzip.GzipWriter`. The resulting file is a standard ``gzip``
+    file. Otherwise, or if ``nibImage`` needs to be converted to a different
+    format for the given file type, ``nibabel.save`` is used.
+
+    If ``filename`` has a ``.h5`` or ``.hdf5`` extension, the image is saved
+    as a chunked image file via :func:`.chunkedimage.saveChunkedImage`.
+
+    :arg nibImage: ``nibabel`` image to save.
+    :arg filename: File to save to.
+    :arg threads:  Number of compression threads. Defaults to
+                   :attr:`.pgzip.THREADS`.
+    :arg level:    Compression level. Defaults to :attr:`.pgzip.LEVEL`.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    import fsl.utils.pgzip       as pgzip
+    import fsl.data.chunkedimage as chunkedimage
+
+    if chunkedimage.looksLikeChunkedImage(filename):
+        chunkedimage.saveChunkedImage(nibImage, filename, level=level)
+        return
+
+    if not filename.endswith('.gz'):
+        nib.save(nibImage, filename)
+        return
+
+    # nibabel.save will convert the image
+    # if the file type does not match the
+    # image type (e.g. nifti1 -> analyze).
+    # We let nibabel take care of these
+    # cases.
+    try:
+        fmap = type(nibImage).filespec_to_file_map(filename)
+    except nib.filebasedimages.ImageFileError:
+        nib.save(nibImage, filename)
+        return
+
+    writers = []
+
+    try:
+        for holder in fmap.values():
+            if holder.filename.endswith('.gz'):
+                holder.fileobj = pgzip.GzipWriter(holder.filename,
+                                                  level=level,
+                                                  threads=threads)
+                writers.append(holder.fileobj)
+
+        nibImage.to_file_map(fmap)
+
+    finally:
+        for w in writers:
+            w.close()
+
+        # The nibabel image keeps a ref to
+        # the file map, so we need to clear
+        # the (now closed) file objects.
+        for holder in fmap.values():
+            holder.fileobj = None
+
+
+def saveNibImageAtomic(nibImage, filename, threads=None, level=None):
+    """Saves the given ``nibabel`` image to ``filename`` via
+    :func:`saveNibImage`, replacing any existing file atomically.
+
+    The image is first saved to a temporary file in the same directory as
+    ``filename``, which is then renamed into place with ``os.replace``. The
+    rename does not copy any data, and other processes will only ever see
+    the complete old file or the complete new file. Both files of a
+    ``.hdr``/``.img`` pair are renamed, one after the other.
+
+    If ``filename`` is a symbolic link, the file that it points to is
+    replaced, and the link is left intact. If the two files of a
+    ``.hdr``/``.img`` pair are in different directories (via symbolic
+    links), the second file is moved into place, which is not atomic.
+
+    .. note:: Any existing file is replaced, rather than written to, so
+              processes which already have the old file open will continue
+              to see the old file. Readers which re-open the file by name
+              will see the new file - the :class:`.SeekableGzipFile` detects
+              this, and rebuilds its index, but an
+              ``indexed_gzip.IndexedGzipFile`` (see :func:`.openIndexed`)
+              which was opened on the old file must not be used after the
+              file has been replaced.
+
+    :arg nibImage: ``nibabel`` image to save.
+    :arg filename: File to save to.
+    :arg threads:  Number of compression threads - see :func:`saveNibImage`.
+    :arg level:    Compression level - see :func:`saveNibImage`.
+    """
+
+    # Write through symlinks, rather
+    # than replacing them.
+    linkname       = op.abspath(filename)
+    filename       = op.realpath(linkname)
+    dirname        = op.dirname(filename)
+    prefix, suffix = splitExt(op.basename(filename))
+
+    # Chunked image files (see the
+    # chunkedimage module) are not
+    # in ALLOWED_EXTENSIONS
+    if suffix == '':
+        prefix, suffix = op.splitext(op.basename(filename))
+
+    # The files of a pair are resolved
+    # separately, relative to the path
+    # that we were given.
+    linkbase = linkname[:len(linkname) - len(suffix)]
+    tmpbase  = op.join(dirname, '.{}.{}'.format(prefix, uuid.uuid4().hex))
+
+    try:
+        saveNibImage(nibImage, tmpbase + suffix, threads, level)
+
+        if suffix in ALLOWED_EXTENSIONS:
+            exts = fslpath.getFileGroup(tmpbase + suffix,
+                                        ALLOWED_EXTENSIONS,
+                                        FILE_GROUPS,
+                                        fullPaths=False)
+        else:
+            exts = [suffix]
+
+        # Replace the .img after the .hdr, so
+        # the header of a pair is always
+        # written before the image data.
+        for ext in sorted(exts, key=lambda e: e.startswith('.img')):
+            dest = op.realpath(linkbase + ext)
+            if op.dirname(dest) == dirname:
+                os.replace(tmpbase + ext, dest)
+            else:
+                shutil.move(tmpbase + ext, dest)
+
+    finally:
+        for ext in ALLOWED_EXTENSIONS + [suffix]:
+            if op.exists(tmpbase + ext):
+                os.remove(tmpbase + ext)
+
+
+def loadSeekIndexedImage(filename, **kwargs):
+    """Loads the given ``.nii.gz`` file, accessing it through a seek point
+    index, via the :func:`.gzindex.openIndexed` function. Data from arbitrary
+    locations within the file can then be read without the file having to be
+    decompressed from the beginning on each access.
+
+    If the file is not actually ``gzip``-compressed, it is loaded via
+    ``nibabel.load``.
+
+    :arg filename: Path to a ``.nii.gz`` file.
+
+    All other arguments are passed through to the ``from_file_map`` method
+    of the ``nibabel`` image class.
+
+    :returns: A ``nibabel.Nifti1Image`` or ``nibabel.Nifti2Image``.
+    """
+
+    import fsl.utils.gzindex as gzindex  # pylint: disable=import-outside-toplevel
+
+    with open(filename, 'rb') as f:
+        if f.read(2) != b'\x1f\x8b':
+            return nib.load(filename, **kwargs)
+
+    fobj = gzindex.openIndexed(filename)
+
+    # The header size is stored in the first
+    # four bytes - 348 for NIFTI1, 540 for
+    # NIFTI2, in either byte order.
+    fobj.seek(0)
+    sizeof_hdr = fobj.read(4)
+    fobj.seek(0)
+
+    if 540 in (struct.unpack('<i', sizeof_hdr)[0],
+               struct.unpack('>i', sizeof_hdr)[0]):
+        ctr = nib.Nifti2Image
+    else:
+        ctr = nib.Nifti1Image
 
-    jsonfile = op.join(dirname, '{}.json'.format(basename))
-    if op.exists(jsonfile):
-        with open(jsonfile, 'rt') as f:
-            return json.load(f)
+    fmap                   = ctr.make_file_map()
+    fmap['image'].filename = filename
+    fmap['image'].fileobj  = fobj
 
-    return {}
+    return ctr.from_file_map(fmap, **kwargs)
 
 
 def looksLikeImage(filename, allowedExts=None):
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+#
+# imageheader.py - Fast header-only reading of NIFTI/ANALYZE image files.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module provides functions for reading the header of NIFTI1, NIFTI2
+and ANALYZE image files, without loading the image.
+
+.. autosummary::
+   :nosignatures:
+
+   readHeader
+   readHeaders
+   parseHeader
+
+
+Creating an :class:`.Image` with ``loadData=False`` is a relatively expensive
+way of finding out the shape, voxel size, data type or affine of an image, as
+a ``nibabel`` image, :class:`.ImageWrapper` and file handle are all created.
+The :func:`readHeader` function reads only the fixed-size header block (348
+bytes for NIFTI1/ANALYZE, and 540 bytes for NIFTI2) - for a ``.gz`` file,
+only enough of the file to produce this many bytes is decompressed. The
+returned ``nibabel`` header object may be passed to the :class:`.Nifti`
+class::
+
+    import fsl.data.image       as fslimage
+    import fsl.data.imageheader as imageheader
+
+    nifti = fslimage.Nifti(imageheader.readHeader('MNI152_T1_2mm.nii.gz'))
+    print(nifti.shape, nifti.pixdim, nifti.voxToWorldMat)
+
+The :func:`readHeaders` function can be used to read the headers of many
+files on a pool of threads.
+
+Header blocks are cached if the :mod:`.headercache` is enabled.
+
+.. note:: NIFTI header extensions are not read.
+"""
+
+
+import concurrent.futures   as futures
+import                         os
+import                         zlib
+
+import nibabel              as nib
+
+import fsl.data.image       as fslimage
+import fsl.data.headercache as headercache
+
+
+HEADER_SIZES = {1 : 348, 2 : 540}
+"""Size in bytes of the NIFTI1/ANALYZE and NIFTI2 headers, as stored in the
+first field (``sizeof_hdr``) of the header.
+"""
+
+
+def readHeader(filename):
+    """Reads the header of the given NIFTI1, NIFTI2 or ANALYZE image file.
+
+    :arg filename: Image file name. The file extension may be omitted. If
+                   the ``.img`` file of a ``.hdr``/``.img`` pair is
+                   specified, the ``.hdr`` file is read.
+
+    :returns:      A ``nibabel`` ``Nifti1Header``, ``Nifti2Header``,
+                   ``Nifti1PairHeader``, ``Nifti2PairHeader``, or
+                   ``Spm2AnalyzeHeader`` object.
+    """
+
+    if not fslimage.looksLikeImage(filename):
+        filename = fslimage.addExt(filename)
+
+    base, ext = fslimage.splitExt(filename)
+
+    if ext in ('.img', '.img.gz'):
+        filename = base + ext.replace('.img', '.hdr')
+
+    # Use the raw header block from
+    # the header cache if possible
+    cache = headercache.getCache()
+    data  = None
+
+    if cache is not None:
+        data = cache.lookup(filename, 'header')
+
+    cached = data is not None
+
+    if not cached:
+        data = readBytes(filename, HEADER_SIZES[2])
+
+    header = parseHeader(data, filename)
+
+    if cache is not None and not cached:
+        cache.store(filename, 'header', header.binaryblock)
+
+    return header
+
+
+def parseHeader(data, source='header'):
+    """Creates a ``nibabel`` header object from the given NIFTI1, NIFTI2
+    or ANALYZE header block.
+
+    :arg data:   ``bytes`` containing the header block (and optionally any
+                 following data).
+    :arg source: Name of the file that ``data`` came from, used in error
+                 messages.
+    :returns:    A ``nibabel`` header object - see :func:`readHeader`.
+    """
+
+    if len(data) < HEADER_SIZES[1]:
+        raise ValueError('{} is not a NIFTI/ANALYZE '
+                         'file (too short)'.format(source))
+
+    # The sizeof_hdr field tells us
+    # both the header version and the
+    # byte order of the header.
+    for endian in ('<', '>'):
+        size = int.from_bytes(data[:4], 'little' if endian == '<' else 'big')
+        if size in HEADER_SIZES.values():
+            break
+    else:
+        raise ValueError('{} is not a NIFTI/ANALYZE file (invalid '
+                         'sizeof_hdr: {})'.format(source, data[:4]))
+
+    if size == HEADER_SIZES[2]:
+        if len(data) < size:
+            raise ValueError('{} is not a NIFTI2 '
+                             'file (too short)'.format(source))
+        magic = bytes(data[4:8])
+        if   magic == b'n+2\0': ctr = nib.nifti2.Nifti2Header
+        elif magic == b'ni2\0': ctr = nib.nifti2.Nifti2PairHeader
+        else:
+            raise ValueError('{} is not a NIFTI2 file (invalid '
+                             'magic: {})'.format(source, magic))
+
+    else:
+        magic = bytes(data[344:348])
+        if   magic == b'n+1\0': ctr = nib.nifti1.Nifti1Header
+        elif magic == b'ni1\0': ctr = nib.nifti1.Nifti1PairHeader
+
+        # nibabel loads ANALYZE images as SPM2
+        # ANALYZE, which uses the origin field
+        # when generating the affine.
+        else: ctr = nib.spm2analyze.Spm2AnalyzeHeader
+
+    return ctr(binaryblock=bytes(data[:size]), endianness=endian, check=False)
+
+
+def readHeaders(filenames, nthreads=None):
+    """Reads the headers of all of the given image files, on a pool of
+    threads. See :func:`readHeader`.
+
+    If any file cannot be read, the first error is raised.
+
+    :arg filenames: Sequence of image file names.
+    :arg nthreads:  Number of threads to use. Defaults to the number of CPUs.
+    :returns:       A list containing a ``nibabel`` header object for each
+                    file.
+    """
+
+    if nthreads is None:
+        nthreads = os.cpu_count() or 1
+
+    with futures.ThreadPoolExecutor(nthreads) as pool:
+        return list(pool.map(readHeader, filenames))
+
+
+def readBytes(filename, nbytes):
+    """Reads up to ``nbytes`` bytes from the start of ``filename``. If the
+    file is ``gzip``-compressed, the bytes are decompressed, and only as
+    much of the file as is needed is read.
+
+    :returns: A ``bytes`` object containing at most ``nbytes`` bytes.
+    """
+
+    with open(filename, 'rb') as f:
+
+        if f.read(2) != b'\x1f\x8b':
+            f.seek(0)
+            return f.read(nbytes)
+
+        f.seek(0)
+
+        # 16 + MAX_WBITS tells zlib to
+        # expect a gzip header/trailer
+        decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data   = b''
+
+        while len(data) < nbytes:
+
+            if decomp.unconsumed_tail: chunk = decomp.unconsumed_tail
+            else:                      chunk = f.read(16384)
+
+            if len(chunk) == 0 or decomp.eof:
+                break
+
+            data += decomp.decompress(chunk, nbytes - len(data))
+
+        return data
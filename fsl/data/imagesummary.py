@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+#
+# imagesummary.py - The ImageSummary class.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module provides the :class:`ImageSummary` class, which can be used
+to calculate summary statistics (minimum, maximum, mean, and number of
+finite voxels) for arbitrary sub-regions of an :class:`.Image`, without
+having to read and reduce all of the voxels within the region.
+
+
+The image is divided into fixed-size blocks, and the statistics for each
+block are calculated up front. These per-block statistics form the first
+level of a *pyramid* - each subsequent level is created by combining the
+statistics of neighbouring ``2 x 2 x ...`` blocks from the level below,
+until the top level consists of a single block which covers the entire
+image. A region query is answered by descending the pyramid, using the
+statistics of any block which lies completely within the region, and only
+descending into blocks which lie partially within the region. Only voxels
+which lie within blocks on the region boundary (at the first level) need to
+be read from the image - and even this is optional.
+
+
+An ``ImageSummary`` listens for changes to the :class:`.Image` data, and
+updates the blocks which are affected by any change, along with their
+ancestors in the pyramid. It can also be saved to and loaded from file.
+
+
+Statistics are calculated on finite values only - ``nan`` and ``inf``
+values are ignored, in the same way as in the :class:`.ImageWrapper` data
+range calculation. Structured (e.g. RGB) images are not supported.
+"""
+
+
+import              logging
+import itertools as it
+
+import numpy     as np
+
+import fsl.data.image        as fslimage
+import fsl.data.imagewrapper as imagewrapper
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_BLOCK_SIZE = 16
+"""Default block size along the first three (spatial) dimensions of an image.
+The default block size along all other dimensions is 1.
+"""
+
+
+class ImageSummary(object):
+    """The ``ImageSummary`` class maintains a pyramid of per-block
+    minimum/maximum/sum/count statistics for an :class:`.Image`, which can be
+    used to query statistics on arbitrary sub-regions of the image.
+
+    The :meth:`query`, :meth:`range`, :meth:`mean` and :meth:`count` methods
+    accept regions in the same form that would be used to index the
+    ``Image``, e.g.::
+
+        summary = ImageSummary(image)
+        summary.range(np.s_[10:20, :, 5:15])
+        summary.mean( np.s_[..., 0])
+
+    By default, regions are answered exactly, by reading the voxels in
+    those blocks which lie on the boundary of the region.  Pass
+    ``exact=False`` to answer a query without reading any voxels - the
+    result will then be calculated over all blocks which intersect the
+    region.
+    """
+
+
+    def __init__(self, image, blockShape=None, filename=None):
+        """Create an ``ImageSummary``.
+
+        :arg image:      The :class:`.Image`.
+
+        :arg blockShape: Size of a block along each image dimension. May be a
+                         single integer, which is applied to the first three
+                         dimensions. Defaults to :data:`DEFAULT_BLOCK_SIZE`.
+
+        :arg filename:   File to load the summary from (see :meth:`save`).
+                         If not provided, the summary is calculated from the
+                         image data.
+        """
+
+        if len(image.dtype) > 0:
+            raise ValueError('ImageSummary does not support '
+                             'structured data ({})'.format(image.dtype))
+
+        shape = tuple(image.shape)
+        ndims = len(shape)
+
+        if blockShape is None:
+            blockShape = DEFAULT_BLOCK_SIZE
+        if np.isscalar(blockShape):
+            blockShape = [blockShape] * 3 + [1] * (ndims - 3)
+
+        blockShape = tuple(int(b) for b in blockShape)
+
+        if len(blockShape) != ndims or any(b < 1 for b in blockShape):
+            raise ValueError('Invalid block shape for image of shape {}: '
+                             '{}'.format(shape, blockShape))
+
+        self.__image      = image
+        self.__name       = '{}_{}'.format(type(self).__name__, id(self))
+        self.__shape      = shape
+        self.__blockShape = blockShape
+
+        # Each level is a list containing
+        # [min, max, sum, count] arrays,
+        # with level 0 containing the
+        # statistics for each block.
+        self.__levels = []
+
+        if filename is None: self.__build()
+        else:                self.__load(filename)
+
+        image.register(self.__name, self.__dataChanged, topic='data')
+
+
+    def destroy(self):
+        """Must be called when this ``ImageSummary`` is no longer needed.
+        Deregisters from the :class:`.Image`.
+        """
+        if self.__image is not None:
+            self.__image.deregister(self.__name, topic='data')
+        self.__image = None
+
+
+    @property
+    def image(self):
+        """Returns the :class:`.Image` associated with this ``ImageSummary``.
+        """
+        return self.__image
+
+
+    @property
+    def blockShape(self):
+        """Returns the block shape. """
+        return self.__blockShape
+
+
+    @property
+    def nlevels(self):
+        """Returns the number of levels in the summary pyramid. """
+        return len(self.__levels)
+
+
+    def blocks(self, level=0):
+        """Returns the ``(min, max, sum, count)`` arrays for the given level
+        of the summary pyramid.
+        """
+        return tuple(np.array(a) for a in self.__levels[level])
+
+
+    def query(self, region=None, exact=True):
+        """Calculate summary statistics on the given region.
+
+        :arg region: Something which can be used to slice the image (but
+                     not a boolean mask, or a slice with a step). If
+                     ``None``, statistics are calculated over the entire
+                     image.
+
+        :arg exact:  If ``True`` (the default), the statistics are exact,
+                     and voxels within blocks which lie on the region
+                     boundary are read from the image. Otherwise no voxels
+                     are read, and the statistics are calculated over all
+                     blocks which intersect the region.
+
+        :returns:    A tuple containing the minimum, maximum, sum and
+                     number of finite voxels in the region. The minimum
+                     and maximum are ``nan`` if the region does not contain
+                     any finite values.
+        """
+
+        if region is None:
+            region = slice(None)
+
+        region = self.__regionBounds(region)
+        result = [np.nan, np.nan, 0.0, 0]
+        top    = len(self.__levels) - 1
+
+        self.__visit(top, (0,) * len(self.__shape), region, exact, result)
+
+        return tuple(result)
+
+
+    def range(self, region=None, exact=True):
+        """Returns the ``(min, max)`` of the given region. See :meth:`query`.
+        """
+        return self.query(region, exact)[:2]
+
+
+    def mean(self, region=None, exact=True):
+        """Returns the mean of finite values in the given region. See
+        :meth:`query`.
+        """
+        _, _, total, count = self.query(region, exact)
+        if count == 0:
+            return np.nan
+        return total / count
+
+
+    def count(self, region=None, exact=True):
+        """Returns the number of finite values in the given region. See
+        :meth:`query`.
+        """
+        return self.query(region, exact)[3]
+
+
+    def save(self, filename):
+        """Saves this ``ImageSummary`` to a ``.npz`` file, from which it can
+        be re-loaded by passing the file name to :meth:`__init__`.
+        """
+        arrays = {'shape'      : np.array(self.__shape),
+                  'blockShape' : np.array(self.__blockShape)}
+        for i, level in enumerate(self.__levels):
+            for name, arr in zip(('min', 'max', 'sum', 'count'), level):
+                arrays['{}_{}'.format(name, i)] = arr
+        np.savez(filename, **arrays)
+
+
+    def __load(self, filename):
+        """Loads the summary from a file created by :meth:`save`. A
+        ``ValueError`` is raised if the file does not match the image.
+        """
+
+        with np.load(filename) as f:
+
+            shape      = tuple(f['shape'])
+            blockShape = tuple(f['blockShape'])
+
+            if shape != self.__shape or blockShape != self.__blockShape:
+                raise ValueError('{} does not match image (shape: {}, block '
+                                 'shape {})'.format(filename,
+                                                    self.__shape,
+                                                    self.__blockShape))
+
+            levels = []
+            for i in it.count():
+                if 'min_{}'.format(i) not in f:
+                    break
+                levels.append([f['{}_{}'.format(n, i)]
+                               for n in ('min', 'max', 'sum', 'count')])
+
+        self.__levels = levels
+
+
+    def __build(self):
+        """Calculates the per-block statistics from the image data, and then
+        builds the summary pyramid.
+        """
+
+        shape   = self.__shape
+        bshape  = self.__blockShape
+        nblocks = [int(np.ceil(s / b)) for s, b in zip(shape, bshape)]
+
+        mins   = np.full(nblocks, np.nan)
+        maxs   = np.full(nblocks, np.nan)
+        sums   = np.zeros(nblocks)
+        counts = np.zeros(nblocks, dtype=np.int64)
+
+        # The image is read in slabs along the
+        # last dimension, each of which contains
+        # a whole number of blocks. Statistics
+        # are calculated in double precision.
+        axis     = len(shape) - 1
+        slabSize = max(1, fslimage.DEFAULT_CHUNK_SIZE // (8 * bshape[axis] *
+                                                          np.prod(shape[:-1])))
+        slabSize = int(slabSize * bshape[axis])
+
+        for start in range(0, shape[axis], slabSize):
+            end   = min(start + slabSize, shape[axis])
+            slc   = (slice(None),) * axis + (slice(start, end),)
+            stats = blockStats(self.__image[slc], bshape)
+            bend  = int(np.ceil(end / bshape[axis]))
+            bslc  = (slice(None),) * axis + \
+                    (slice(start // bshape[axis], bend),)
+            mins[  bslc] = stats[0]
+            maxs[  bslc] = stats[1]
+            sums[  bslc] = stats[2]
+            counts[bslc] = stats[3]
+
+        self.__levels = [[mins, maxs, sums, counts]]
+
+        while any(s > 1 for s in self.__levels[-1][0].shape):
+            self.__levels.append(reduceBlocks(*self.__levels[-1]))
+
+        log.debug('Built summary for %s (%i levels, block shape %s)',
+                  self.__image.name, len(self.__levels), bshape)
+
+
+    def __regionBounds(self, sliceobj, strided=False):
+        """Converts ``sliceobj`` into a list of ``(low, high)`` voxel index
+        pairs, one for each image dimension.
+
+        :arg sliceobj: Something which can be used to slice the image.
+        :arg strided:  If ``True``, boolean masks and strided slices are
+                       accepted, and their bounding box is returned.
+                       Otherwise a ``ValueError`` is raised.
+        """
+
+        shape = self.__shape
+
+        # Boolean mask - use its bounding box
+        if imagewrapper.isValidFancySliceObj(sliceobj, shape):
+            if not strided:
+                raise ValueError('ImageSummary does not support '
+                                 'boolean mask queries')
+            coords = np.nonzero(sliceobj.reshape(shape))
+            if len(coords[0]) == 0:
+                return [(0, 0)] * len(shape)
+            return [(int(c.min()), int(c.max()) + 1) for c in coords]
+
+        sliceobj = imagewrapper.canonicalSliceObj(sliceobj, shape)
+        bounds   = []
+
+        for s, n in zip(sliceobj, shape):
+            if isinstance(s, slice):
+                if s.step not in (None, 1) and not strided:
+                    raise ValueError('ImageSummary does not support '
+                                     'strided queries')
+                idxs = range(*s.indices(n))
+                if len(idxs) == 0: bounds.append((0, 0))
+                else:              bounds.append((min(idxs), max(idxs) + 1))
+            else:
+                s = int(s) % n
+                bounds.append((s, s + 1))
+
+        return bounds
+
+
+    def __visit(self, level, idx, region, exact, result):
+        """Recursively accumulates statistics on ``region`` into ``result``,
+        starting from the block at the given ``level`` and index ``idx``.
+        """
+
+        extent = [b * 2 ** level for b in self.__blockShape]
+        blo    = [i * e for i, e in zip(idx, extent)]
+        bhi    = [min(s, (i + 1) * e)
+                  for i, e, s in zip(idx, extent, self.__shape)]
+        ilo    = [max(a, b) for a, b in zip(blo, [r[0] for r in region])]
+        ihi    = [min(a, b) for a, b in zip(bhi, [r[1] for r in region])]
+
+        # This block does not intersect the region
+        if any(lo >= hi for lo, hi in zip(ilo, ihi)):
+            return
+
+        contained = ilo == blo and ihi == bhi
+
+        if contained or (level == 0 and not exact):
+            stats = [a[idx] for a in self.__levels[level]]
+
+        # Block at the first level which lies
+        # on the region boundary - we have to
+        # read the voxels in the intersection.
+        elif level == 0:
+            slc   = tuple(slice(lo, hi) for lo, hi in zip(ilo, ihi))
+            data  = np.asanyarray(self.__image[slc])
+            stats = [a.item() for a in
+                     blockStats(data.reshape([hi - lo for lo, hi in
+                                              zip(ilo, ihi)]),
+                                [hi - lo for lo, hi in zip(ilo, ihi)])]
+
+        # Block which lies partially within the
+        # region - descend to the next level.
+        else:
+            below = self.__levels[level - 1][0].shape
+            for offset in it.product((0, 1), repeat=len(idx)):
+                child = tuple(2 * i + o for i, o in zip(idx, offset))
+                if all(c < s for c, s in zip(child, below)):
+                    self.__visit(level - 1, child, region, exact, result)
+            return
+
+        result[0]  = np.fmin(result[0], stats[0])
+        result[1]  = np.fmax(result[1], stats[1])
+        result[2] += stats[2]
+        result[3] += int(stats[3])
+
+
+    def __dataChanged(self, image, topic, sliceobj):
+        """Called when the :class:`.Image` data changes. Re-calculates the
+        statistics for all blocks which intersect the changed region, and
+        their ancestors.
+        """
+
+        bshape = self.__blockShape
+        region = self.__regionBounds(sliceobj, strided=True)
+
+        if any(lo >= hi for lo, hi in region):
+            return
+
+        # Round the region out to block boundaries
+        blo    = [lo // b              for (lo, _), b in zip(region, bshape)]
+        bhi    = [int(np.ceil(hi / b)) for (_, hi), b in zip(region, bshape)]
+        vlo    = [lo * b for lo, b in zip(blo, bshape)]
+        vhi    = [min(hi * b, s)
+                  for hi, b, s in zip(bhi, bshape, self.__shape)]
+        vslc   = tuple(slice(lo, hi) for lo, hi in zip(vlo, vhi))
+        bslc   = tuple(slice(lo, hi) for lo, hi in zip(blo, bhi))
+        data   = np.asanyarray(self.__image[vslc])
+        data   = data.reshape([hi - lo for lo, hi in zip(vlo, vhi)])
+        stats  = blockStats(data, bshape)
+
+        for arr, stat in zip(self.__levels[0], stats):
+            arr[bslc] = stat
+
+        # Propagate the changes up the pyramid
+        for level in range(1, len(self.__levels)):
+
+            blo   = [lo // 2              for lo in blo]
+            bhi   = [int(np.ceil(hi / 2)) for hi in bhi]
+            cslc  = tuple(slice(2 * lo, 2 * hi) for lo, hi in zip(blo, bhi))
+            bslc  = tuple(slice(lo, hi)         for lo, hi in zip(blo, bhi))
+            below = [a[cslc] for a in self.__levels[level - 1]]
+            stats = reduceBlocks(*below)
+
+            for arr, stat in zip(self.__levels[level], stats):
+                arr[bslc] = stat
+
+
+def blockStats(data, blockShape):
+    """Calculates the minimum, maximum, sum, and number of finite values in
+    each block of ``data``. The last block along each dimension may be
+    smaller than ``blockShape``.
+
+    :arg data:       ``numpy`` array
+    :arg blockShape: Block size along each dimension of ``data``.
+    :returns:        A tuple containing ``(min, max, sum, count)`` arrays,
+                     each with one value per block.
+    """
+
+    data    = np.asarray(data, dtype=np.float64)
+    nblocks = [int(np.ceil(s / b)) for s, b in zip(data.shape, blockShape)]
+    padded  = [n * b for n, b in zip(nblocks, blockShape)]
+
+    if list(data.shape) != padded:
+        data = np.pad(data,
+                      [(0, p - s) for p, s in zip(padded, data.shape)],
+                      constant_values=np.nan)
+
+    # Interleave the number of blocks and
+    # block size along each dimension, so
+    # we can reduce over the block axes.
+    data   = data.reshape(list(it.chain(*zip(nblocks, blockShape))))
+    axes   = tuple(range(1, 2 * len(nblocks), 2))
+    finite = np.isfinite(data)
+    vals   = np.where(finite, data, np.nan)
+
+    return (np.fmin.reduce(vals, axis=axes),
+            np.fmax.reduce(vals, axis=axes),
+            np.where(finite, data, 0).sum(axis=axes),
+            finite.sum(axis=axes, dtype=np.int64))
+
+
+def reduceBlocks(mins, maxs, sums, counts):
+    """Combines neighbouring ``2 x 2 x ...`` blocks of the given statistics
+    arrays, as created by :func:`blockStats`.
+
+    :returns: A tuple containing ``(min, max, sum, count)`` arrays, each
+              half the size (rounded up) of the inputs along each dimension.
+    """
+
+    shape  = mins.shape
+    nnew   = [int(np.ceil(s / 2)) for s in shape]
+    pad    = [(0, 2 * n - s) for n, s in zip(nnew, shape)]
+    newshp = list(it.chain(*zip(nnew, [2] * len(shape))))
+    axes   = tuple(range(1, 2 * len(shape), 2))
+
+    def prep(arr, fill):
+        if any(p[1] > 0 for p in pad):
+            arr = np.pad(arr, pad, constant_values=fill)
+        return arr.reshape(newshp)
+
+    return (np.fmin.reduce(prep(mins,   np.nan), axis=axes),
+            np.fmax.reduce(prep(maxs,   np.nan), axis=axes),
+            prep(sums,   0).sum(axis=axes),
+            prep(counts, 0).sum(axis=axes))
@@ -37,17 +37,27 @@ get their definitions straight:
 """
 
 
-import                    logging
-import                    collections
-import collections.abc as abc
-import itertools       as it
+import os.path            as op
+import                       os
+import                       logging
+import                       warnings
+import                       contextlib
+import                       threading
+import                       collections
+import collections.abc    as abc
+import concurrent.futures as futures
+import itertools          as it
 
 import numpy     as np
 import nibabel   as nib
 
-import fsl.utils.notifier    as notifier
-import fsl.utils.naninfrange as nir
-import fsl.utils.idle        as idle
+import fsl.utils.notifier     as notifier
+import fsl.utils.naninfrange  as nir
+import fsl.utils.idle         as idle
+import fsl.utils.cache        as cache
+import fsl.utils.weakfuncref  as weakfuncref
+import fsl.utils.deprecated   as deprecated
+import fsl.data.memorymanager as memorymanager
 
 
 log = logging.getLogger(__name__)
@@ -79,6 +89,92 @@ class ImageWrapper(notifier.Notifier):
     memory and accessed directly.
 
 
+    *Write-through mode*
+
+
+    If the image is stored in an uncompressed file, the ``writeThrough``
+    parameter to :meth:`__init__` may be used to access the image data
+    through a writable memory-map of the file (see the :class:`MemmapProxy`
+    class). In this mode, the image data is never loaded into memory - all
+    reads and writes go directly to the file, so modifying a small part of a
+    large image only costs the pages that are touched. Call :meth:`flush` to
+    make sure that all changes have been written to disk.
+
+
+    *Storage backends*
+
+
+    Write-through mode is implemented by a *backend* - an array-like object
+    to which all reads and writes are delegated. An alternative backend may
+    be passed to :meth:`__init__` via the ``backend`` argument (e.g. the
+    :class:`.ChunkedProxy`, for images stored in chunked HDF5 files). A
+    backend must provide:
+
+      - ``shape`` and ``ndim`` attributes
+      - ``__getitem__`` and ``__setitem__``, accepting anything that may be
+        used to slice a ``numpy`` array, and taking care of any scaling
+        parameters
+      - ``flush()``, which makes sure that all changes have been saved
+      - ``writeHeader(header)``, which saves the given ``nibabel`` header in
+        place
+      - ``close()``, which releases any resources (e.g. open files) held by
+        the backend - it will not be used again after this is called (see
+        :meth:`close`)
+
+
+    *Lazy scaling*
+
+
+    When the data of an image which has scaling parameters (e.g. ``int16``
+    data with ``scl_slope`` and ``scl_inter``) is loaded into memory,
+    ``nibabel`` returns the scaled data as a ``float64`` array, which uses
+    four times as much memory as the raw ``int16`` data. If the
+    ``lazyScaling`` option is used, the raw data is kept in memory instead,
+    and the scaling parameters are applied to the data as it is accessed.
+    Scaled data is returned as ``float32`` for 8 and 16 bit data, and as
+    ``float64`` otherwise. The data range is calculated from the raw data,
+    and then scaled.
+
+    The raw data cannot be modified without losing precision, so the first
+    time that the data is modified, all of the data is scaled, and lazy
+    scaling is disabled.
+
+
+    *Volume cache*
+
+
+    When the image data is not in memory, every read goes back to the file,
+    which can be expensive if the same parts of a compressed image are
+    read repeatedly. The ``volumeCache`` option may be used to keep the most
+    recently read volumes (for a 4D image, or slices for a 3D image) in a
+    :class:`.Cache`, with a limit on the total size of the cached data. When
+    a read touches a volume that is not in the cache, the whole volume is
+    read and stored, and older volumes are dropped if necessary. Reads which
+    span more volumes than will fit in the cache bypass it.
+
+    A :class:`.Cache` may be shared by many ``ImageWrapper`` instances,
+    giving a single limit for a group of images. The hit/miss statistics
+    are available through the :attr:`.Cache.hits` and :attr:`.Cache.misses`
+    properties of the :attr:`volumeCache`. Cached volumes are invalidated
+    whenever the image data is modified, or the image is replaced via
+    :meth:`setImage`.
+
+    .. note:: Cached volumes are marked as read-only, so data returned by
+              :meth:`__getitem__` may not be writable.
+
+
+    *Batch updates*
+
+
+    Every write via :meth:`__setitem__` normally updates the known data
+    range, which involves reading back the data that was written (and the
+    data that it replaces). When many small writes are made, this can cost
+    more than the writes themselves. Within a :meth:`batchUpdate` context,
+    the data range is not updated on each write - instead, the data range of
+    the smallest region which contains all of the writes is updated once,
+    when the context exits.
+
+
     *Image dimensionality*
 
 
@@ -138,13 +234,36 @@ class ImageWrapper(notifier.Notifier):
     .. autosummary::
        :nosignatures:
 
+       isSimpleSliceObj
        isValidFancySliceObj
        canonicalSliceObj
        sliceObjToSliceTuple
        sliceTupleToSliceObj
        sliceCovered
        calcExpansion
+       coverageGroups
        adjustCoverage
+
+
+    The :func:`chunkSlices` function is also provided, for splitting an image
+    into chunks which can be read (and included in the data range
+    calculation) one at a time.
+
+
+    The full image data range can be calculated at once via the
+    :meth:`calcRange` method, which calculates the range of each volume in
+    parallel, on a pool of threads.
+
+
+    If an ``ImageWrapper`` is created with ``threaded=True``, data range
+    updates are performed in the background, on a :class:`.TaskPool` which
+    is shared by all ``ImageWrapper`` instances (see :func:`rangeTaskPool`).
+    The tasks of each ``ImageWrapper`` are run one at a time, and in order,
+    and tasks which duplicate an already queued task are dropped. Images
+    which have listeners (e.g. an :class:`.Image` which is being displayed)
+    are given priority. The :meth:`waitUntilIdle` method and
+    :func:`waitUntilIdle` function can be used to wait for outstanding
+    updates to complete for one image, or for all images.
     """
 
 
@@ -153,7 +272,12 @@ class ImageWrapper(notifier.Notifier):
                  name=None,
                  loadData=False,
                  dataRange=None,
-                 threaded=False):
+                 threaded=False,
+                 writeThrough=False,
+                 backend=None,
+                 lazyScaling=False,
+                 volumeCache=None,
+                 priority=None):
         """Create an ``ImageWrapper``.
 
         :arg image:     A ``nibabel.Nifti1Image`` or ``nibabel.Nifti2Image``.
@@ -171,15 +295,48 @@ class ImageWrapper(notifier.Notifier):
                         important information about this parameter.
 
         :arg threaded:  If ``True``, the data range is updated on a
-                        :class:`.TaskThread`. Otherwise (the default), the
+                        shared :class:`.TaskPool` (see
+                        :func:`rangeTaskPool`). Otherwise (the default), the
                         data range is updated directly on reads/writes.
+
+        :arg writeThrough: If ``True``, the image data is accessed through a
+                        writable memory-map of the image file, and all
+                        modifications are written directly to the file. The
+                        ``loadData`` argument is ignored. Only supported for
+                        uncompressed image files - a ``ValueError`` is raised
+                        otherwise.
+
+        :arg backend:   An array-like object which provides read/write access
+                        to the image data (see the *Storage backends* section
+                        above). If provided, all data accesses go through the
+                        backend, as in write-through mode, and the
+                        ``loadData`` and ``writeThrough`` arguments are
+                        ignored.
+
+        :arg lazyScaling: If ``True``, and the image data has scaling
+                        parameters, the data is kept in memory in its raw
+                        (unscaled) form - see the *Lazy scaling* section
+                        above.
+
+        :arg volumeCache: Either a :class:`.Cache` in which image volumes are
+                        to be cached, or the maximum size, in bytes, of a
+                        cache to create. See the *Volume cache* section
+                        above.
+
+        :arg priority:  Only used if ``threaded=True``. A function which
+                        returns ``True`` if the data range updates of this
+                        ``ImageWrapper`` should be run before those of other
+                        images. Defaults to checking whether any listeners
+                        are registered with this ``ImageWrapper``. Only a
+                        weak reference to the function is kept.
         """
 
         import fsl.data.image as fslimage
 
-        self.__image      = image
-        self.__name       = name
-        self.__taskThread = None
+        self.__image    = image
+        self.__name     = name
+        self.__taskPool = None
+        self.__priority = None
 
         # Save the number of 'real' dimensions,
         # that is the number of dimensions minus
@@ -217,37 +374,128 @@ class ImageWrapper(notifier.Notifier):
 
         self.reset(dataRange)
 
-        # We keep an internal ref to
-        # the data numpy array if/when
-        # it is loaded in memory
-        self.__data = None
-        if loadData or image.in_memory:
+        # We keep an internal ref to the
+        # data numpy array if/when it is
+        # loaded in memory, as a tuple of
+        # (data, scaling), where scaling
+        # is a (slope, inter, dtype) tuple
+        # if the data is being stored in
+        # memory unscaled (see loadData),
+        # or None otherwise. The data and
+        # its scaling parameters are kept
+        # in a single attribute, so they
+        # can be read atomically by threads
+        # which may race with unloadData.
+        self.__data     = None
+        self.__backend  = None
+        self.__modified = False
+        self.__pinned   = False
+
+        # Held while the in-memory data is
+        # being loaded, unloaded, or marked
+        # as modified
+        self.__dataLock = threading.RLock()
+
+        self.__lazyScaling = lazyScaling
+
+        # Used by batchUpdate - the number
+        # of nested batchUpdate contexts, and
+        # the region that has been written
+        # within them, as (low, high) tuples.
+        self.__batchDepth  = 0
+        self.__batchSlices = None
+
+        # Cached volumes are stored with
+        # a key of (cacheToken, volume),
+        # so that a cache can be shared
+        if volumeCache is not None and \
+           not isinstance(volumeCache, cache.Cache):
+            volumeCache = cache.Cache(maxsize=None,
+                                      lru=True,
+                                      maxbytes=volumeCache)
+        self.__volumeCache = volumeCache
+        self.__cacheToken  = object()
+
+        if backend is not None:
+            self.__backend = backend
+        elif writeThrough:
+            self.__backend = MemmapProxy(image)
+        elif loadData or image.in_memory:
             self.loadData()
 
         if threaded:
-            self.__taskThread = idle.TaskThread()
-            self.__taskThread.daemon = True
-            self.__taskThread.start()
+            self.__taskPool = rangeTaskPool()
+            if priority is not None:
+                self.__priority = weakfuncref.WeakFunctionRef(priority)
 
 
     def __del__(self):
+        """Clears some internal references. """
+        self.__image   = None
+        self.__data    = None
+        self.__backend = None
+
+
+    def getTaskPool(self):
         """If this ``ImageWrapper`` was created with ``threaded=True``,
-        the :class:`.TaskThread` is stopped.
+        this method returns the :class:`.TaskPool` that is used for running
+        data range calculation tasks. Otherwise, this method returns
+        ``None``.
         """
-        self.__image = None
-        self.__data  = None
-        if self.__taskThread is not None:
-            self.__taskThread.stop()
-            self.__taskThread = None
+        return self.__taskPool
 
 
+    @deprecated.deprecated('3.5.0', '4.0.0', 'Use getTaskPool instead')
     def getTaskThread(self):
+        """Deprecated - use :meth:`getTaskPool` instead.
+
+        If this ``ImageWrapper`` was created with ``threaded=True``, returns
+        a :class:`.TaskPoolOwner`, which provides a :class:`.TaskThread`-like
+        interface to the tasks of this ``ImageWrapper``. Otherwise returns
+        ``None``.
+        """
+        if self.__taskPool is None:
+            return None
+        return idle.TaskPoolOwner(self.__taskPool,
+                                  id(self),
+                                  priority=self.__hasPriority)
+
+
+    def waitUntilIdle(self, timeout=None):
         """If this ``ImageWrapper`` was created with ``threaded=True``,
-        this method returns the ``TaskThread`` that is used for running
-        data range calculation tasks. Otherwise, this method returns
-        ``False``.
+        blocks until all outstanding data range updates for this
+        ``ImageWrapper`` have completed. Otherwise returns immediately.
+
+        :arg timeout: Maximum number of seconds to wait.
+        :returns:     ``True`` if the updates completed, ``False`` if the
+                      ``timeout`` elapsed.
+        """
+        if self.__taskPool is None:
+            return True
+        return self.__taskPool.waitUntilIdle(id(self), timeout)
+
+
+    def __hasPriority(self):
+        """Used by the :class:`.TaskPool` (if ``threaded=True``) to decide
+        whether the data range updates of this ``ImageWrapper`` should be
+        prioritised. See the ``priority`` argument to :meth:`__init__`.
         """
-        return self.__taskThread
+        if self.__priority is None:
+            return self.hasListeners()
+
+        priority = self.__priority.function()
+        return priority is not None and priority()
+
+
+    def __enqueue(self, func, *args, **kwargs):
+        """Enqueues a data range update task on the :class:`.TaskPool`.
+        All arguments are passed through to :meth:`.TaskPool.enqueue`.
+        """
+        self.__taskPool.enqueue(id(self),
+                                func,
+                                *args,
+                                priority=self.__hasPriority,
+                                **kwargs)
 
 
     def reset(self, dataRange=None):
@@ -377,18 +625,463 @@ class ImageWrapper(notifier.Notifier):
         return np.array(self.__coverage[..., vol])
 
 
+    @property
+    def writeThrough(self):
+        """Returns ``True`` if this ``ImageWrapper`` is accessing the image
+        data through a writable memory-map or other backend, ``False``
+        otherwise.
+        """
+        return self.__backend is not None
+
+
+    @property
+    def backend(self):
+        """Returns the backend used to access the image data in write-through
+        mode, or ``None`` if this ``ImageWrapper`` is not in write-through
+        mode.
+        """
+        return self.__backend
+
+
+    @property
+    def inMemory(self):
+        """Returns ``True`` if the image data has been loaded into memory,
+        ``False`` otherwise.
+        """
+        return self.__data is not None
+
+
+    def __inMemoryData(self):
+        """Returns a tuple containing the in-memory data array and its
+        scaling parameters (see :meth:`loadData`), or ``(None, None)`` if
+        the data is not in memory. Other threads may unload the data at
+        any time, so the data and its scaling parameters must always be
+        retrieved together via this method.
+        """
+        loaded = self.__data
+        if loaded is None: return None, None
+        else:              return loaded
+
+
+    @property
+    def name(self):
+        """Returns the name of this ``ImageWrapper``. """
+        return self.__name
+
+
+    @property
+    def residentBytes(self):
+        """Returns the number of bytes of image data that this
+        ``ImageWrapper`` has loaded into memory.
+        """
+        data, _ = self.__inMemoryData()
+        if data is None: return 0
+        else:            return data.nbytes
+
+
+    @property
+    def modified(self):
+        """Returns ``True`` if the image data has been modified since it
+        was loaded, ``False`` otherwise.
+        """
+        return self.__modified
+
+
+    @property
+    def pinned(self):
+        """Returns ``True`` if the image data has been pinned in memory (see
+        :meth:`pinData`), ``False`` otherwise.
+        """
+        return self.__pinned
+
+
+    def pinData(self):
+        """Loads the image data into memory (see :meth:`loadData`), and
+        prevents it from being unloaded by :meth:`unloadData`.
+
+        This must be called before a view of the in-memory data is handed
+        out (e.g. by :attr:`.Image.data`), as the view may be used to modify
+        the data - such modifications would be lost if the data were
+        unloaded and then re-read from file. The data remains pinned for the
+        lifetime of this ``ImageWrapper``.
+        """
+        with self.__dataLock:
+            self.__pinned = True
+        self.loadData()
+
+
+    def unloadData(self):
+        """Unloads the image data from memory, if possible. The data will be
+        read from file when it is next accessed, and the known data range and
+        coverage are retained. This is used by the :mod:`.memorymanager`.
+
+        The data is only unloaded if it has not been modified or pinned (see
+        :meth:`pinData`), and it can be re-read from file (i.e. the
+        ``nibabel`` image data is accessed through an array proxy). This method may be called from another thread while
+        the data is being accessed - readers always see the in-memory data
+        and its lazy scaling parameters together, or neither.
+
+        :returns: ``True`` if the data was unloaded, ``False`` otherwise.
+        """
+
+        with self.__dataLock:
+            if self.__data is None            or \
+               self.__backend is not None     or \
+               self.__modified                or \
+               self.__pinned                  or \
+               not nib.is_proxy(self.__image.dataobj):
+                return False
+
+            log.debug('Unloading image data for %s', self.__name)
+
+            self.__data = None
+
+        return True
+
+
+    @property
+    def volumeCache(self):
+        """Returns the :class:`.Cache` used to store image volumes, or
+        ``None`` if volumes are not being cached. See the *Volume cache*
+        section above.
+        """
+        return self.__volumeCache
+
+
+    def clearVolumeCache(self, vols=None):
+        """Removes volumes of this image from the :attr:`volumeCache`.
+
+        :arg vols: Sequence of volume indices to remove. If ``None`` (the
+                   default), all volumes are removed.
+        """
+
+        if self.__volumeCache is None:
+            return
+
+        if vols is None:
+            vols = range(self.__image.shape[self.__numRealDims - 1])
+
+        for vol in vols:
+            self.__volumeCache.pop((self.__cacheToken, vol))
+
+
+    @contextlib.contextmanager
+    def batchUpdate(self):
+        """Context manager which defers data range updates for writes made
+        via :meth:`__setitem__`, until the context exits. See the *Batch
+        updates* section above. Contexts may be nested - the data range is
+        updated when the outermost context exits.
+
+        .. note:: The :attr:`dataRange` may be out of date until the context
+                  exits.
+        """
+
+        self.__batchDepth += 1
+
+        try:
+            yield
+
+        finally:
+            self.__batchDepth -= 1
+
+            if self.__batchDepth == 0 and self.__batchSlices is not None:
+                slices             = self.__batchSlices
+                self.__batchSlices = None
+                self.__updateDataRangeOnWrite(slices)
+
+
+    def setImage(self, image):
+        """Replaces the ``nibabel`` image managed by this ``ImageWrapper``.
+
+        This is intended for use after the image has been saved to a new
+        file (see :meth:`.Image.save`). The new image must contain the same
+        data as the old image - the known data range and coverage are
+        retained. If the data has been loaded into memory, the in-memory data
+        is retained; otherwise the data will be accessed through the new
+        image.
+
+        :arg image: A ``nibabel`` image with the same (canonical) shape as
+                    the current image.
+
+        .. note:: This method cannot be used in write-through mode - a
+                  ``ValueError`` is raised.
+        """
+
+        import fsl.data.image as fslimage
+
+        if self.__backend is not None:
+            raise ValueError('The image cannot be replaced '
+                             'in write-through mode')
+
+        if fslimage.canonicalShape(image.shape) != self.__canonicalShape:
+            raise ValueError('Image shape does not match: {} != {}'.format(
+                image.shape, self.__image.shape))
+
+        numRealDims = len(image.shape)
+        for d in reversed(image.shape):
+            if d == 1: numRealDims -= 1
+            else:      break
+        if numRealDims < 3:
+            numRealDims = min(3, len(image.shape))
+
+        self.clearVolumeCache()
+
+        # The image now contains the same
+        # data as we do, so our data is no
+        # longer considered to be modified
+        self.__image      = image
+        self.__numPadDims = len(image.shape) - numRealDims
+        self.__modified   = False
+
+        with self.__dataLock:
+            if self.__data is not None:
+                data, scaling = self.__data
+                self.__data   = (data.reshape(image.shape), scaling)
+
+        # The coverage is stored per-volume along
+        # the last real dimension - if that has
+        # changed (only possible for degenerate
+        # images with less than three dimensions),
+        # we have to start again.
+        if numRealDims != self.__numRealDims:
+            self.__numRealDims = numRealDims
+            self.reset(self.__range)
+
+
     def loadData(self):
         """Forces all of the image data to be loaded into memory.
 
         .. note:: This method will be called by :meth:`__init__` if its
                   ``loadData`` parameter is ``True``. It will also be called
-                  on all write operations (see :meth:`__setitem__`).
+                  on all write operations (see :meth:`__setitem__`). It has
+                  no effect in write-through mode, as the data is already
+                  accessible through the memory-map.
         """
-        if self.__data is None:
-            self.__data = np.asanyarray(self.__image.dataobj)
+        with self.__dataLock:
+
+            if self.__data is not None or self.__backend is not None:
+                return
+
+            # Cached volumes are not used
+            # once the data is in memory
+            self.clearVolumeCache()
+
+            dataobj = self.__image.dataobj
+
+            if self.__lazyScaling and isScaledProxy(dataobj):
+                data    = np.asanyarray(dataobj.get_unscaled())
+                scaling = (float(dataobj.slope),
+                           float(dataobj.inter),
+                           scaledType(data.dtype))
+            else:
+                data    = np.asanyarray(dataobj)
+                scaling = None
+
+            self.__data = (data, scaling)
+
+        # Let the memory manager know that
+        # we have loaded the data, in case
+        # it needs to unload other images.
+        # This must be done without holding
+        # our lock, as the manager may call
+        # unloadData from another thread.
+        manager = memorymanager.getManager()
+        if manager is not None:
+            manager.loaded(self)
+
+
+    @property
+    def lazyScaling(self):
+        """Returns ``True`` if the image data is held in memory in its raw
+        form, and is scaled on access (see the *Lazy scaling* section above).
+        """
+        _, scaling = self.__inMemoryData()
+        return scaling is not None
+
+
+    def __scale(self, data, scaling):
+        """Applies the given scaling parameters to ``data``, if the data is
+        being lazily scaled. The data is scaled in chunks, so no ``float64``
+        temporary arrays are created.
+
+        :arg data:    Raw data
+        :arg scaling: ``(slope, inter, dtype)`` tuple, as returned by
+                      :meth:`__inMemoryData`, or ``None``.
+        """
+
+        if scaling is None:
+            return data
+
+        import fsl.data.image as fslimage
+
+        slope, inter, dtype = scaling
+
+        data   = np.asanyarray(data)
+        scaled = np.empty(data.shape, dtype=dtype)
+
+        if data.ndim == 0:
+            slices = [Ellipsis]
+        else:
+            slices = chunkSlices(data.shape,
+                                 -1,
+                                 fslimage.DEFAULT_CHUNK_SIZE,
+                                 dtype.itemsize)
+
+        for slc in slices:
+            out = scaled[slc]
+            np.multiply(data[slc], slope, out=out, dtype=dtype)
+            np.add(out, inter, out=out, dtype=dtype)
+
+        return scaled
+
+
+    def __scaleRanges(self, ranges, scaling):
+        """Applies the given scaling parameters to a ``(nvols, 2)`` array of
+        ``(min, max)`` ranges, calculated from the raw data, if it is being
+        lazily scaled.
+        """
+        if scaling is None:
+            return ranges
+        ranges = self.__scale(ranges, scaling)
+        if scaling[0] < 0:
+            ranges = ranges[:, ::-1]
+        return ranges
+
+
+    def flush(self):
+        """In write-through mode, makes sure that all changes to the image
+        data have been written to disk. Otherwise does nothing.
+        """
+        if self.__backend is not None:
+            self.__backend.flush()
+
+
+    def close(self):
+        """Waits for any outstanding data range updates to complete and, in
+        write-through mode, flushes and closes the backend, releasing any
+        files that it holds open. This ``ImageWrapper`` must not be used to
+        access the image data after this method has been called.
+        """
+        self.waitUntilIdle()
+        if self.__backend is not None:
+            self.__backend.flush()
+            self.__backend.close()
+
+
+    def maskedData(self, mask, nbytes=None):
+        """Returns the image data within the given boolean ``mask``.
+
+        The ``mask`` may have fewer dimensions than the image, in which case
+        it is applied to the leading image dimensions - for example, a 3D
+        mask may be applied to a 4D image, to extract the time series of
+        every voxel within the mask.
+
+        If the image data is not in memory, it is read in slabs, and only
+        the part of each slab which is within the bounding box of the mask
+        is read - see the :func:`maskedData` function. The known data range
+        is not updated.
+
+        :arg mask:   Boolean ``numpy`` array, with the same shape as the
+                     leading dimensions of the image.
+        :arg nbytes: Maximum number of bytes to read at a time. Defaults to
+                     :data:`.image.DEFAULT_CHUNK_SIZE`.
+        :returns:    A ``numpy`` array of shape ``(nvoxels, ...)``, where
+                     ``nvoxels`` is the number of voxels in the mask, and
+                     the remaining dimensions are the image dimensions not
+                     covered by the mask.
+        """
+
+        import fsl.data.image as fslimage
+
+        if nbytes is None:
+            nbytes = fslimage.DEFAULT_CHUNK_SIZE
+
+        shape     = self.__canonicalShape
+        realShape = self.__image.shape
+        mask      = np.asarray(mask, dtype=bool)
+
+        if tuple(mask.shape) != tuple(shape[:mask.ndim]):
+            raise ValueError('Mask shape {} does not match image shape '
+                             '{}'.format(mask.shape, shape))
+
+        # The canonical shape (e.g. (X, Y, 1)) may
+        # differ from the real shape (e.g. (X, Y)),
+        # or the image may have trailing padding
+        # dimensions (e.g. (X, Y, Z, 1)).
+        outShape = tuple(shape[mask.ndim:])
+        while mask.ndim > len(realShape) and mask.shape[-1] == 1:
+            mask = mask[..., 0]
+
+        data, scaling = self.__inMemoryData()
+        if data is not None:
+            data = self.__scale(data[mask], scaling)
+        else:
+            if self.__backend is not None: dataobj = self.__backend
+            else:                          dataobj = self.__image.dataobj
+            data = maskedData(dataobj,
+                              mask,
+                              nbytes,
+                              self.__image.get_data_dtype().itemsize)
+
+        return data.reshape((data.shape[0],) + outShape)
+
+
+    def voxelData(self, coords, nbytes=None):
+        """Returns the image data at the given voxel coordinates.
+
+        If the image data is not in memory, it is read in slabs - see the
+        :func:`voxelData` function. The known data range is not updated.
+
+        :arg coords: Sequence of integer ``numpy`` arrays, one for each of
+                     the leading image dimensions (e.g. three arrays
+                     containing the X, Y, and Z voxel coordinates).
+        :arg nbytes: Maximum number of bytes to read at a time. Defaults to
+                     :data:`.image.DEFAULT_CHUNK_SIZE`.
+        :returns:    A ``numpy`` array of shape ``(nvoxels, ...)``, where the
+                     remaining dimensions are the image dimensions not
+                     covered by ``coords``.
+        """
+
+        import fsl.data.image as fslimage
+
+        if nbytes is None:
+            nbytes = fslimage.DEFAULT_CHUNK_SIZE
+
+        shape     = self.__canonicalShape
+        realShape = self.__image.shape
+        coords    = [np.asarray(c, dtype=np.intp) for c in coords]
+        outShape  = tuple(shape[len(coords):])
+
+        if len(coords) > len(shape):
+            raise ValueError('Too many coordinates ({}) for image shape '
+                             '{}'.format(len(coords), shape))
+
+        for c, s in zip(coords, shape):
+            if np.any((c < 0) | (c >= s)):
+                raise IndexError('Voxel coordinates out of bounds for '
+                                 'image shape {}'.format(shape))
+
+        # Coordinates for dimensions which are
+        # in the canonical shape, but not in the
+        # real shape, (e.g. the Z axis of a 2D
+        # image) will all be 0.
+        coords = coords[:max(1, min(len(coords), len(realShape)))]
+
+        data, scaling = self.__inMemoryData()
+        if data is not None:
+            data = self.__scale(data[tuple(coords)], scaling)
+        else:
+            if self.__backend is not None: dataobj = self.__backend
+            else:                          dataobj = self.__image.dataobj
+            data = voxelData(dataobj,
+                             coords,
+                             nbytes,
+                             self.__image.get_data_dtype().itemsize)
+
+        return data.reshape((data.shape[0],) + outShape)
 
 
-    def __getData(self, sliceobj, isTuple=False):
+    def __getData(self, sliceobj, isTuple=False, raw=False, cached=True):
         """Retrieves the image data at the location specified by ``sliceobj``.
 
         :arg sliceobj: Something which can be used to slice an array, or
@@ -396,26 +1089,125 @@ class ImageWrapper(notifier.Notifier):
 
         :arg isTuple:  Set to ``True`` if ``sliceobj`` is a sequence of
                        (low, high) index pairs.
+
+        :arg raw:      If ``True``, a ``(data, scaling)`` tuple is returned.
+                       If the data is being lazily scaled, ``data`` is the
+                       raw data, and ``scaling`` contains the parameters
+                       which need to be applied to it (see :meth:`__scale`).
+                       Otherwise ``scaling`` is ``None``.
+
+        :arg cached:   If ``False``, the :attr:`volumeCache` is not used.
         """
 
         if isTuple:
             sliceobj = sliceTupleToSliceObj(sliceobj)
 
+        if raw:
+            data, scaling = self.__inMemoryData()
+            if data is not None:
+                return data[sliceobj], scaling
+            return self.__getData(sliceobj, cached=cached), None
+
         # If the image has not been loaded
         # into memory, we can use the nibabel
-        # ArrayProxy. Otheriwse if it is in
+        # ArrayProxy (or the write-through
+        # backend). Otheriwse if it is in
         # memory, we can access it directly.
-        #
-        # Note also that if the caller has
-        # given us a 'fancy' slice object (a
-        # boolean numpy array), but the image
-        # data is not in memory, we can't access
-        # the data, as the nibabel ArrayProxy
-        # (the dataobj attribute) cannot handle
-        # fancy indexing. In this case an error
-        # will be raised.
-        if self.__data is not None: return self.__data[         sliceobj]
-        else:                       return self.__image.dataobj[sliceobj]
+        # We take a local reference to the data
+        # and its scaling parameters, as they
+        # may be unloaded by another thread
+        # (see the memorymanager module).
+        data, scaling = self.__inMemoryData()
+        if data is not None:
+            return self.__scale(data[sliceobj], scaling)
+
+        if self.__backend is not None: dataobj = self.__backend
+        else:                          dataobj = self.__image.dataobj
+
+        # If the caller has given us a 'fancy'
+        # slice object (a boolean numpy array),
+        # but the image data is not in memory,
+        # we read it in slabs, as the nibabel
+        # ArrayProxy cannot handle fancy indexing.
+        if isinstance(sliceobj, np.ndarray):
+            import fsl.data.image as fslimage
+            return maskedData(dataobj,
+                              sliceobj,
+                              fslimage.DEFAULT_CHUNK_SIZE,
+                              self.__image.get_data_dtype().itemsize)
+
+        if cached and self.__volumeCache is not None:
+            data = self.__getCachedData(dataobj, sliceobj)
+            if data is not None:
+                return data
+
+        return dataobj[sliceobj]
+
+
+    def __getCachedData(self, dataobj, sliceobj):
+        """Called by :meth:`__getData`. Retrieves the image data at the
+        location specified by ``sliceobj`` from the volumes stored in the
+        :attr:`volumeCache`, reading and caching any volumes which are not
+        already cached.
+
+        :returns: The image data, or ``None`` if ``sliceobj`` cannot be
+                  retrieved from the cache.
+        """
+
+        shape    = self.__image.shape
+        axis     = self.__numRealDims - 1
+        volCache = self.__volumeCache
+
+        if not isinstance(sliceobj, tuple) or len(sliceobj) != len(shape):
+            return None
+
+        for slc in sliceobj:
+            if slc is None:
+                return None
+            if isinstance(slc, slice) and slc.step not in (None, 1):
+                return None
+
+        lo, hi   = sliceObjToSliceTuple(sliceobj, shape)[axis]
+        volBytes = int(np.prod(shape[:axis])) * \
+                   self.__image.get_data_dtype().itemsize
+
+        if hi <= lo:
+            return None
+
+        if volCache.maxbytes is not None and \
+           (hi - lo) * volBytes > volCache.maxbytes:
+            return None
+
+        padding = (0,) * self.__numPadDims
+        volslc  = sliceobj[:axis]
+        parts   = []
+
+        for vol in range(lo, hi):
+
+            key  = (self.__cacheToken, vol)
+            data = volCache.get(key, None)
+
+            if data is None:
+                data = np.asarray(dataobj[(slice(None),) * axis +
+                                          (vol,) +
+                                          padding])
+                data.flags.writeable = False
+                volCache.put(key, data)
+
+            parts.append(data[volslc])
+
+        if isinstance(sliceobj[axis], slice):
+            data = np.stack(parts, axis=-1)
+        else:
+            data = parts[0]
+
+        # Re-instate any trailing dimensions of
+        # length 1 which the caller has sliced
+        npad = sum(isinstance(s, slice) for s in sliceobj[axis + 1:])
+        if npad > 0:
+            data = data.reshape(data.shape + (1,) * npad)
+
+        return data
 
 
     def __imageIsCovered(self):
@@ -428,9 +1220,19 @@ class ImageWrapper(notifier.Notifier):
         return sliceCovered(slices, self.__coverage)
 
 
-    def __expandCoverage(self, slices):
+    def __expandCoverage(self, slices, data=None):
         """Expands the current image data range and coverage to encompass the
         given ``slices``.
+
+        :arg slices: A sequence of ``(low, high)`` index pairs, one for each
+                     dimension in the image.
+
+        :arg data:   The image data at ``slices``, if it has already been
+                     read, with one dimension for each dimension in the
+                     image. If provided, ranges are calculated from this
+                     data where possible, and only the parts of the
+                     expansions which are not contained within ``slices``
+                     are read from the image.
         """
 
         _, expansions = calcExpansion(slices, self.__coverage)
@@ -455,6 +1257,7 @@ class ImageWrapper(notifier.Notifier):
         # for each volume in the image separately.
         # So we squeeze out the padding dimensions,
         # but not the volume dimension.
+        volDim      = self.__numRealDims - 1
         squeezeDims = tuple(range(self.__numRealDims,
                                   self.__numRealDims + self.__numPadDims))
 
@@ -465,28 +1268,58 @@ class ImageWrapper(notifier.Notifier):
         # coverage and data range.
         for exp in expansions:
 
-            data     = self.__getData(exp, isTuple=True)
-            data     = data.squeeze(squeezeDims)
-            vlo, vhi = exp[self.__numRealDims - 1]
-
-            for vi, vol in enumerate(range(vlo, vhi)):
-
-                oldvlo, oldvhi = self.__volRanges[vol, :]
-                voldata        = data[..., vi]
-                newvlo, newvhi = nir.naninfrange(voldata)
-
-                if np.isnan(newvlo) or \
-                   (not np.isnan(oldvlo) and oldvlo < newvlo):
-                    newvlo = oldvlo
-                if np.isnan(newvhi) or \
-                   (not np.isnan(oldvhi) and oldvhi > newvhi):
-                    newvhi = oldvhi
-
-                # Update the stored range and
-                # coverage for each volume
-                self.__volRanges[vol, :]  = newvlo, newvhi
-                self.__coverage[..., vol] = adjustCoverage(
-                    self.__coverage[..., vol], exp)
+            # Expansions may not contain
+            # entries for padding dimensions
+            exp      = list(exp) + [(0, 1)] * (len(slices) - len(exp))
+            vlo, vhi = exp[volDim]
+            ranges   = np.full((vhi - vlo, 2), np.nan)
+
+            # Figure out which parts of the expansion
+            # are in the data we have been given, and
+            # which parts we need to read in.
+            if data is None:
+                inside, outside = None, [exp]
+            else:
+                inside, outside = subtractSlices(exp, slices)
+
+            # Data that we read ourselves may be
+            # raw, in which case the ranges need
+            # to be scaled.
+            parts = [(box,) + self.__getData(box, isTuple=True, raw=True)
+                     for box in outside]
+
+            if inside is not None:
+                offsets = [lo - slo for (lo, _), (slo, _) in
+                           zip(inside, slices)]
+                box     = tuple(slice(off, off + hi - lo) for off, (lo, hi)
+                                in zip(offsets, inside))
+                parts.append((inside, data[box], None))
+
+            for box, boxdata, scaling in parts:
+                blo, bhi  = box[volDim]
+                boxdata   = boxdata.squeeze(squeezeDims)
+                boxranges = self.__scaleRanges(volumeRanges(boxdata), scaling)
+                ranges[blo - vlo:bhi - vlo, 0] = np.fmin(
+                    ranges[blo - vlo:bhi - vlo, 0], boxranges[:, 0])
+                ranges[blo - vlo:bhi - vlo, 1] = np.fmax(
+                    ranges[blo - vlo:bhi - vlo, 1], boxranges[:, 1])
+
+            # Update the stored range and coverage
+            # for every volume in the expansion
+            volRanges = self.__volRanges[vlo:vhi]
+            volRanges[:, 0] = np.fmin(volRanges[:, 0], ranges[:, 0])
+            volRanges[:, 1] = np.fmax(volRanges[:, 1], ranges[:, 1])
+            self.__coverage[..., vlo:vhi] = adjustCoverage(
+                self.__coverage[..., vlo:vhi], exp)
+
+        self.__updateTotalRange()
+
+
+    def __updateTotalRange(self):
+        """Called by :meth:`__expandCoverage` and :meth:`__calcRange`.
+        Re-calculates the known data range over all volumes, and notifies
+        listeners if it has changed.
+        """
 
         # Calculate the new known data
         # range over the entire image
@@ -508,6 +1341,108 @@ class ImageWrapper(notifier.Notifier):
             self.notify()
 
 
+    def calcRange(self, nthreads=None):
+        """Calculates the full data range of the image.
+
+        The range of each volume (for a 4D image, or slice for a 3D image)
+        which has not already been covered is calculated on a pool of
+        threads, and the per-volume data ranges and coverage are then
+        updated in one step. This is much faster than calculating the range
+        via ``self[:]``, which considers each volume in turn.
+
+        If this ``ImageWrapper`` was created with ``threaded=True``, the
+        calculation is performed on the :class:`.TaskPool`, and this
+        method returns immediately.
+
+        :arg nthreads: Number of threads to use. Defaults to the number of
+                       CPUs.
+        """
+
+        if self.__taskPool is None:
+            self.__calcRange(nthreads)
+        else:
+            self.__enqueue(self.__calcRange, nthreads, taskName='calcRange')
+
+
+    def __calcRange(self, nthreads=None):
+        """Called by :meth:`calcRange`. Calculates the data range of all
+        volumes which have not yet been covered.
+        """
+
+        if self.__covered:
+            return
+
+        if nthreads is None:
+            nthreads = os.cpu_count() or 1
+
+        import fsl.data.image as fslimage  # pylint: disable=import-outside-toplevel
+
+        volDim   = self.__numRealDims - 1
+        shape    = self.__image.shape
+        volShape = np.array(shape[:volDim])
+        nvols    = shape[volDim]
+        lows     = self.__coverage[0]
+        highs    = self.__coverage[1]
+
+        # Figure out which volumes have not
+        # already been completely covered
+        covered = np.all(lows  == 0,                 axis=0) & \
+                  np.all(highs == volShape[:, None], axis=0)
+        vols    = np.where(~covered)[0]
+
+        if len(vols) == 0:
+            return
+
+        # Volumes are processed in contiguous
+        # blocks, each block being read in one
+        # go - each block should be no bigger
+        # than the default chunk size, and
+        # we want at least one block per thread.
+        itemsize  = self.__image.get_data_dtype().itemsize
+        volBytes  = max(1, int(np.prod(volShape)) * itemsize)
+        blockSize = min(fslimage.DEFAULT_CHUNK_SIZE // volBytes,
+                        int(np.ceil(len(vols) / nthreads)))
+        blockSize = max(1, blockSize)
+        blocks    = []
+
+        # Split the uncovered volumes into
+        # runs of contiguous volumes, and
+        # then split each run into blocks
+        runs = np.split(vols, np.where(np.diff(vols) != 1)[0] + 1)
+        for run in runs:
+            for start in range(0, len(run), blockSize):
+                block = run[start:start + blockSize]
+                blocks.append((block[0], block[-1] + 1))
+
+        padding = (0,) * self.__numPadDims
+
+        def blockRange(block):
+            lo, hi   = block
+            sliceobj = (slice(None),) * volDim + (slice(lo, hi),) + padding
+            data, scaling = self.__getData(sliceobj, raw=True, cached=False)
+            return self.__scaleRanges(volumeRanges(data), scaling)
+
+        log.debug('Calculating data range of image %s (%i volumes, '
+                  '%i blocks, %i threads)',
+                  self.__name, len(vols), len(blocks), nthreads)
+
+        if nthreads > 1 and len(blocks) > 1:
+            with futures.ThreadPoolExecutor(nthreads) as pool:
+                ranges = list(pool.map(blockRange, blocks))
+        else:
+            ranges = [blockRange(b) for b in blocks]
+
+        ranges = np.concatenate(ranges).astype(self.__volRanges.dtype)
+
+        # Update the per-volume data
+        # ranges and coverage in one go
+        self.__volRanges[vols, :] = ranges
+        lows[ :, vols]            = 0
+        highs[:, vols]            = volShape[:, None]
+
+        self.__updateTotalRange()
+
+
     def __updateDataRangeOnRead(self, slices, data):
         """Called by :meth:`__getitem__`. Calculates the minimum/maximum
         values of the given data (which has been extracted from the portion of
@@ -518,32 +1453,99 @@ class ImageWrapper(notifier.Notifier):
                      index pair, one for each dimension in the image.
 
         :arg data:   The image data at the given ``slices`` (as a ``numpy``
-                     array).
+                     array), or ``None`` if the data cannot be re-used
+                     (e.g. it was retrieved with a fancy slice object).
         """
 
-        # TODO You could do something with
-        #      the provided data to avoid
-        #      reading it in again.
+        # The data that was read is re-used
+        # in the range calculation, so that
+        # it does not need to be read again.
+        # It needs to have one dimension per
+        # image dimension (integer indices
+        # drop dimensions).
+        if data is not None:
+            data = data.reshape([hi - lo for lo, hi in slices])
+
+        if self.__taskPool is None:
+            self.__expandCoverage(slices, data)
+
+        # A queued calcRange task will cover
+        # this region, so we don't need to
+        elif not self.__taskPool.isQueued(id(self), 'calcRange'):
+
+            # In threaded mode, in-memory data
+            # is cheap to re-read, and may have
+            # changed by the time the task runs,
+            # so we only hold onto data that was
+            # read from disk. We take a copy, as
+            # the caller may modify it in place.
+            if self.__data is not None or \
+               isinstance(self.__backend, MemmapProxy):
+                data = None
+            elif data is not None:
+                data = np.array(data)
+
+            # Identical read tasks are coalesced
+            self.__enqueue(self.__expandCoverage,
+                           slices,
+                           data,
+                           taskName='read_{}'.format(slices))
+
+
+    def __updateDataRangeOnWrite(self, slices, oldRanges=None, newData=None):
+        """Called by :meth:`__setitem__`. Assumes that the image data has
+        been changed (the data at ``slices`` has been replaced). Updates the
+        image data coverage, and known data range accordingly.
+
+        :arg slices:  A tuple of tuples, each tuple being a ``(low, high)``
+                      index pair, one for each dimension in the image.
+
+        :arg oldRanges: The range of each volume in the given ``slices``,
+                        before the data was replaced, or ``None`` if it is
+                        not known.
 
-        if self.__taskThread is None:
-            self.__expandCoverage(slices)
+        :arg newData:   The image data at the given ``slices``, after it was
+                        replaced, or ``None`` if it is not known.
+        """
+
+        if self.__taskPool is None:
+            self.__applyWrite(slices, oldRanges, newData)
         else:
-            name = '{}_read_{}'.format(id(self), slices)
-            if not self.__taskThread.isQueued(name):
-                self.__taskThread.enqueue(
-                    self.__expandCoverage, slices, taskName=name)
+            # In-memory data may change before
+            # the task is run, so we take a copy.
+            # Write tasks are never coalesced,
+            # as every write has to be applied.
+            if newData is not None:
+                newData = np.array(newData)
+            self.__enqueue(self.__applyWrite, slices, oldRanges, newData)
 
 
-    def __updateDataRangeOnWrite(self, slices, data):
-        """Called by :meth:`__setitem__`. Assumes that the image data has
-        been changed (the data at ``slices`` has been replaced with ``data``.
-        Updates the image data coverage, and known data range accordingly.
+    def __volumeRanges(self, slices, data):
+        """Used by :meth:`__setitem__` and :meth:`__applyWrite`.
+        Calculates the range of each volume in ``data``, which is assumed to
+        have been read from ``slices``.
 
-        :arg slices: A tuple of tuples, each tuple being a ``(low, high)``
-                     index pair, one for each dimension in the image.
+        :returns: A ``numpy`` array of shape ``(nvols, 2)``.
+        """
+        squeezeDims = tuple(range(self.__numRealDims,
+                                  self.__numRealDims + self.__numPadDims))
+        data        = np.asanyarray(data)
+        data        = data.reshape([hi - lo for lo, hi in slices])
+        return volumeRanges(data.squeeze(squeezeDims))
 
-        :arg data:   The image data at the given ``slices`` (as a ``numpy``
-                     array).
+
+    def __applyWrite(self, slices, oldRanges, newData):
+        """Called by :meth:`__updateDataRangeOnWrite`, either directly, or on
+        the :class:`.TaskPool`. Updates the coverage and known data range
+        to take into account data which has been written to the image.
+
+        :arg slices:    A tuple of ``(low, high)`` index pairs specifying the
+                        region that was written.
+
+        :arg oldRanges: Range of each volume in the region, before it was
+                        written (or ``None`` if not known).
+
+        :arg newData:   The data that was written (or ``None`` if not known).
         """
 
         overlap = sliceOverlap(slices, self.__coverage)
@@ -552,59 +1554,90 @@ class ImageWrapper(notifier.Notifier):
         # area and the current coverage, then it's
         # easy - we just expand the coverage to
         # include the newly written area.
-        #
+        if overlap not in (OVERLAP_SOME, OVERLAP_ALL):
+            if newData is not None:
+                newData = np.asanyarray(newData).reshape(
+                    [hi - lo for lo, hi in slices])
+            self.__expandCoverage(slices, newData)
+            return
+
         # But if there is overlap between the written
         # area and the current coverage, things are
         # more complicated, because the portion of
         # the image that has been written over may
         # have contained the currently known data
-        # minimum/maximum. We have no way of knowing
-        # this, so we have to reset the coverage (on
-        # the affected volumes), and recalculate the
-        # data range.
-        if overlap in (OVERLAP_SOME, OVERLAP_ALL):
-
-            # TODO Could you store the location of the
-            #      data minimum/maximum (in each volume),
-            #      so you know whether resetting the
-            #      coverage is necessary?
-            lowVol, highVol = slices[self.__numRealDims - 1]
-
-            # We create a single slice which
-            # encompasses the given slice, and
-            # all existing coverages for each
-            # volume in the given slice. The
-            # data range for this slice will
-            # be recalculated.
-            slices = adjustCoverage(self.__coverage[:, :, lowVol], slices)
-            for vol in range(lowVol + 1, highVol):
-                slices = adjustCoverage(slices, self.__coverage[:, :, vol].T)
-
-            slices = np.array(slices.T, dtype=np.uint32)
-            slices = tuple(it.chain(map(tuple, slices), [(lowVol, highVol)]))
-
-            log.debug('Image %s data written - clearing known data '
-                      'range on volumes %s - %s (write slice: %s; '
-                      'coverage: %s; volRanges: %s)',
-                      self.__name,
-                      lowVol,
-                      highVol,
-                      slices,
-                      self.__coverage[:, :, lowVol:highVol],
-                      self.__volRanges[lowVol:highVol, :])
+        # minimum/maximum.
+        #
+        # If we know the range of the data that was
+        # overwritten, we can tell whether it could
+        # have contained a volume minimum/maximum - if
+        # not, the volume range simply needs to be
+        # expanded to include the new data. Otherwise
+        # we have to reset the coverage (on the
+        # affected volumes), and recalculate the data
+        # range.
+        lowVol, highVol = slices[self.__numRealDims - 1]
+        resetVols       = []
+
+        if oldRanges is None or newData is None:
+            resetVols = list(range(lowVol, highVol))
+        else:
+            newRanges = self.__volumeRanges(slices, newData)
 
-            for vol in range(lowVol, highVol):
-                self.__coverage[:, :, vol]    = np.nan
-                self.__volRanges[     vol, :] = np.nan
+            for vi, vol in enumerate(range(lowVol, highVol)):
 
+                vlo, vhi = self.__volRanges[vol, :]
+                olo, ohi = oldRanges[vi]
+                nlo, nhi = newRanges[vi]
 
-        if self.__taskThread is None:
-            self.__expandCoverage(slices)
-        else:
-            name = '{}_write_{}'.format(id(self), slices)
-            if not self.__taskThread.isQueued(name):
-                self.__taskThread.enqueue(
-                    self.__expandCoverage, slices, taskName=name)
+                # This volume is not yet covered
+                if np.isnan(vlo) or np.isnan(vhi):
+                    continue
+
+                # The old data may have contained the
+                # min/max of this volume (if it only
+                # contained nans, it can't have)
+                if not np.isnan(olo) and (olo <= vlo or ohi >= vhi):
+                    resetVols.append(vol)
+                else:
+                    self.__volRanges[vol, :] = (np.fmin(vlo, nlo),
+                                                np.fmax(vhi, nhi))
+
+        # None of the volume minimums/maximums were
+        # overwritten, so all we need to do is expand
+        # the coverage to include the written area
+        # (re-using the new data where possible).
+        if len(resetVols) == 0:
+            newData = np.asanyarray(newData).reshape(
+                [hi - lo for lo, hi in slices])
+            self.__expandCoverage(slices, newData)
+            return
+
+        # We create a single slice which
+        # encompasses the given slice, and
+        # all existing coverages for each
+        # volume to be reset. The data range
+        # for this slice will be recalculated.
+        slices = adjustCoverage(self.__coverage[:, :, resetVols[0]], slices)
+        for vol in resetVols[1:]:
+            slices = adjustCoverage(slices, self.__coverage[:, :, vol].T)
+
+        slices = np.array(slices.T, dtype=np.uint32)
+        slices = tuple(it.chain(map(tuple, slices), [(lowVol, highVol)]))
+
+        log.debug('Image %s data written - clearing known data '
+                  'range on volumes %s (write slice: %s; '
+                  'coverage: %s; volRanges: %s)',
+                  self.__name,
+                  resetVols,
+                  slices,
+                  self.__coverage[:, :, resetVols],
+                  self.__volRanges[resetVols, :])
+
+        self.__coverage[:, :, resetVols] = np.nan
+        self.__volRanges[resetVols, :]   = np.nan
+
+        self.__expandCoverage(slices)
 
 
     def __getitem__(self, sliceobj):
@@ -614,6 +1647,31 @@ class ImageWrapper(notifier.Notifier):
         :arg sliceobj: Something which can slice the image data.
         """
 
+        # Fast path for simple reads (integers and
+        # contiguous slices) of in-memory data, when
+        # the data range is already known - none of
+        # the coverage machinery below is needed.
+        # The image shape must be the same as
+        # its canonical shape (see expectedShape)
+        data, scaling = self.__inMemoryData()
+        if self.__covered                          and \
+           data is not None                        and \
+           data.ndim == len(self.__canonicalShape) and \
+           isSimpleSliceObj(sliceobj, data.shape):
+
+            data    = self.__scale(data[sliceobj], scaling)
+            manager = memorymanager.getManager()
+
+            if manager is not None:
+                manager.accessed(self)
+
+            # __scale returns a 0d array
+            # for scalar reads
+            if isinstance(data, np.ndarray) and data.ndim == 0:
+                data = data[()]
+
+            return data
+
         log.debug('Getting image data: %s', sliceobj)
 
         shape              = self.__canonicalShape
@@ -622,22 +1680,30 @@ class ImageWrapper(notifier.Notifier):
         fancy              = isValidFancySliceObj(sliceobj, shape)
         expNdims, expShape = expectedShape(       sliceobj, shape)
 
-        # TODO Cache 3D images for large 4D volumes,
-        #      so you don't have to hit the disk?
-
         # Make the slice object compatible with the
         # actual image shape, and retrieve the data.
         sliceobj = canonicalSliceObj(sliceobj, realShape)
         data     = self.__getData(sliceobj)
 
+        manager = memorymanager.getManager()
+        if manager is not None and self.__data is not None:
+            manager.accessed(self)
+
         # Update data range for the
         # data that we just read in
         if not self.__covered:
 
             slices = sliceObjToSliceTuple(sliceobj, realShape)
 
+            # The range of a fancy slice is
+            # calculated over the whole image,
+            # which is only cheap if the image
+            # is in memory.
             if not sliceCovered(slices, self.__coverage):
-                self.__updateDataRangeOnRead(slices, data)
+                if not fancy:
+                    self.__updateDataRangeOnRead(slices, data)
+                elif self.__data is not None:
+                    self.__updateDataRangeOnRead(slices, None)
 
         # Make sure that the result has the
         # shape that the caller is expecting.
@@ -672,7 +1738,8 @@ class ImageWrapper(notifier.Notifier):
 
 
         .. note:: Modifying image data will cause the entire image to be
-                  loaded into memory.
+                  loaded into memory, unless this ``ImageWrapper`` is in
+                  write-through mode.
         """
 
         realShape = self.__image.shape
@@ -703,18 +1770,415 @@ class ImageWrapper(notifier.Notifier):
             # have a compatible shape.
             else:
 
-                values = np.array(values)
+                values = np.asanyarray(values)
                 if values.shape != expShape:
                     values = values.reshape(expShape)
 
-        # The image data has to be in memory
-        # for the data to be changed. If it's
-        # already in memory, this call won't
-        # have any effect.
+        # Otherwise the image data has to be
+        # in memory for the data to be changed.
+        # If it's already in memory, this call
+        # won't have any effect. The data is
+        # marked as modified first, so that it
+        # cannot be unloaded by the memory
+        # manager.
+        with self.__dataLock:
+            self.__modified = True
         self.loadData()
 
-        self.__data[sliceobj] = values
-        self.__updateDataRangeOnWrite(slices, values)
+        # The raw data cannot be modified without
+        # losing precision, so if we are lazily
+        # scaling, we have to scale all of the data
+        with self.__dataLock:
+            data, scaling = self.__inMemoryData()
+            if scaling is not None:
+                log.debug('Disabling lazy scaling on %s', self.__name)
+                self.__data = (self.__scale(data, scaling), None)
+
+        # If the write overlaps with the current
+        # coverage, we calculate the range of the
+        # data that is about to be overwritten, as
+        # we may be able to use it to avoid
+        # re-calculating the data range (see
+        # __applyWrite).
+        fancy     = isValidFancySliceObj(sliceobj, realShape)
+        batch     = self.__batchDepth > 0
+        oldRanges = None
+        newData   = None
+
+        if not (fancy or batch) and \
+           sliceOverlap(slices, self.__coverage) != OVERLAP_NONE:
+            oldRanges = self.__volumeRanges(slices, self.__getData(sliceobj))
+
+        # In write-through mode, the new
+        # values go straight to the file
+        if self.__backend is not None: self.__backend[sliceobj] = values
+        else:                          self.__data[0][sliceobj] = values
+
+        # Drop any cached volumes which have been
+        # modified (cached volumes have already
+        # been dropped by loadData if the data
+        # is now in memory)
+        if self.__backend is not None:
+            if fancy:
+                self.clearVolumeCache()
+            else:
+                lo, hi = slices[self.__numRealDims - 1]
+                self.clearVolumeCache(range(lo, hi))
+
+        # In a batch update, the range of all
+        # written data is updated at the end
+        # (see batchUpdate)
+        if batch:
+            if self.__batchSlices is None:
+                self.__batchSlices = slices
+            else:
+                self.__batchSlices = unionSlices(self.__batchSlices, slices)
+            return
+
+        # We pass the data as it is actually
+        # stored (e.g. after casting to the
+        # image data type) through to the
+        # range calculation.
+        if not fancy:
+            newData = self.__getData(sliceobj)
+
+        self.__updateDataRangeOnWrite(slices, oldRanges, newData)
+
+
+RANGE_THREADS = 4
+"""Maximum number of threads used by the :class:`.TaskPool` returned by
+:func:`rangeTaskPool`.
+"""
+
+
+RANGE_TASK_POOL = None
+"""The :class:`.TaskPool` returned by :func:`rangeTaskPool`. """
+
+
+RANGE_TASK_POOL_LOCK = threading.Lock()
+"""Used by :func:`rangeTaskPool` to protect access to
+:data:`RANGE_TASK_POOL`.
+"""
+
+
+def rangeTaskPool():
+    """Returns a :class:`.TaskPool` which is used by all
+    :class:`ImageWrapper` instances that were created with ``threaded=True``
+    to update their data ranges. The pool is created on the first call, with
+    at most :data:`RANGE_THREADS` threads.
+    """
+
+    global RANGE_TASK_POOL  # pylint: disable=global-statement
+
+    with RANGE_TASK_POOL_LOCK:
+        if RANGE_TASK_POOL is None:
+            RANGE_TASK_POOL = idle.TaskPool(RANGE_THREADS,
+                                            name='fslpy-range')
+        return RANGE_TASK_POOL
+
+
+def waitUntilIdle(timeout=None):
+    """Blocks until all outstanding data range updates, for all
+    :class:`ImageWrapper` instances, have completed.
+
+    :arg timeout: Maximum number of seconds to wait.
+    :returns:     ``True`` if the updates completed, ``False`` if the
+                  ``timeout`` elapsed.
+    """
+    return rangeTaskPool().waitUntilIdle(timeout=timeout)
+
+
+class MemmapProxy(object):
+    """The ``MemmapProxy`` is an array-like object which provides read/write
+    access to the data of an uncompressed NIFTI/ANALYZE image file through a
+    writable ``numpy.memmap``. It is used by the :class:`ImageWrapper` in
+    write-through mode.
+
+    Any scaling parameters (``scl_slope``/``scl_inter``) specified in the
+    image header are applied to data when it is read, and inverted when data
+    is written. When writing to an image with an integer data type, values
+    are rounded and clipped to the range of the data type.
+    """
+
+
+    def __init__(self, image):
+        """Create a ``MemmapProxy``.
+
+        :arg image: A ``nibabel`` image which has been loaded from an
+                    uncompressed file, and whose data has not been loaded
+                    into memory.
+        """
+
+        dataobj  = image.dataobj
+        filename = image.file_map['image'].filename
+
+        if image.in_memory or not nib.is_proxy(dataobj):
+            raise ValueError('Image data is not stored in a file')
+
+        if filename is None or not op.exists(filename) or \
+           filename.lower().endswith(('.gz', '.bz2', '.zst')):
+            raise ValueError('Write-through mode is only supported for '
+                             'uncompressed image files ({})'.format(filename))
+
+        self.__filename = filename
+        self.__fileMap  = image.file_map
+        self.__slope    = float(dataobj.slope)
+        self.__inter    = float(dataobj.inter)
+        self.__mmap     = np.memmap(filename,
+                                    dtype=dataobj.dtype,
+                                    mode='r+',
+                                    offset=dataobj.offset,
+                                    shape=dataobj.shape,
+                                    order='F')
+
+
+    @property
+    def filename(self):
+        """Returns the name of the file that is memory-mapped. """
+        return self.__filename
+
+
+    @property
+    def shape(self):
+        """Returns the shape of the image data. """
+        return self.__mmap.shape
+
+
+    @property
+    def ndim(self):
+        """Returns the number of dimensions in the image data. """
+        return self.__mmap.ndim
+
+
+    @property
+    def scaled(self):
+        """Returns ``True`` if the data is scaled, ``False`` otherwise. """
+        return self.__slope != 1 or self.__inter != 0
+
+
+    def flush(self):
+        """Flushes any changes to the memory-mapped data to disk. """
+        if self.__mmap is not None:
+            self.__mmap.flush()
+
+
+    def close(self):
+        """Flushes any changes to disk, and releases the memory-map. The
+        file is unmapped once all arrays which refer to it have been
+        garbage-collected.
+        """
+        if self.__mmap is not None:
+            self.__mmap.flush()
+            self.__mmap = None
+
+
+    def writeHeader(self, header):
+        """Writes the given ``nibabel`` header to the file in place. Only the
+        fixed-size header block is written - extensions are not re-written.
+        """
+
+        # The header is the first thing in a
+        # .nii file, and is in a separate file
+        # for a .hdr/.img pair.
+        fmap    = self.__fileMap
+        hdrfile = fmap.get('header', fmap['image']).filename
+
+        with open(hdrfile, 'r+b') as f:
+            f.write(header.binaryblock)
+
+
+    def __getitem__(self, sliceobj):
+        """Read data from the file, applying scaling parameters if
+        necessary.
+        """
+        data = self.__mmap[sliceobj]
+        if self.scaled:
+            data = nib.volumeutils.apply_read_scaling(
+                data, self.__slope, self.__inter)
+        return data
+
+
+    def __setitem__(self, sliceobj, values):
+        """Write data to the file, inverting scaling parameters and casting
+        to the file data type if necessary.
+        """
+
+        dtype  = self.__mmap.dtype
+        values = np.asanyarray(values)
+
+        if self.scaled:
+            values = (values - self.__inter) / self.__slope
+
+        if np.issubdtype(dtype, np.integer) and \
+           not np.issubdtype(values.dtype, np.integer):
+            info   = np.iinfo(dtype)
+            values = np.clip(np.round(values), info.min, info.max)
+
+        self.__mmap[sliceobj] = values
+
+
+def volumeRanges(data):
+    """Calculates the minimum/maximum of each volume in ``data``, ignoring
+    ``nan`` and ``inf`` values (see :func:`.naninfrange`). Volumes are assumed
+    to be stacked along the last dimension of ``data``.
+
+    The range of all volumes is calculated in one go where possible, and
+    individually otherwise (e.g. for volumes containing infinite values).
+
+    :returns: A ``numpy`` array of shape ``(nvols, 2)``.
+    """
+
+    nvols = data.shape[-1]
+
+    # Structured data (e.g. RGB)
+    if len(data.dtype) > 0:
+        return np.array([nir.naninfrange(data[..., i]) for i in range(nvols)])
+
+    # Nibabel images are usually in fortran
+    # order, in which case this reshape
+    # does not result in a copy
+    order = 'F' if data.flags['F_CONTIGUOUS'] else 'C'
+    data  = data.reshape((-1, nvols), order=order)
+
+    if data.shape[0] == 0:
+        return np.full((nvols, 2), np.nan)
+
+    if not np.issubdtype(data.dtype, np.floating):
+        return np.stack((data.min(axis=0), data.max(axis=0)), axis=1)
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore')
+        ranges = np.stack((np.nanmin(data, axis=0),
+                           np.nanmax(data, axis=0)), axis=1)
+
+    # Volumes containing inf/all nan values
+    for vol in np.where(~np.all(np.isfinite(ranges), axis=1))[0]:
+        ranges[vol] = nir.naninfrange(data[:, vol])
+
+    return ranges
+
+
+def subtractSlices(slices, other):
+    """Subtracts the region specified by ``other`` from the region specified
+    by ``slices``.
+
+    :arg slices: A sequence of ``(low, high)`` index pairs, one for each
+                 dimension.
+    :arg other:  A sequence of ``(low, high)`` index pairs, one for each
+                 dimension.
+
+    :returns:    A tuple containing:
+
+                  - The intersection of ``slices`` and ``other``, as a
+                    sequence of ``(low, high)`` tuples, or ``None`` if they
+                    do not intersect.
+
+                  - A list of non-overlapping regions, each a sequence of
+                    ``(low, high)`` tuples, which together cover the part of
+                    ``slices`` that is not in ``other``.
+    """
+
+    slices = [(int(lo), int(hi)) for lo, hi in slices]
+    other  = [(int(lo), int(hi)) for lo, hi in other]
+
+    # No intersection
+    for (lo, hi), (olo, ohi) in zip(slices, other):
+        if hi <= olo or lo >= ohi:
+            return None, [slices]
+
+    # Peel off the parts of the region which lie
+    # below/above the other region, one dimension
+    # at a time - what is left is the intersection.
+    remainder = []
+    inter     = list(slices)
+
+    for dim, (olo, ohi) in enumerate(other):
+
+        lo, hi = inter[dim]
+
+        if lo < olo:
+            part           = list(inter)
+            part[dim]      = (lo, olo)
+            lo             = olo
+            remainder.append(part)
+
+        if hi > ohi:
+            part           = list(inter)
+            part[dim]      = (ohi, hi)
+            hi             = ohi
+            remainder.append(part)
+
+        inter[dim] = (lo, hi)
+
+    return inter, remainder
+
+
+def unionSlices(slices, other):
+    """Returns the smallest region which contains both of the regions
+    specified by ``slices`` and ``other``.
+
+    :arg slices: A sequence of ``(low, high)`` index pairs, one for each
+                 dimension.
+    :arg other:  A sequence of ``(low, high)`` index pairs, one for each
+                 dimension.
+
+    :returns:    A tuple of ``(low, high)`` tuples.
+    """
+    return tuple((min(lo, olo), max(hi, ohi))
+                 for (lo, hi), (olo, ohi) in zip(slices, other))
+
+
+def isSimpleSliceObj(sliceobj, shape):
+    """Returns ``True`` if the given ``sliceobj`` is *simple* - an integer,
+    a contiguous ``slice``, or a tuple of these, with no more entries than
+    there are dimensions in ``shape``, and with all integer indices and
+    ``slice`` limits within bounds. Such a ``sliceobj`` can be passed
+    straight to a ``numpy`` array of shape ``shape``, without needing to be
+    converted by :func:`canonicalSliceObj`.
+
+    :arg sliceobj: Something which can be used to slice an array of shape
+                   ``shape``.
+
+    :arg shape:    Shape of the array being sliced.
+    """
+
+    if not isinstance(sliceobj, tuple):
+        sliceobj = (sliceobj,)
+
+    if len(sliceobj) > len(shape):
+        return False
+
+    for s, n in zip(sliceobj, shape):
+
+        # Booleans are treated as
+        # masks by numpy, not indices
+        if isinstance(s, (bool, np.bool_)):
+            return False
+
+        elif isinstance(s, (int, np.integer)):
+            if not (-n <= s < n):
+                return False
+
+        elif isinstance(s, slice):
+
+            if s.step not in (None, 1):
+                return False
+
+            start = 0 if s.start is None else s.start
+            stop  = n if s.stop  is None else s.stop
+
+            for lim in (start, stop):
+                if isinstance(lim, (bool, np.bool_)) or \
+                   not isinstance(lim, (int, np.integer)):
+                    return False
+
+            if not (0 <= start <= stop <= n):
+                return False
+
+        else:
+            return False
+
+    return True
 
 
 def isValidFancySliceObj(sliceobj, shape):
@@ -868,13 +2332,142 @@ def sliceTupleToSliceObj(slices):
     return tuple(sliceobj)
 
 
+def chunkSlices(shape, axis, nbytes, itemsize):
+    """Generates a sequence of slice objects which can be used to iterate
+    over an array of the given ``shape`` in chunks along the given ``axis``.
+    Each chunk will contain as many slices along ``axis`` as can fit into
+    ``nbytes`` bytes, but will always contain at least one slice.
+
+    :arg shape:    Shape of the array being sliced.
+    :arg axis:     Axis along which the array is to be split.
+    :arg nbytes:   Maximum number of bytes in each chunk.
+    :arg itemsize: Number of bytes per array element.
+    :returns:      A generator which yields tuples of ``slice`` objects,
+                   one for each chunk.
+    """
+
+    shape    = list(shape)
+    axis     = axis % len(shape)
+    slcbytes = itemsize * int(np.prod(shape[:axis] + shape[axis + 1:]))
+    step     = max(1, int(nbytes // max(1, slcbytes)))
+
+    for start in range(0, shape[axis], step):
+        sliceobj       = [slice(None)] * len(shape)
+        sliceobj[axis] = slice(start, min(start + step, shape[axis]))
+        yield tuple(sliceobj)
+
+
+def isScaledProxy(dataobj):
+    """Returns ``True`` if ``dataobj`` is a ``nibabel`` array proxy which
+    applies scaling parameters to the data, ``False`` otherwise.
+    """
+    return (nib.is_proxy(dataobj)           and
+            hasattr(dataobj, 'get_unscaled') and
+            (float(dataobj.slope), float(dataobj.inter)) != (1.0, 0.0))
+
+
+def scaledType(dtype):
+    """Returns the data type that data of the given ``dtype`` is converted
+    to when it is lazily scaled - ``float32`` for 8 and 16 bit types, and
+    ``float64`` for all other types.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.itemsize <= 2: return np.dtype(np.float32)
+    else:                   return np.dtype(np.float64)
+
+
+def maskedData(dataobj, mask, nbytes, itemsize):
+    """Extracts the values within a boolean ``mask`` from ``dataobj``,
+    without reading all of ``dataobj`` into memory. See :func:`voxelData`.
+
+    :arg dataobj:  Array-like (e.g. a ``nibabel`` ``ArrayProxy``) which
+                   supports slicing with ``slice`` objects.
+    :arg mask:     Boolean ``numpy`` array, with the same shape as the
+                   leading dimensions of ``dataobj``.
+    :arg nbytes:   Maximum number of bytes to read at a time.
+    :arg itemsize: Number of bytes per element of ``dataobj``.
+    :returns:      A ``numpy`` array of shape ``(nvoxels,) +
+                   dataobj.shape[mask.ndim:]``, with the voxels in the same
+                   order as would be returned by ``data[mask]``.
+    """
+    return voxelData(dataobj, np.nonzero(mask), nbytes, itemsize)
+
+
+def voxelData(dataobj, coords, nbytes, itemsize):
+    """Extracts the values at the given voxel ``coords`` from ``dataobj``,
+    without reading all of ``dataobj`` into memory.
+
+    The data is read in slabs along the last coordinate dimension, each of
+    which contains at most (approximately) ``nbytes`` bytes. Only the
+    bounding box of the voxels within each slab is read. Slabs which do not
+    contain any voxels are not read at all.
+
+    :arg dataobj:  Array-like (e.g. a ``nibabel`` ``ArrayProxy``) which
+                   supports slicing with ``slice`` objects.
+    :arg coords:   Sequence of integer ``numpy`` arrays, one for each
+                   leading dimension of ``dataobj``, containing the voxel
+                   coordinates, in any order (e.g. as returned by
+                   ``numpy.nonzero``).
+    :arg nbytes:   Maximum number of bytes to read at a time.
+    :arg itemsize: Number of bytes per element of ``dataobj``.
+    :returns:      A ``numpy`` array of shape ``(nvoxels,) +
+                   dataobj.shape[len(coords):]``, with the voxels in the
+                   same order as would be returned by ``data[coords]``.
+    """
+
+    coords   = [np.asarray(c, dtype=np.intp) for c in coords]
+    shape    = tuple(dataobj.shape)
+    trailing = shape[len(coords):]
+    nvoxels  = len(coords[0])
+    rest     = (slice(None),) * len(trailing)
+
+    if nvoxels == 0:
+        dtype = np.asanyarray(dataobj[(0,) * len(shape)]).dtype
+        return np.zeros((0,) + trailing, dtype=dtype)
+
+    # Figure out how many slices along
+    # the last axis we can read at a time
+    axis     = len(coords) - 1
+    lo       = [int(c.min())     for c in coords]
+    hi       = [int(c.max()) + 1 for c in coords]
+    slcsize  = itemsize * np.prod([h - l for h, l in zip(hi[:axis], lo[:axis])])
+    slcsize *= np.prod(trailing)
+    step     = max(1, int(nbytes // max(1, slcsize)))
+    result   = None
+
+    for start in range(lo[axis], hi[axis], step):
+
+        # Indices into the result
+        # of the voxels within this slab
+        stop = min(start + step, hi[axis])
+        idxs = np.flatnonzero((coords[axis] >= start) &
+                              (coords[axis] <  stop))
+
+        if len(idxs) == 0:
+            continue
+
+        box    = tuple(slice(int(c[idxs].min()), int(c[idxs].max()) + 1)
+                       for c in coords)
+        slab   = np.asanyarray(dataobj[box + rest])
+        values = slab[tuple(c[idxs] - b.start for c, b in zip(coords, box))]
+
+        if result is None:
+            result = np.empty((nvoxels,) + trailing, dtype=values.dtype)
+
+        result[idxs] = values
+
+    return result
+
+
 def adjustCoverage(oldCoverage, slices):
     """Adjusts/expands the given ``oldCoverage`` so that it covers the
     given set of ``slices``.
 
     :arg oldCoverage: A ``numpy`` array of shape ``(2, n)`` containing
                       the (low, high) index pairs for ``n`` dimensions of
-                      a single slice/volume in the image.
+                      a single slice/volume in the image, or of shape
+                      ``(2, n, nv)``, containing the coverage of ``nv``
+                      slices/volumes, all of which are adjusted.
 
     :arg slices:      A sequence of (low, high) index pairs. If ``slices``
                       contains more dimensions than are specified in
@@ -883,17 +2476,15 @@ def adjustCoverage(oldCoverage, slices):
     :return: A ``numpy`` array containing the adjusted/expanded coverage.
     """
 
-    newCoverage = np.zeros(oldCoverage.shape, dtype=oldCoverage.dtype)
-
-    for dim in range(oldCoverage.shape[1]):
-
-        low,      high      = slices[        dim]
-        lowCover, highCover = oldCoverage[:, dim]
+    numDims     = oldCoverage.shape[1]
+    slices      = np.asarray(slices, dtype=np.float64)[:numDims]
+    bcastShape  = (numDims,) + (1,) * (oldCoverage.ndim - 2)
+    newCoverage = np.empty(oldCoverage.shape, dtype=oldCoverage.dtype)
 
-        if np.isnan(lowCover)  or low  < lowCover:  lowCover  = low
-        if np.isnan(highCover) or high > highCover: highCover = high
-
-        newCoverage[:, dim] = lowCover, highCover
+    # fmin/fmax ignore nans, so dimensions
+    # with no coverage take on the slices
+    newCoverage[0] = np.fmin(oldCoverage[0], slices[:, 0].reshape(bcastShape))
+    newCoverage[1] = np.fmax(oldCoverage[1], slices[:, 1].reshape(bcastShape))
 
     return newCoverage
 
@@ -940,47 +2531,30 @@ def sliceOverlap(slices, coverage):
     numDims         = coverage.shape[1]
     lowVol, highVol = slices[numDims]
 
-    # Overlap state is calculated for each volume
-    overlapStates = np.zeros(highVol - lowVol)
-
-    for i, vol in enumerate(range(lowVol, highVol)):
-
-        state = OVERLAP_ALL
-
-        for dim in range(numDims):
+    # Overlap state is calculated for each
+    # volume, over arrays of shape (nd, nv)
+    lowSlice, highSlice = _sliceBounds(slices, numDims)
+    lowCover, highCover = coverage[:, :, lowVol:highVol]
 
-            lowCover, highCover = coverage[:, dim, vol]
-            lowSlice, highSlice = slices[     dim]
+    # The slice is contained within the
+    # coverage, or does not overlap at
+    # all with the coverage, on each
+    # dimension. No coverage on any
+    # dimension means no overlap.
+    contained = (lowSlice >= lowCover) & (highSlice <= highCover)
+    disjoint  = (lowSlice >= highCover) | (highSlice <= lowCover)
+    nocover   = np.isnan(lowCover) | np.isnan(highCover)
 
-            # No coverage
-            if np.isnan(lowCover) or np.isnan(highCover):
-                state = OVERLAP_NONE
-                break
-
-            # The slice is contained within the
-            # coverage on this dimension - check
-            # the other dimensions.
-            if lowSlice >= lowCover and highSlice <= highCover:
-                continue
+    none = np.any(nocover | (disjoint & ~contained), axis=0)
+    some = ~none & np.any(~contained, axis=0)
 
-            # The slice does not overlap at all
-            # with the coverage on this dimension
-            # (or at all). No overlap - no need
-            # to check the other dimensions.
-            if lowSlice >= highCover or highSlice <= lowCover:
-                state = OVERLAP_NONE
-                break
+    if   np.any(some): return OVERLAP_SOME
+    elif np.all(none): return OVERLAP_NONE
+    elif not np.any(none): return OVERLAP_ALL
 
-            # There is some overlap between the
-            # slice and coverage on this dimension
-            # - check the other dimensions.
-            state = OVERLAP_SOME
-
-        overlapStates[i] = state
-
-    if   np.any(overlapStates == OVERLAP_SOME): return OVERLAP_SOME
-    elif np.all(overlapStates == OVERLAP_NONE): return OVERLAP_NONE
-    elif np.all(overlapStates == OVERLAP_ALL):  return OVERLAP_ALL
+    # Some volumes are wholly covered, and
+    # others are not covered at all
+    return None
 
 
 def sliceCovered(slices, coverage):
@@ -996,23 +2570,59 @@ def sliceCovered(slices, coverage):
                     the current image coverage.
     """
 
-    numDims         = coverage.shape[1]
-    lowVol, highVol = slices[numDims]
+    numDims             = coverage.shape[1]
+    lowVol, highVol     = slices[numDims]
+    lowSlice, highSlice = _sliceBounds(slices, numDims)
+    lowCover, highCover = coverage[:, :, lowVol:highVol]
 
-    for vol in range(lowVol, highVol):
+    # Comparisons with nan are always
+    # False, so uncovered volumes fail
+    return bool(np.all(lowSlice  >= lowCover) and
+                np.all(highSlice <= highCover))
 
-        for dim in range(numDims):
 
-            lowCover, highCover = coverage[:, dim, vol]
-            lowSlice, highSlice = slices[     dim]
+def _sliceBounds(slices, numDims):
+    """Used by :func:`sliceOverlap` and :func:`sliceCovered`. Returns the
+    low and high indices of the first ``numDims`` dimensions of ``slices``,
+    as two ``numpy`` arrays of shape ``(numDims, 1)``, which can be
+    broadcast against a coverage array.
+    """
+    bounds = np.array(slices[:numDims], dtype=np.float64).reshape(numDims, 2)
+    return bounds[:, :1], bounds[:, 1:]
 
-            if np.isnan(lowCover) or np.isnan(highCover):
-                return False
 
-            if lowSlice  < lowCover:  return False
-            if highSlice > highCover: return False
+def coverageGroups(coverage):
+    """Groups the slices/volumes in the given ``coverage`` which have
+    identical coverage.
 
-    return True
+    :arg coverage: A ``numpy`` array of shape ``(2, nd, nv)`` containing the
+                   (low, high) index pairs describing the coverage of ``nv``
+                   slices/volumes.
+
+    :returns:      A tuple containing:
+
+                    - A list of ``(2, nd)`` arrays, the distinct coverages
+                    - An array of length ``nv``, containing the index into
+                      the list for each slice/volume.
+    """
+
+    numVols = coverage.shape[2]
+
+    if numVols == 0:
+        return [], np.zeros(0, dtype=int)
+
+    # Indices are never negative,
+    # so -1 is a safe stand-in for
+    # nan (which np.unique does not
+    # consider to be equal to itself)
+    keys = np.nan_to_num(coverage, nan=-1).reshape(-1, numVols).T
+
+    _, first, inverse = np.unique(keys,
+                                  axis=0,
+                                  return_index=True,
+                                  return_inverse=True)
+
+    return [coverage[:, :, i] for i in first], inverse.reshape(-1)
 
 
 def calcExpansion(slices, coverage):
@@ -1033,156 +2643,170 @@ def calcExpansion(slices, coverage):
     expansions = []
     volumes    = []
 
-    # Finish off an expansion by
+    # Volumes with identical coverage have
+    # identical expansions, so they are only
+    # calculated once for each distinct
+    # coverage.
+    groups, inverse = coverageGroups(coverage[:, :, lowVol:highVol])
+    groupExps       = [_volumeExpansions(slices, cov) for cov in groups]
+
+    # Finish off each expansion by
     # adding indices for the vector/
     # slice/volume dimension, and for
     # 'padding' dimensions of size 1.
-    def finishExpansion(exp, vol):
-        exp.append((vol, vol + 1))
-        for _ in range(padDims):
-            exp.append((0, 1))
-        return exp
-
-    for vol in range(lowVol, highVol):
-
-        # No coverage of this volume -
-        # we need the whole slice.
-        if np.any(np.isnan(coverage[:, :, vol])):
-            exp = [(s[0], s[1]) for s in slices[:numDims]]
-            exp = finishExpansion(exp, vol)
+    padding = [(0, 1)] * padDims
+
+    for vol, group in zip(range(lowVol, highVol), inverse):
+        for exp in groupExps[group]:
             volumes   .append(vol)
-            expansions.append(exp)
-            continue
+            expansions.append(exp + [(vol, vol + 1)] + padding)
 
-        # First we'll figure out the index
-        # range for each dimension that
-        # needs to be added to the coverage.
-        # We build a list of required ranges,
-        # where each entry is a tuple
-        # containing:
-        #   (dimension, lowIndex, highIndex)
-        reqRanges = []
-
-        for dim in range(numDims):
-
-            lowCover, highCover = coverage[:, dim, vol]
-            lowSlice, highSlice = slices[     dim]
-
-            # The slice covers a region
-            # below the current coverage
-            if lowCover - lowSlice > 0:
-                reqRanges.append((dim, int(lowSlice), int(lowCover)))
-
-            # The slice covers a region
-            # above the current coverage
-            if highCover - highSlice < 0:
-                reqRanges.append((dim, int(highCover), int(highSlice)))
-
-        # Now we generate an expansion for
-        # each of those ranges.
-        volExpansions = []
-        for dimx, xlo, xhi in reqRanges:
-
-            expansion = [[np.nan, np.nan] for d in range(numDims)]
-
-            # The expansion for each
-            # dimension will span the range
-            # for that dimension...
-            expansion[dimx][0] = xlo
-            expansion[dimx][1] = xhi
-
-            # And will span the union of
-            # the coverage, and calculated
-            # range for every other dimension.
-            for dimy, ylo, yhi in reqRanges:
-                if dimy == dimx:
-                    continue
+    return volumes, expansions
 
-                yLowCover, yHighCover = coverage[:, dimy, vol]
-                expLow,    expHigh    = expansion[  dimy]
 
-                if np.isnan(expLow):  expLow  = yLowCover
-                if np.isnan(expHigh): expHigh = yHighCover
+def _volumeExpansions(slices, coverage):
+    """Used by :func:`calcExpansion`. Calculates the expansions needed to
+    expand the coverage of a single slice/volume so that it includes the
+    given ``slices``.
 
-                expLow  = min((ylo, yLowCover,  expLow))
-                expHigh = max((yhi, yHighCover, expHigh))
+    :arg slices:   Slices that the coverage needs to be expanded to cover.
+    :arg coverage: A ``(2, nd)`` array containing the coverage of the
+                   slice/volume.
 
-                expansion[dimy][0] = int(expLow)
-                expansion[dimy][1] = int(expHigh)
+    :returns:      A list of expansions, each a list of ``nd`` ``(low,
+                   high)`` tuples.
+    """
 
-            # If no range exists for any of the
-            # other dimensions, the range for
-            # all expansions will be the current
-            # coverage
-            for dimy in range(numDims):
-                if dimy == dimx:
-                    continue
+    numDims = coverage.shape[1]
+
+    # No coverage of this volume -
+    # we need the whole slice.
+    if np.any(np.isnan(coverage)):
+        return [[(s[0], s[1]) for s in slices[:numDims]]]
+
+    # First we'll figure out the index
+    # range for each dimension that
+    # needs to be added to the coverage.
+    # We build a list of required ranges,
+    # where each entry is a tuple
+    # containing:
+    #   (dimension, lowIndex, highIndex)
+    reqRanges = []
+
+    for dim in range(numDims):
+
+        lowCover, highCover = coverage[:, dim]
+        lowSlice, highSlice = slices[     dim]
+
+        # The slice covers a region
+        # below the current coverage
+        if lowCover - lowSlice > 0:
+            reqRanges.append((dim, int(lowSlice), int(lowCover)))
+
+        # The slice covers a region
+        # above the current coverage
+        if highCover - highSlice < 0:
+            reqRanges.append((dim, int(highCover), int(highSlice)))
+
+    # Now we generate an expansion for
+    # each of those ranges.
+    volExpansions = []
+    for dimx, xlo, xhi in reqRanges:
+
+        expansion = [[np.nan, np.nan] for d in range(numDims)]
+
+        # The expansion for each
+        # dimension will span the range
+        # for that dimension...
+        expansion[dimx][0] = xlo
+        expansion[dimx][1] = xhi
+
+        # And will span the union of
+        # the coverage, and calculated
+        # range for every other dimension.
+        for dimy, ylo, yhi in reqRanges:
+            if dimy == dimx:
+                continue
 
-                if np.any(np.isnan(expansion[dimy])):
-                    expansion[dimy] = [int(c) for c in coverage[:, dimy, vol]]
+            yLowCover, yHighCover = coverage[:, dimy]
+            expLow,    expHigh    = expansion[  dimy]
 
-            # Finish off this expansion
-            expansion = finishExpansion(expansion, vol)
+            if np.isnan(expLow):  expLow  = yLowCover
+            if np.isnan(expHigh): expHigh = yHighCover
 
-            volumes.      append(vol)
-            volExpansions.append(expansion)
+            expLow  = min((ylo, yLowCover,  expLow))
+            expHigh = max((yhi, yHighCover, expHigh))
 
-        # We do a final run through all pairs
-        # of expansions, and adjust their
-        # range if they overlap with each other.
-        for exp1, exp2 in it.product(volExpansions, volExpansions):
+            expansion[dimy][0] = int(expLow)
+            expansion[dimy][1] = int(expHigh)
 
-            # Check each dimension
-            for dimx in range(numDims):
+        # If no range exists for any of the
+        # other dimensions, the range for
+        # all expansions will be the current
+        # coverage
+        for dimy in range(numDims):
+            if dimy == dimx:
+                continue
 
-                xlo1, xhi1 = exp1[dimx]
-                xlo2, xhi2 = exp2[dimx]
+            if np.any(np.isnan(expansion[dimy])):
+                expansion[dimy] = [int(c) for c in coverage[:, dimy]]
 
-                # These expansions do not
-                # overlap with each other
-                # on this dimension (or at
-                # all). No need to check
-                # the other dimensions.
-                if xhi1 <= xlo2: break
-                if xlo1 >= xhi2: break
+        volExpansions.append(expansion)
 
-                # These expansions overlap on
-                # this dimension - check to see
-                # if exp1 is wholly contained
-                # within exp2 in all other
-                # dimensions.
-                adjustable = True
+    # We do a final run through all pairs
+    # of expansions, and adjust their
+    # range if they overlap with each other.
+    for exp1, exp2 in it.product(volExpansions, volExpansions):
 
-                for dimy in range(numDims):
+        # Check each dimension
+        for dimx in range(numDims):
 
-                    if dimy == dimx:
-                        continue
+            xlo1, xhi1 = exp1[dimx]
+            xlo2, xhi2 = exp2[dimx]
 
-                    ylo1, yhi1 = exp1[dimy]
-                    ylo2, yhi2 = exp2[dimy]
+            # These expansions do not
+            # overlap with each other
+            # on this dimension (or at
+            # all). No need to check
+            # the other dimensions.
+            if xhi1 <= xlo2: break
+            if xlo1 >= xhi2: break
 
-                    # Exp1 is not contained within
-                    # exp2 on another dimension -
-                    # we can't reduce the overlap.
-                    if ylo1 < ylo2 or yhi1 > yhi2:
-                        adjustable = False
-                        break
+            # These expansions overlap on
+            # this dimension - check to see
+            # if exp1 is wholly contained
+            # within exp2 in all other
+            # dimensions.
+            adjustable = True
 
-                # The x dimension range of exp1
-                # can be reduced, as it is covered
-                # by exp2.
-                if adjustable:
-                    if   xlo1 <  xlo2 and xhi1 <= xhi2 and xhi1 > xlo2:
-                        xhi1 = xlo2
+            for dimy in range(numDims):
 
-                    elif xlo1 >= xlo2 and xhi1 >  xhi2 and xlo1 < xhi2:
-                        xlo1 = xhi2
+                if dimy == dimx:
+                    continue
 
-                    exp1[dimx] = xlo1, xhi1
+                ylo1, yhi1 = exp1[dimy]
+                ylo2, yhi2 = exp2[dimy]
 
-        expansions.extend(volExpansions)
+                # Exp1 is not contained within
+                # exp2 on another dimension -
+                # we can't reduce the overlap.
+                if ylo1 < ylo2 or yhi1 > yhi2:
+                    adjustable = False
+                    break
 
-    return volumes, expansions
+            # The x dimension range of exp1
+            # can be reduced, as it is covered
+            # by exp2.
+            if adjustable:
+                if   xlo1 <  xlo2 and xhi1 <= xhi2 and xhi1 > xlo2:
+                    xhi1 = xlo2
+
+                elif xlo1 >= xlo2 and xhi1 >  xhi2 and xlo1 < xhi2:
+                    xlo1 = xhi2
+
+                exp1[dimx] = xlo1, xhi1
+
+    return [[tuple(r) for r in exp] for exp in volExpansions]
 
 
 def collapseExpansions(expansions, numDims):
@@ -1220,20 +2844,20 @@ def collapseExpansions(expansions, numDims):
             commonExps            = []
             commonExpansions[exp] = commonExps
 
-        for i, (vlo, vhi) in enumerate(commonExps):
-
+        # The expansions are sorted, so the volumes
+        # for each distinct expansion are visited
+        # in ascending order - we only need to
+        # check whether this volume is within, or
+        # adjacent to, the most recent run.
+        if len(commonExps) > 0:
+            vlo, vhi = commonExps[-1]
             if vol >= vlo and vol < vhi:
-                break
-
-            elif vol == vlo - 1:
-                commonExps[i] = vol, vhi
-                break
+                continue
             elif vol == vhi:
-                commonExps[i] = vlo, vol + 1
-                break
+                commonExps[-1] = vlo, vol + 1
+                continue
 
-        else:
-            commonExps.append((vol, vol + 1))
+        commonExps.append((vol, vol + 1))
 
     collapsed = []
 
@@ -0,0 +1,536 @@
+#!/usr/bin/env python
+#
+# imagewriter.py - Writing large images volume by volume.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module provides the :class:`ImageWriter` class, which can be used to
+write a NIFTI image to file incrementally, without the image data ever having
+to be held in memory.
+
+
+To save an image with the :class:`.Image` class, all of its data must be in
+memory. An :class:`ImageWriter` instead writes the image header to file up
+front, and then writes the image data as it is provided, via the
+:meth:`ImageWriter.append` and :meth:`ImageWriter.write` methods. This makes
+it possible to create a large 4D image in constant memory, e.g. by processing
+the volumes of an input image one at a time::
+
+    import fsl.data.image       as fslimage
+    import fsl.data.imagewriter as imagewriter
+
+    img = fslimage.Image('bold.nii.gz', loadData=False)
+
+    with imagewriter.ImageWriter('bold_smooth.nii.gz', img) as writer:
+        for slc, vol in img.iterVolumes():
+            writer.write(slc, smooth(vol))
+
+
+``.nii`` and ``.nii.gz`` files can be written. ``.nii.gz`` files are
+compressed in parallel with a :class:`.pgzip.GzipWriter`.
+
+
+When the ``ImageWriter`` is closed, the image dimensions in the header are
+set according to the number of volumes that have been written, and the
+``cal_min`` and ``cal_max`` header fields are set to the range of the data
+that has been written. Until then, the image is written to a temporary file
+alongside the destination, which is renamed into place when the
+``ImageWriter`` is closed (see :func:`.image.saveNibImageAtomic`). If an
+error occurs within a ``with`` block, the temporary file is deleted, and
+any existing file is left untouched.
+
+
+.. note:: Data is written as-is, after being cast to the data type of the
+          output image - the ``scl_slope`` and ``scl_inter`` header fields
+          of the output image are cleared. Values written to an integer
+          image are rounded and clipped to the range of its data type.
+
+
+.. note:: A ``.nii.gz`` file is written sequentially, so data must be
+          written in order - each :meth:`ImageWriter.write` must be located
+          at or after the end of the preceding one. Any gaps are filled with
+          zeros. Data may be written in any order to a ``.nii`` file.
+"""
+
+
+import                          io
+import                          logging
+import                          os
+import os.path               as op
+import                          uuid
+
+import numpy                 as np
+import nibabel               as nib
+
+import fsl.data.image        as fslimage
+import fsl.utils.pgzip       as pgzip
+import fsl.utils.naninfrange as nir
+
+
+log = logging.getLogger(__name__)
+
+
+class ImageWriter(object):
+    """Writes a NIFTI image to a ``.nii`` or ``.nii.gz`` file incrementally.
+    See the module documentation for more details.
+
+    The output image is treated as a 4D image, whose volumes each have the
+    shape of the first three dimensions of the reference header. Its fourth
+    dimension grows as volumes are written.
+
+    An ``ImageWriter`` should be used as a context manager, or its
+    :meth:`close` method must be called once all data has been written.
+    It is not safe to use an ``ImageWriter`` from multiple threads.
+    """
+
+
+    def __init__(self,
+                 filename,
+                 header,
+                 shape=None,
+                 dtype=None,
+                 threads=None,
+                 level=None):
+        """Create an ``ImageWriter``.
+
+        :arg filename: File to write to. If it does not have a file extension,
+                       the default extension is used (see
+                       :func:`.image.defaultExt`). Must be a ``.nii`` or
+                       ``.nii.gz`` file.
+
+        :arg header:   Reference :class:`.Nifti` / :class:`.Image`, or
+                       ``nibabel`` header, which is used as the basis for the
+                       output image header.
+
+        :arg shape:    Image shape. Defaults to the shape in ``header``. Only
+                       the first three dimensions are used - the number of
+                       volumes is determined by the data that is written. A
+                       3D image is written if ``shape`` has fewer than four
+                       dimensions, and only one volume is written.
+
+        :arg dtype:    Output data type. Defaults to the data type in
+                       ``header``.
+
+        :arg threads:  Number of compression threads, for ``.nii.gz`` files.
+                       Defaults to :attr:`.pgzip.THREADS`.
+
+        :arg level:    Compression level, for ``.nii.gz`` files. Defaults to
+                       :attr:`.pgzip.LEVEL`.
+        """
+
+        if isinstance(header, fslimage.Nifti):
+            header = header.header
+
+        if not fslimage.looksLikeImage(filename):
+            filename = fslimage.addExt(filename, mustExist=False)
+
+        # Write through symlinks, rather than
+        # replacing them (as saveNibImageAtomic)
+        prefix, suffix = fslimage.splitExt(op.realpath(filename))
+
+        if suffix not in ('.nii', '.nii.gz'):
+            raise ValueError('ImageWriter can only write .nii and .nii.gz '
+                             'files: {}'.format(filename))
+
+        # Convert to a single file NIFTI
+        # header - a NIFTI2 header is
+        # retained, anything else is
+        # converted to NIFTI1
+        if isinstance(header, nib.Nifti2Header): hdrType = nib.Nifti2Header
+        else:                                    hdrType = nib.Nifti1Header
+
+        header = hdrType.from_header(header)
+
+        if shape is None: shape = header.get_data_shape()
+        if dtype is None: dtype = header.get_data_dtype()
+
+        shape = tuple(shape)
+
+        if len(shape) > 4:
+            raise ValueError('ImageWriter can only write images with up '
+                             'to four dimensions: {}'.format(shape))
+
+        header.set_data_dtype(dtype)
+        header.set_data_shape(shape)
+        header.set_slope_inter(1, 0)
+
+        volShape = shape[:3] + (1,) * (3 - len(shape[:3]))
+        dirname  = op.dirname(prefix)
+        basename = op.basename(prefix)
+        tmpfile  = op.join(dirname, '.{}.{}{}'.format(
+            basename, uuid.uuid4().hex, suffix))
+
+        self.__filename   = prefix + suffix
+        self.__tmpfile    = tmpfile
+        self.__compressed = suffix == '.nii.gz'
+        self.__header     = header
+        self.__shape      = shape
+        self.__volShape   = volShape
+        self.__volSize    = int(np.prod(volShape))
+        self.__dtype      = header.get_data_dtype()
+        self.__range      = (np.nan, np.nan)
+        self.__nvols      = 0
+        self.__closed     = False
+
+        # The size of the header block
+        # (including extensions) will
+        # not change, so we can write
+        # it now, and re-write it with
+        # the final dimensions on close.
+        hdrbytes          = self.__headerBytes()
+        self.__voxOffset  = len(hdrbytes)
+        self.__fobj       = open(tmpfile, 'wb+')
+
+        try:
+            # .nii.gz files are written as two
+            # gzip members - the uncompressed
+            # header, which has a fixed size
+            # so can be re-written on close,
+            # followed by the compressed data.
+            if self.__compressed:
+                self.__fobj.write(ImageWriter.__storedMember(hdrbytes))
+                self.__dataStart = self.__fobj.tell()
+                self.__gzfobj    = pgzip.GzipWriter(fileobj=self.__fobj,
+                                                    threads=threads,
+                                                    level=level)
+            else:
+                self.__fobj.write(hdrbytes)
+                self.__dataStart = self.__voxOffset
+                self.__gzfobj    = None
+
+        except Exception:
+            self.__fobj.close()
+            os.remove(tmpfile)
+            raise
+
+        log.debug('Writing %s to temporary file %s', filename, tmpfile)
+
+
+    def __enter__(self):
+        """Context manager entry - returns this ``ImageWriter``. """
+        return self
+
+
+    def __exit__(self, exc_type, *args):
+        """Context manager exit - calls :meth:`close`, or :meth:`abort` if
+        an error has occurred.
+        """
+        if exc_type is None: self.close()
+        else:                self.abort()
+
+
+    def __del__(self):
+        """Discards the temporary file if this ``ImageWriter`` has not been
+        closed.
+        """
+        if not getattr(self, '_ImageWriter__closed', True):
+            self.abort()
+
+
+    @property
+    def filename(self):
+        """Returns the name of the file that is being written. """
+        return self.__filename
+
+
+    @property
+    def closed(self):
+        """Returns ``True`` if this ``ImageWriter`` has been closed or
+        aborted.
+        """
+        return self.__closed
+
+
+    @property
+    def dtype(self):
+        """Returns the ``numpy`` data type of the output image. """
+        return self.__dtype
+
+
+    @property
+    def nvols(self):
+        """Returns the number of volumes that have been written so far. """
+        return self.__nvols
+
+
+    @property
+    def shape(self):
+        """Returns the current shape of the output image, according to the
+        number of volumes that have been written so far.
+        """
+        if self.__nvols == 1 and len(self.__shape) < 4:
+            return self.__shape
+        return self.__volShape + (self.__nvols,)
+
+
+    @property
+    def dataRange(self):
+        """Returns the ``(min, max)`` range of the data written so far, or
+        ``(None, None)`` if no (finite) data has been written.
+        """
+        low, high = self.__range
+        if np.isnan(low):
+            return None, None
+        return float(low), float(high)
+
+
+    def append(self, volume):
+        """Writes ``volume`` after the last volume that has been written.
+
+        :arg volume: ``numpy`` array containing the data for one volume -
+                     it must have the same number of elements as one
+                     volume (the first three dimensions of the image).
+        """
+        volume = np.asanyarray(volume)
+        if volume.size != self.__volSize:
+            raise ValueError('Volume has wrong size ({} != {})'.format(
+                volume.shape, self.__volShape))
+        volume = volume.reshape(self.__volShape, order='F')
+        self.write((slice(None),) * 3 + (self.__nvols,), volume)
+
+
+    def write(self, slc, data):
+        """Writes ``data`` at the location specified by ``slc``.
+
+        :arg slc:  Index into the image - a tuple of integers and/or
+                   ``slice`` objects, e.g. as yielded by
+                   :meth:`.Image.iterVolumes`. The selected region must be
+                   contiguous on disk - i.e. it may span entire volumes, or
+                   entire slices within one volume, etc. The volume index
+                   must be given explicitly if it is a ``slice``.
+
+        :arg data: Data to write - must be broadcastable to the shape of the
+                   region selected by ``slc``.
+        """
+
+        if self.__closed:
+            raise ValueError('ImageWriter is closed')
+
+        bounds, isint = self.__sliceTuple(slc)
+        start         = ImageWriter.__contiguousOffset(
+            bounds, self.__volShape + (np.inf,))
+
+        if start is None:
+            raise IndexError('Region is not contiguous on disk: '
+                             '{}'.format(slc))
+
+        # As with numpy indexing, dimensions
+        # which are indexed with an integer
+        # are dropped.
+        shape  = tuple(hi - lo for lo, hi in bounds)
+        bshape = tuple(n for n, i in zip(shape, isint) if not i)
+        data   = np.broadcast_to(np.asanyarray(data), bshape).reshape(shape)
+
+        if data.size == 0:
+            return
+
+        # Values written to an integer image
+        # are rounded and clipped to the
+        # range of the data type.
+        dtype = self.__dtype
+        if np.issubdtype(dtype, np.integer) and \
+           not np.can_cast(data.dtype, dtype):
+            info = np.iinfo(dtype)
+            if not np.issubdtype(data.dtype, np.integer):
+                data = np.round(data)
+            data = np.clip(data, info.min, info.max)
+
+        # The data range is calculated
+        # from the values as they are
+        # stored in the file
+        data         = np.asfortranarray(data, dtype=dtype)
+        low, high    = nir.naninfrange(data)
+        self.__range = (np.fmin(self.__range[0], low),
+                        np.fmax(self.__range[1], high))
+
+        # Write the data in file (fortran)
+        # order, as raw bytes.
+        data   = data.T.reshape(-1).view(np.uint8)
+        offset = start * self.__dtype.itemsize
+
+        if self.__compressed:
+            if offset < self.__gzfobj.tell():
+                raise ValueError('Data must be written to .nii.gz files in '
+                                 'order: {}'.format(slc))
+            self.__gzfobj.seek(offset)
+            self.__gzfobj.write(data)
+        else:
+            self.__fobj.seek(self.__dataStart + offset)
+            self.__fobj.write(data)
+
+        self.__nvols = max(self.__nvols, bounds[3][1])
+
+
+    def close(self):
+        """Writes the final image header, and moves the image file into
+        place. Any volumes which have not been fully written are filled
+        with zeros.
+        """
+
+        if self.__closed:
+            return
+
+        self.__closed = True
+        fileSize      = self.__nvols * self.__volSize * self.__dtype.itemsize
+
+        try:
+            if self.__compressed:
+                self.__gzfobj.seek(fileSize)
+                self.__gzfobj.close()
+            else:
+                self.__fobj.truncate(self.__dataStart + fileSize)
+
+            self.__header.set_data_shape(self.shape)
+
+            low, high = self.dataRange
+            if low is not None:
+                self.__header['cal_min'] = low
+                self.__header['cal_max'] = high
+
+            hdrbytes = self.__headerBytes()
+            if self.__compressed:
+                hdrbytes = ImageWriter.__storedMember(hdrbytes)
+
+            if len(hdrbytes) != self.__dataStart:
+                raise RuntimeError('Header block size has changed '
+                                   '({} != {})'.format(len(hdrbytes),
+                                                       self.__dataStart))
+
+            self.__fobj.seek(0)
+            self.__fobj.write(hdrbytes)
+            self.__fobj.close()
+            os.replace(self.__tmpfile, self.__filename)
+
+        except Exception:
+            self.__discard()
+            raise
+
+        log.debug('Wrote %s (shape: %s, range: %s)',
+                  self.__filename, self.shape, self.dataRange)
+
+
+    def abort(self):
+        """Stops writing, and deletes the temporary file. The destination
+        file is not created or modified.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        self.__discard()
+
+
+    def __discard(self):
+        """Closes and deletes the temporary file. """
+        try:
+            if self.__gzfobj is not None:
+                self.__gzfobj.close()
+            self.__fobj.close()
+        finally:
+            if op.exists(self.__tmpfile):
+                os.remove(self.__tmpfile)
+
+
+    def __headerBytes(self):
+        """Returns the header block, including any extensions, as ``bytes``.
+        """
+        buf = io.BytesIO()
+
+        # Make nibabel calculate
+        # the data offset
+        self.__header['vox_offset'] = 0
+        self.__header.write_to(buf)
+
+        hdrbytes = buf.getvalue()
+        padding  = int(self.__header['vox_offset']) - len(hdrbytes)
+
+        return hdrbytes + bytes(max(0, padding))
+
+
+    @staticmethod
+    def __storedMember(data):
+        """Returns ``data`` as an uncompressed ``gzip`` member. The size of
+        the member depends only on the size of ``data``.
+        """
+        buf = io.BytesIO()
+        with pgzip.GzipWriter(fileobj=buf, level=0, threads=1) as gzf:
+            gzf.write(data)
+        return buf.getvalue()
+
+
+    def __sliceTuple(self, slc):
+        """Converts ``slc`` into a sequence of ``(low, high)`` tuples, one
+        for each of the four image dimensions. Also returns a sequence of
+        booleans, indicating which dimensions were indexed with an integer.
+        """
+
+        if not isinstance(slc, tuple):
+            slc = (slc,)
+
+        if len(slc) > 4:
+            raise IndexError('Too many indices: {}'.format(slc))
+
+        slc    = slc + (slice(None),) * (4 - len(slc))
+        bounds = []
+        isint  = []
+
+        for dim, s in enumerate(slc):
+
+            if dim < 3: size = self.__volShape[dim]
+            else:       size = None
+
+            if isinstance(s, (int, np.integer)) and \
+               not isinstance(s, (bool, np.bool_)):
+                if size is not None and s < 0:
+                    s = s + size
+                if s < 0 or (size is not None and s >= size):
+                    raise IndexError('Index {} out of range for dimension '
+                                     '{}'.format(s, dim))
+                bounds.append((int(s), int(s) + 1))
+                isint .append(True)
+
+            elif isinstance(s, slice):
+                if s.step not in (None, 1):
+                    raise IndexError('Slices with a step are not '
+                                     'supported: {}'.format(slc))
+                if size is None:
+                    if s.start is None: start = 0
+                    else:               start = s.start
+                    if s.stop is None or s.stop < 0 or start < 0:
+                        raise IndexError('Volume range must be given '
+                                         'explicitly: {}'.format(slc))
+                    bounds.append((int(start), int(max(start, s.stop))))
+                    isint .append(False)
+                else:
+                    start, stop, _ = s.indices(size)
+                    bounds.append((start, max(start, stop)))
+                    isint .append(False)
+
+            else:
+                raise IndexError('Invalid index: {}'.format(slc))
+
+        return bounds, isint
+
+
+    @staticmethod
+    def __contiguousOffset(bounds, shape):
+        """Returns the offset, in elements, of the region specified by
+        ``bounds`` within an image of the given ``shape``, if the region is
+        contiguous in fortran order, or ``None`` if it is not.
+        """
+
+        # All dimensions up to the first partial
+        # dimension must be full, and all after
+        # it must have a length of one.
+        partial = False
+        offset  = 0
+        stride  = 1
+
+        for (lo, hi), size in zip(bounds, shape):
+            if partial and hi - lo > 1:
+                return None
+            if lo != 0 or hi != size:
+                partial = True
+            offset += lo * stride
+            stride *= size
+
+        return int(offset)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+#
+# memorymanager.py - Limit the memory used by in-memory image data.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module provides the :class:`MemoryManager` class, which keeps track
+of the image data that has been loaded into memory by :class:`.ImageWrapper`
+instances, and which unloads the data of the least recently used images when
+a limit is exceeded.
+
+
+The memory manager is disabled by default. It can be enabled via the
+:func:`enable` function, and disabled via the :func:`disable` function::
+
+    import fsl.data.memorymanager as memorymanager
+
+    # Keep at most 2GB of image data in memory
+    memorymanager.enable(2 * 1024 ** 3)
+
+
+While the manager is enabled, every ``ImageWrapper`` which loads its data
+into memory is registered with it. When the total size of all registered
+data exceeds the limit, the data of the least recently accessed images is
+unloaded (see :meth:`.ImageWrapper.unloadData`), until the total is within
+the limit. Only data which can be re-read from file is unloaded - data which
+has been modified, or which does not come from a file, is never unloaded, so
+the limit may be exceeded if there is not enough unmodified data.
+
+Data which has been accessed via :attr:`.Image.data` is also never unloaded
+(see :meth:`.ImageWrapper.pinData`), as the returned array may be a view of
+the in-memory data - any changes made through the view would be lost if the
+data were unloaded and then re-read from file.
+
+Unloading is transparent - the data of an unloaded image is read from file
+when it is next accessed, and the known data range is retained.
+
+The :meth:`MemoryManager.residentBytes` and :meth:`MemoryManager.usage`
+methods can be used to query how much memory is being used, and by which
+images.
+
+
+.. note:: Images which were loaded into memory before the manager was
+          enabled are not tracked until they are next loaded.
+"""
+
+
+import logging
+import threading
+import weakref
+import collections
+
+
+log = logging.getLogger(__name__)
+
+
+MANAGER = None
+"""The :class:`MemoryManager` which is currently in use, or ``None`` if the
+manager is disabled. Use :func:`enable`, :func:`disable` and
+:func:`getManager` rather than accessing this directly.
+"""
+
+
+def enable(limit):
+    """Enable the memory manager.
+
+    :arg limit: Maximum number of bytes of image data to keep in memory.
+    :returns:   The :class:`MemoryManager`.
+    """
+    global MANAGER  # pylint: disable=global-statement
+    disable()
+    MANAGER = MemoryManager(limit)
+    return MANAGER
+
+
+def disable():
+    """Disable the memory manager. Image data which is in memory stays in
+    memory.
+    """
+    global MANAGER  # pylint: disable=global-statement
+    MANAGER = None
+
+
+def getManager():
+    """Returns the :class:`MemoryManager` if it is enabled, ``None``
+    otherwise.
+    """
+    return MANAGER
+
+
+class MemoryManager(object):
+    """The ``MemoryManager`` keeps track of :class:`.ImageWrapper` instances
+    with data in memory, in order of most recent access, and unloads the
+    data of the least recently used images when the total size of their data
+    exceeds a limit. See the module documentation for more details.
+
+    ``ImageWrapper`` instances are registered via :meth:`loaded`, and
+    accesses are recorded via :meth:`accessed`. Only weak references to
+    each ``ImageWrapper`` are held.
+    """
+
+
+    def __init__(self, limit):
+        """Create a ``MemoryManager``.
+
+        :arg limit: Maximum number of bytes of image data to keep in memory.
+        """
+        self.__limit    = limit
+        self.__wrappers = collections.OrderedDict()
+        self.__lock     = threading.RLock()
+
+
+    @property
+    def limit(self):
+        """Returns the maximum number of bytes of image data to keep in
+        memory.
+        """
+        return self.__limit
+
+
+    @limit.setter
+    def limit(self, limit):
+        """Set the maximum number of bytes of image data to keep in memory,
+        unloading image data if necessary.
+        """
+        self.__limit = limit
+        self.enforce()
+
+
+    def __liveWrappers(self):
+        """Returns a list of all registered ``ImageWrapper`` instances which
+        are still alive, least recently used first.
+        """
+        with self.__lock:
+            wrappers = [ref() for ref in self.__wrappers.values()]
+        return [w for w in wrappers if w is not None]
+
+
+    def loaded(self, wrapper):
+        """Must be called when the data of the given ``ImageWrapper`` has
+        been loaded into memory. Registers the ``ImageWrapper``, and unloads
+        the data of other images if the limit has been exceeded.
+        """
+
+        key = id(wrapper)
+
+        def remove(ref):
+            with self.__lock:
+                if self.__wrappers.get(key) is ref:
+                    self.__wrappers.pop(key)
+
+        with self.__lock:
+            self.__wrappers.pop(key, None)
+            self.__wrappers[key] = weakref.ref(wrapper, remove)
+
+        self.enforce(exclude=wrapper)
+
+
+    def accessed(self, wrapper):
+        """Should be called when the data of the given ``ImageWrapper`` is
+        accessed. Marks the ``ImageWrapper`` as the most recently used.
+        """
+        with self.__lock:
+            key = id(wrapper)
+            if key in self.__wrappers:
+                self.__wrappers.move_to_end(key)
+
+
+    def residentBytes(self):
+        """Returns the total number of bytes of image data that are in
+        memory, for all registered images.
+        """
+        return sum(w.residentBytes for w in self.__liveWrappers())
+
+
+    def usage(self):
+        """Returns a list of ``(wrapper, nbytes)`` tuples, containing each
+        registered :class:`.ImageWrapper` with data in memory, and the number
+        of bytes of data it has in memory. The list is ordered from least
+        to most recently used.
+        """
+        usage = [(w, w.residentBytes) for w in self.__liveWrappers()]
+        return [(w, n) for w, n in usage if n > 0]
+
+
+    def enforce(self, exclude=None):
+        """Unloads the data of the least recently used images, until the
+        total size of all data in memory is less than the limit. Images with
+        data which cannot be unloaded are skipped.
+
+        :arg exclude: ``ImageWrapper`` which should not be unloaded.
+        """
+
+        with self.__lock:
+
+            usage = self.usage()
+            total = sum(n for _, n in usage)
+
+            for wrapper, nbytes in usage:
+
+                if total <= self.__limit:
+                    break
+
+                if wrapper is exclude:
+                    continue
+
+                if wrapper.unloadData():
+                    log.debug('Unloaded %s (%u bytes) - %u bytes still '
+                              'in memory', wrapper.name, nbytes,
+                              total - nbytes)
+                    total -= nbytes
+
+            # Forget about images
+            # which are not in memory
+            for wrapper in self.__liveWrappers():
+                if wrapper.residentBytes == 0:
+                    self.__wrappers.pop(id(wrapper), None)
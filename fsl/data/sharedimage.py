@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+#
+# sharedimage.py - Sharing Image data between processes.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module provides the :class:`SharedImage` class, which can be used to
+share the data of an :class:`.Image` with other processes via
+:mod:`multiprocessing.shared_memory`.
+
+.. autosummary::
+   :nosignatures:
+
+   SharedImage
+   ImageHandle
+   attach
+
+
+An :class:`.Image` cannot be passed to a worker process - it cannot be
+pickled, and even if it could, its data would be copied into every worker.
+Instead, a :class:`SharedImage` can be created, which copies the image data
+into a shared memory block. Its :attr:`SharedImage.handle` is a small
+picklable :class:`ImageHandle` object, which contains the name of the
+shared memory block, along with the image header, and which can be used to
+re-create the ``Image`` within a worker process::
+
+    import concurrent.futures as futures
+    import fsl.data.image       as fslimage
+    import fsl.data.sharedimage as sharedimage
+
+    def work(handle, vol):
+        img = handle.attach()
+        return img[..., vol].mean()
+
+    img = fslimage.Image('bold.nii.gz')
+
+    with sharedimage.SharedImage(img) as shared, \\
+         futures.ProcessPoolExecutor() as pool:
+        jobs  = [pool.submit(work, shared.handle, v)
+                 for v in range(img.shape[3])]
+        means = [j.result() for j in jobs]
+
+
+Every ``Image`` which is attached to the same shared memory block accesses
+the same physical memory - the data is copied once, when the
+``SharedImage`` is created.
+
+
+Lifetime
+--------
+
+
+The process which creates a :class:`SharedImage` owns the shared memory
+block - it is released when :meth:`SharedImage.close` is called (or when
+the ``SharedImage`` is used as a context manager and the ``with`` block is
+exited, or when the ``SharedImage`` is garbage-collected). All workers
+should have finished with the data by then.
+
+Within each process, the shared memory block is opened once, regardless of
+how many ``Image`` objects are attached to it, and is closed when all of
+them have been garbage-collected.
+
+Arrays returned by an attached image (e.g. ``img[..., 0]``) may be views of
+the shared memory, and may outlive the image. The shared memory block
+cannot be closed while any such views exist, so closing is deferred - the
+block is closed on a subsequent call to :func:`detach`, after all views
+have been garbage-collected. Any blocks which are still in use when the
+interpreter exits are released by the operating system.
+
+
+.. note:: This module requires Python 3.8 or newer, as it uses the
+          :mod:`multiprocessing.shared_memory` module. On older versions of
+          Python, a ``RuntimeError`` is raised when a :class:`SharedImage`
+          is created, or an image is attached.
+
+
+.. note:: Attached images are read-only by default - an attempt to modify
+          their data will result in a ``ValueError``. A writable image
+          may be requested via the ``writeable`` argument to
+          :func:`attach`, in which case modifications are visible to all
+          processes. No locking is performed, so it is up to you to ensure
+          that processes do not modify the same parts of the image
+          concurrently.
+"""
+
+
+import logging
+import sys
+import threading
+import weakref
+
+import numpy                as np
+
+import fsl.data.image       as fslimage
+import fsl.data.imageheader as imageheader
+
+
+# multiprocessing.shared_memory
+# was added in python 3.8
+try:
+    import multiprocessing.shared_memory as shared_memory
+except ImportError:
+    shared_memory = None
+
+
+log = logging.getLogger(__name__)
+
+
+def checkSharedMemory():
+    """Raises a ``RuntimeError`` if the :mod:`multiprocessing.shared_memory`
+    module is not available (it requires Python 3.8 or newer).
+    """
+    if shared_memory is None:
+        raise RuntimeError('Python 3.8 or newer is required to share '
+                           'image data between processes')
+
+
+if shared_memory is not None:
+
+    class SharedMemory(shared_memory.SharedMemory):
+        """A ``multiprocessing.shared_memory.SharedMemory`` which can be
+        garbage-collected while ``numpy`` views of its buffer are still alive.
+
+        The standard ``SharedMemory`` class tries to close itself when it is
+        garbage-collected, which fails with a ``BufferError`` (printed as an
+        "Exception ignored" message, typically at interpreter exit) if its
+        buffer is still in use. This class ignores that error - the memory
+        is unmapped when the last view is garbage-collected.
+        """
+
+        def __del__(self):
+            try:
+                self.close()
+            except BufferError:
+                pass
+
+
+class ImageHandle(object):
+    """A small picklable object which describes an :class:`.Image` that has
+    been copied into shared memory by a :class:`SharedImage`. An
+    ``ImageHandle`` can be passed to other processes, and turned back into
+    an ``Image`` with the :meth:`attach` method.
+
+    The following attributes are available on an ``ImageHandle``:
+
+     - ``memname``: Name of the shared memory block
+     - ``shape``:   Shape of the image data
+     - ``dtype``:   ``numpy`` data type string
+     - ``header``:  ``bytes`` containing the image header block
+     - ``name``:    Image name
+     - ``dataSource``: Image data source (may be ``None``)
+     - ``meta``:    ``dict`` containing the image metadata (see
+       :class:`.Meta`).
+    """
+
+
+    def __init__(self, memname, shape, dtype, header, name, dataSource, meta):
+        """Create an ``ImageHandle``. You should not need to create an
+        ``ImageHandle`` directly - use :attr:`SharedImage.handle` instead.
+        """
+        self.memname    = memname
+        self.shape      = tuple(shape)
+        self.dtype      = dtype
+        self.header     = header
+        self.name       = name
+        self.dataSource = dataSource
+        self.meta       = meta
+
+
+    def __str__(self):
+        """Return a string representation of this ``ImageHandle``. """
+        return 'ImageHandle({}, {})'.format(self.name, self.memname)
+
+
+    def __repr__(self):
+        """Return a string representation of this ``ImageHandle``. """
+        return str(self)
+
+
+    def attach(self, writeable=False):
+        """Create an :class:`.Image` which accesses the shared image data.
+        See the :func:`attach` function.
+        """
+        return attach(self, writeable)
+
+
+class SharedImage(object):
+    """Copies the data of an :class:`.Image` into a shared memory block, so
+    that it can be accessed by other processes. See the module documentation
+    for more details.
+    """
+
+
+    def __init__(self, image, nbytes=None):
+        """Create a ``SharedImage``.
+
+        The image data is copied into shared memory in slabs (see
+        :meth:`.Image.iterSlabs`), so the image does not need to be
+        loaded into memory.
+
+        :arg image:  :class:`.Image` to share.
+        :arg nbytes: Maximum size, in bytes, of each slab that is copied.
+                     Defaults to :data:`.image.DEFAULT_CHUNK_SIZE`.
+        """
+
+        checkSharedMemory()
+
+        shape  = image.shape
+        dtype  = np.dtype(image.dtype)
+        size   = max(1, int(np.prod(shape)) * dtype.itemsize)
+        mem    = SharedMemory(create=True, size=size)
+
+        try:
+            data = np.ndarray(shape, dtype=dtype, buffer=mem.buf)
+            for slc, slab in image.iterSlabs(nbytes=nbytes):
+                data[slc] = slab
+            del data
+        except Exception:
+            mem.close()
+            mem.unlink()
+            raise
+
+        # The data has already been scaled, so
+        # the header scaling parameters are cleared
+        header = image.header.copy()
+        header.set_data_dtype(dtype)
+        header.set_slope_inter(1, 0)
+
+        log.debug('Copied %s into shared memory block %s (%u bytes)',
+                  image.name, mem.name, size)
+
+        self.__handle   = ImageHandle(mem.name,
+                                      shape,
+                                      dtype.str,
+                                      header.binaryblock,
+                                      image.name,
+                                      image.dataSource,
+                                      dict(image.metaItems()))
+        self.__finalize = weakref.finalize(self, SharedImage.__release, mem)
+
+
+    def __enter__(self):
+        """Context manager entry - returns this ``SharedImage``. """
+        return self
+
+
+    def __exit__(self, *args):
+        """Context manager exit - calls :meth:`close`. """
+        self.close()
+
+
+    @property
+    def handle(self):
+        """Returns an :class:`ImageHandle` which may be passed to other
+        processes.
+        """
+        return self.__handle
+
+
+    @property
+    def closed(self):
+        """Returns ``True`` if this ``SharedImage`` has been closed. """
+        return not self.__finalize.alive
+
+
+    def close(self):
+        """Releases the shared memory block. Images which are attached to
+        the block will continue to work, but new images cannot be attached.
+        """
+        self.__finalize()
+
+
+    @staticmethod
+    def __release(mem):
+        """Closes and unlinks the given shared memory block. """
+        log.debug('Releasing shared memory block %s', mem.name)
+        try:
+            mem.close()
+        except BufferError:
+            log.debug('Shared memory block %s is still in use', mem.name)
+        mem.unlink()
+
+
+ATTACHED = {}
+"""Used by :func:`attach`. Contains a ``[SharedMemory, data, count]`` list
+for every shared memory block which is attached within this process, where
+``data`` is a ``numpy`` array which accesses the shared memory, and
+``count`` is the number of attached images.
+"""
+
+
+ATTACHED_LOCK = threading.Lock()
+"""Used by :func:`attach` to protect access to :data:`ATTACHED`. """
+
+
+def attach(handle, writeable=False):
+    """Create an :class:`.Image` which accesses the shared image data
+    described by ``handle``.
+
+    The data range of the image is not calculated, but is updated as the
+    data is accessed.
+
+    :arg handle:    :class:`ImageHandle` describing the shared image.
+    :arg writeable: If ``True``, the image data can be modified. Defaults to
+                    ``False``.
+    :returns:       A new :class:`.Image`.
+    """
+
+    checkSharedMemory()
+
+    with ATTACHED_LOCK:
+        entry = ATTACHED.get(handle.memname)
+        if entry is None:
+            mem   = openSharedMemory(handle.memname)
+            dtype = np.dtype(handle.dtype)
+            count = int(np.prod(handle.shape))
+
+            # All attached images are views of
+            # this array. np.frombuffer holds on
+            # to the buffer, so the shared memory
+            # cannot be unmapped while any of them
+            # are alive (this is not the case for
+            # np.ndarray(buffer=...)).
+            data  = np.frombuffer(mem.buf, dtype=dtype, count=count)
+            entry = [mem, data, 0]
+            ATTACHED[handle.memname] = entry
+        entry[2] += 1
+
+    try:
+        data = entry[1].reshape(handle.shape)
+        data.flags.writeable = writeable
+        header = imageheader.parseHeader(handle.header, handle.name)
+        image  = fslimage.Image(data,
+                                header=header,
+                                name=handle.name,
+                                dataSource=handle.dataSource,
+                                calcRange=False)
+
+    except Exception:
+        detach(handle.memname)
+        raise
+
+    image.updateMeta(handle.meta)
+    weakref.finalize(image, detach, handle.memname)
+
+    return image
+
+
+def detach(memname):
+    """Called when an image created by :func:`attach` is garbage-collected.
+    Closes the shared memory block if no more images are attached to it.
+
+    Views of the image data (e.g. slices that were returned by an image) may
+    still be alive, in which case the block is left open - it will be re-used
+    by the next call to :func:`attach`, and closed by a later call to
+    ``detach`` (for any image), once the views have been garbage-collected.
+    """
+
+    with ATTACHED_LOCK:
+        entry = ATTACHED.get(memname)
+
+        if entry is not None:
+            entry[2] -= 1
+
+        for name, entry in list(ATTACHED.items()):
+
+            if entry[2] > 0:
+                continue
+
+            # Each view holds a reference to
+            # the array (the other two are held
+            # by the entry, and passed to
+            # getrefcount).
+            if sys.getrefcount(entry[1]) > 2:
+                log.debug('Shared memory block %s is still in use', name)
+                continue
+
+            ATTACHED.pop(name)
+            entry[1] = None
+            entry[0].close()
+
+
+def openSharedMemory(memname):
+    """Opens the existing shared memory block with the given name.
+
+    The process which created the block is responsible for releasing it
+    (see :meth:`SharedImage.close`), so if possible the block is not
+    registered with the ``multiprocessing`` resource tracker within this
+    process.
+    """
+    try:
+        return SharedMemory(name=memname, track=False)
+
+    # track argument added in python 3.13
+    except TypeError:
+        return SharedMemory(name=memname)
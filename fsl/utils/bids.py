@@ -181,6 +181,37 @@ def loadMetadataFile(filename):
         return json.load(f)
 
 
+def metadataDirs(filename):
+    """Returns a list of all directories which are searched for metadata
+    files by :func:`loadMetadata`, from the directory containing
+    ``filename`` up to the BIDS dataset root (or the filesystem root).
+
+    :arg filename: Path to a data file in a BIDS dataset.
+    :returns:      A list of directories, deepest first.
+    """
+
+    filename = op.realpath(op.abspath(filename))
+    dirname  = op.dirname(filename)
+    dirs     = []
+
+    # Walk up the directory tree until
+    # we hit the BIDS dataset root, or
+    # the filesystem root
+    while True:
+
+        dirs.append(dirname)
+
+        # move to the next dir up
+        prevdir = dirname
+        dirname = op.dirname(dirname)
+
+        # stop when we hit the dataset or filesystem root
+        if isBIDSDir(prevdir) or dirname == prevdir:
+            break
+
+    return dirs
+
+
 def loadMetadata(filename):
     """Load all of the metadata associated with ``filename``.
 
@@ -191,15 +222,10 @@ def loadMetadata(filename):
 
     filename  = op.realpath(op.abspath(filename))
     bfile     = BIDSFile(filename)
-    dirname   = op.dirname(filename)
-    prevdir   = filename
     metafiles = []
     metadata  = {}
 
-    # Walk up the directory tree until
-    # we hit the BIDS dataset root, or
-    # the filesystem root
-    while True:
+    for dirname in metadataDirs(filename):
 
         # Gather all json files in this
         # directory with matching entities
@@ -213,14 +239,6 @@ def loadMetadata(filename):
         # build a list of all files
         metafiles.append(files)
 
-        # move to the next dir up
-        prevdir = dirname
-        dirname = op.dirname(dirname)
-
-        # stop when we hit the dataset or filesystem root
-        if isBIDSDir(prevdir) or dirname == prevdir:
-            break
-
     # Load in each json file, from
     # shallowest to deepest, so entries
     # in deeper files take precedence
@@ -9,6 +9,8 @@
 
 
 import time
+import sys
+import threading
 import collections
 
 
@@ -22,10 +24,11 @@ class Expired(Exception):
 class CacheItem(object):
     """Internal container class used to store :class:`Cache` items. """
 
-    def __init__(self, key, value, expiry=0):
+    def __init__(self, key, value, expiry=0, size=0):
         self.key       = key
         self.value     = value
         self.expiry    = expiry
+        self.size      = size
         self.storetime = time.time()
 
 
@@ -40,22 +43,81 @@ class Cache(object):
        - Expiration times can be specified for individual items. If a request
          is made to access an expired item, an :class:`Expired` exception is
          raised.
+
+       - A limit on the total size of all items, in bytes, can be specified,
+         in which case the oldest entries are dropped to make room for new
+         ones.
+
+       - The number of cache hits and misses is recorded - see the
+         :attr:`hits` and :attr:`misses` properties.
+
+    All operations on a ``Cache`` are protected by a lock, so a ``Cache``
+    may be shared between threads.
     """
 
-    def __init__(self, maxsize=100, lru=False):
+    def __init__(self, maxsize=100, lru=False, maxbytes=None, sizeof=None):
         """Create a ``Cache``.
 
-        :arg maxsize: Maximum number of items allowed in the ``Cache`` before
-                      it starts dropping old items
+        :arg maxsize:  Maximum number of items allowed in the ``Cache`` before
+                       it starts dropping old items
+
+        :arg lru:      (least recently used) If ``False`` (the default), items
+                       are dropped according to their insertion time.
+                       Otherwise, items are dropped according to their most
+                       recent access time.
+
+        :arg maxbytes: Maximum total size, in bytes, of all items in the
+                       ``Cache``. Defaults to ``None`` (no limit). Items which
+                       are larger than ``maxbytes`` are not stored.
+
+        :arg sizeof:   Function which returns the size of an item, in bytes.
+                       Defaults to the ``nbytes`` attribute of the item (e.g.
+                       for ``numpy`` arrays), if it has one, or
+                       ``sys.getsizeof`` otherwise.
+        """
+
+        if sizeof is None:
+            sizeof = defaultSizeof
+
+        self.__cache    = collections.OrderedDict()
+        self.__maxsize  = maxsize
+        self.__lru      = lru
+        self.__maxbytes = maxbytes
+        self.__sizeof   = sizeof
+        self.__nbytes   = 0
+        self.__hits     = 0
+        self.__misses   = 0
+        self.__lock     = threading.RLock()
+
 
-        :arg lru:     (least recently used) If ``False`` (the default), items
-                      are dropped according to their insertion time. Otherwise,
-                      items are dropped according to their most recent access
-                      time.
+    @property
+    def nbytes(self):
+        """Returns the total size, in bytes, of all items in the cache. Only
+        calculated if a ``maxbytes`` limit was specified.
         """
-        self.__cache   = collections.OrderedDict()
-        self.__maxsize = maxsize
-        self.__lru     = lru
+        return self.__nbytes
+
+
+    @property
+    def maxbytes(self):
+        """Returns the maximum total size of all items in the cache, or
+        ``None`` if there is no limit.
+        """
+        return self.__maxbytes
+
+
+    @property
+    def hits(self):
+        """Returns the number of successful :meth:`get` calls. """
+        return self.__hits
+
+
+    @property
+    def misses(self):
+        """Returns the number of :meth:`get` calls for items which were not
+        in the cache, or had expired.
+        """
+        return self.__misses
 
 
     def put(self, key, value, expiry=0):
@@ -69,11 +131,35 @@ class Cache(object):
                      ``0`` will not expire.
         """
 
-        if len(self.__cache) == self.__maxsize and \
-           key not in self.__cache:
-            self.__cache.popitem(last=False)
+        size = 0
+        if self.__maxbytes is not None:
+            size = self.__sizeof(value)
+
+        with self.__lock:
 
-        self.__cache[key] = CacheItem(key, value, expiry)
+            old = self.__cache.get(key, None)
+            if old is not None:
+                self.__nbytes -= old.size
+
+            # Items which will not fit are not stored
+            if self.__maxbytes is not None and size > self.__maxbytes:
+                if old is not None:
+                    self.__cache.pop(key)
+                return
+
+            if len(self.__cache) == self.__maxsize and old is None:
+                self.__nbytes -= self.__cache.popitem(last=False)[1].size
+
+            if self.__maxbytes is not None:
+                while self.__nbytes + size > self.__maxbytes:
+                    oldest = next(iter(self.__cache))
+                    if oldest == key:
+                        self.__cache.move_to_end(key)
+                        continue
+                    self.__nbytes -= self.__cache.pop(oldest).size
+
+            self.__cache[key] = CacheItem(key, value, expiry, size)
+            self.__nbytes    += size
 
 
     def get(self, key, *args, **kwargs):
@@ -86,46 +172,66 @@ class Cache(object):
 
         defaultSpecified, default = self.__parseDefault(*args, **kwargs)
 
-        # Default value specified - return
-        # it if the key is not in the cache
-        if defaultSpecified:
+        with self.__lock:
 
             entry = self.__cache.get(key, None)
 
             if entry is None:
-                return default
+                self.__misses += 1
 
-        # No default value specified -
-        # allow KeyErrors to propagate
-        else:
-            entry = self.__cache[key]
+                # Default value specified - return
+                # it if the key is not in the cache
+                if defaultSpecified: return default
 
-        # Check to see if the entry
-        # has expired
-        now = time.time()
+                # No default value specified -
+                # raise a KeyError
+                else:                raise KeyError(key)
 
-        if entry.expiry > 0:
-            if now - entry.storetime > entry.expiry:
+            # Check to see if the entry
+            # has expired
+            now = time.time()
 
-                self.__cache.pop(key)
+            if entry.expiry > 0:
+                if now - entry.storetime > entry.expiry:
 
-                if defaultSpecified: return default
-                else:                raise Expired(key)
+                    self.__cache.pop(key)
+                    self.__nbytes -= entry.size
+                    self.__misses += 1
+
+                    if defaultSpecified: return default
+                    else:                raise Expired(key)
 
-        # If we are an lru cache, update
-        # this entry's expiry, and update
-        # its order in the cache dict
-        if self.__lru:
-            entry.storetime = now
-            self.__cache.pop(key)
-            self.__cache[key] = entry
+            # If we are an lru cache, update
+            # this entry's expiry, and update
+            # its order in the cache dict
+            if self.__lru:
+                entry.storetime = now
+                self.__cache.move_to_end(key)
 
-        return entry.value
+            self.__hits += 1
+
+            return entry.value
+
+
+    def pop(self, key, default=None):
+        """Remove an item from the cache, returning its value, or ``default``
+        if it is not in the cache.
+        """
+        with self.__lock:
+            entry = self.__cache.pop(key, None)
+
+            if entry is None:
+                return default
+
+            self.__nbytes -= entry.size
+            return entry.value
 
 
     def clear(self):
         """Remove all items from the cache. """
-        self.__cache = collections.OrderedDict()
+        with self.__lock:
+            self.__cache  = collections.OrderedDict()
+            self.__nbytes = 0
 
 
     def __len__(self):
@@ -174,3 +280,13 @@ class Cache(object):
         # positional argument, or as a keyword argument
         if   len(args)   == 1: return True, args[0]
         elif len(kwargs) == 1: return True, kwargs['default']
+
+
+def defaultSizeof(value):
+    """Default function used by the :class:`Cache` to calculate the size of
+    an item, in bytes.
+    """
+    nbytes = getattr(value, 'nbytes', None)
+    if nbytes is None:
+        nbytes = sys.getsizeof(value)
+    return nbytes
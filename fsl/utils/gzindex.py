@@ -0,0 +1,598 @@
+#!/usr/bin/env python
+#
+# gzindex.py - Random access to gzip files via a seek point index.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module provides functions and classes for reading from arbitrary
+locations within ``gzip`` files, without having to decompress the file from
+the beginning on every access.
+
+
+The ``gzip`` format does not support random access - in order to read the
+byte at uncompressed offset ``N``, every byte before ``N`` must first be
+decompressed.  For large compressed images (e.g. a ``.nii.gz`` file
+containing a long time series), this means that reading a single volume from
+the end of the file is almost as expensive as reading the entire file.
+
+
+The solution, as implemented in the ``zran.c`` example which ships with
+``zlib``, is to create an index of *seek points* as the file is decompressed.
+Each seek point contains the state of the decompressor at a known location in
+the compressed and uncompressed data streams, so a subsequent read can start
+decompressing from the nearest seek point, rather than from the beginning of
+the file.
+
+
+If the `indexed_gzip <https://github.com/pauldmccarthy/indexed_gzip>`_
+library is available, it is used. Otherwise a pure-Python implementation,
+the :class:`SeekableGzipFile` class, is used. In both cases, the index is
+built lazily - seek points are created the first time that a region of the
+file is decompressed.
+
+
+The :func:`openIndexed` function is the main entry point to this module. When
+``indexed_gzip`` is in use, the index may also be persisted to disk, so that
+it can be re-used the next time the file is opened - see the
+:func:`indexFilePath` function.
+
+
+The following module-level attributes may be used to control default
+behaviour:
+
+
+.. autosummary::
+   :nosignatures:
+
+   SPACING
+   PERSIST
+   INDEX_DIR
+"""
+
+
+import os.path as op
+import            os
+import            io
+import            zlib
+import            hashlib
+import            logging
+import            threading
+
+
+log = logging.getLogger(__name__)
+
+
+SPACING = 4 * 1048576
+"""Default spacing, in bytes of uncompressed data, between seek points.
+Smaller values result in faster random access, at the cost of a larger index
+(each seek point requires around 32 kilobytes of memory).
+"""
+
+
+PERSIST = False
+"""Default value for the ``persist`` argument to :func:`openIndexed`. If
+``True``, indices are saved to disk when a file is closed, and re-loaded the
+next time it is opened.
+"""
+
+
+INDEX_DIR = None
+"""Default directory in which persisted index files are stored. If ``None``,
+index files are stored alongside the ``gzip`` file - see
+:func:`indexFilePath`.
+"""
+
+
+READ_SIZE = 262144
+"""Number of bytes of compressed data read from file at a time by the
+:class:`SeekableGzipFile`.
+"""
+
+
+GZIP_WBITS = zlib.MAX_WBITS | 16
+"""Value passed to ``zlib.decompressobj`` so that it expects a ``gzip`` header
+and trailer.
+"""
+
+
+def haveIndexedGzip():
+    """Returns ``True`` if the ``indexed_gzip`` library is available, ``False``
+    otherwise.
+    """
+    try:
+        import indexed_gzip  # noqa pylint: disable=unused-import,import-outside-toplevel
+        return True
+    except ImportError:
+        return False
+
+
+def indexFilePath(filename, indexDir=None):
+    """Returns a path to a file which may be used to store an index for the
+    given ``gzip`` file.
+
+    :arg filename: Path to a ``gzip`` file
+    :arg indexDir: Directory in which index files are stored. If ``None``,
+                   defaults to :attr:`INDEX_DIR`. If :attr:`INDEX_DIR` is also
+                   ``None``, the index file is stored alongside the ``gzip``
+                   file, as ``<filename>.gzidx``. Otherwise the index file
+                   name is derived from a hash of the absolute path to
+                   ``filename``.
+    """
+
+    if indexDir is None:
+        indexDir = INDEX_DIR
+
+    filename = op.abspath(filename)
+
+    if indexDir is None:
+        return '{}.gzidx'.format(filename)
+
+    digest = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+    return op.join(indexDir, '{}.gzidx'.format(digest))
+
+
+def openIndexed(filename, spacing=None, persist=None, indexDir=None):
+    """Open the given ``gzip`` file for random access.
+
+    :arg filename: Path to a ``gzip`` file.
+
+    :arg spacing:  Spacing, in bytes of uncompressed data, between seek
+                   points. Defaults to :attr:`SPACING`.
+
+    :arg persist:  If ``True``, and ``indexed_gzip`` is available, an index
+                   for the file is loaded from :func:`indexFilePath` (if one
+                   exists and is newer than the file), and the index is saved
+                   back to that location when the file is closed. Defaults
+                   to :attr:`PERSIST`.
+
+    :arg indexDir: Directory in which to store index files - passed through to
+                   :func:`indexFilePath`.
+
+    :returns:      A read-only, seekable file-like object which returns
+                   uncompressed data - either a
+                   ``indexed_gzip.IndexedGzipFile``, or a
+                   :class:`SeekableGzipFile`.
+    """
+
+    if spacing is None: spacing = SPACING
+    if persist is None: persist = PERSIST
+
+    if not haveIndexedGzip():
+        if persist:
+            log.debug('indexed_gzip is not available - the index '
+                      'for %s will not be persisted', filename)
+        return SeekableGzipFile(filename, spacing=spacing)
+
+    import indexed_gzip as igzip  # pylint: disable=import-outside-toplevel
+
+    # drop_handles - the file is only opened
+    # while it is being read from, so we don't
+    # run out of file handles when lots of
+    # images are open at once.
+    if not persist:
+        return igzip.IndexedGzipFile(filename,
+                                     spacing=spacing,
+                                     drop_handles=True)
+
+    indexFile = indexFilePath(filename, indexDir)
+    fobj      = _PersistentIndexedGzipFile(filename,
+                                           indexFile,
+                                           spacing=spacing,
+                                           drop_handles=True)
+    return fobj
+
+
+def _indexIsValid(filename, indexFile):
+    """Used by :func:`openIndexed`. Returns ``True`` if ``indexFile`` exists,
+    and was created after ``filename`` was last modified.
+    """
+    if not op.exists(indexFile):
+        return False
+    return os.stat(indexFile).st_mtime_ns >= os.stat(filename).st_mtime_ns
+
+
+def _makePersistentClass():
+    """Creates and returns the ``_PersistentIndexedGzipFile`` class, a
+    sub-class of ``indexed_gzip.IndexedGzipFile`` which loads its index
+    from file when it is created, and saves its index to file when it is
+    closed. Returns ``None`` if ``indexed_gzip`` is not available.
+    """
+
+    try:
+        import indexed_gzip as igzip  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+
+    class _PersistentIndexedGzipFile(igzip.IndexedGzipFile):
+        """``IndexedGzipFile`` which loads/saves its index from/to file. """
+
+        def __init__(self, filename, indexFile, **kwargs):
+            """Create a ``_PersistentIndexedGzipFile``.
+
+            :arg filename:  ``gzip`` file to open
+            :arg indexFile: File to load/save the index from/to.
+
+            All other arguments are passed to ``IndexedGzipFile.__init__``.
+            """
+            super().__init__(filename, **kwargs)
+
+            # We save the file size/modification
+            # time so we can check whether the
+            # file has been modified before
+            # saving the index - an index built
+            # against the old contents of a file
+            # must not be saved.
+            stat                    = os.stat(filename)
+            self.__gzfilename       = filename
+            self.__indexFile        = indexFile
+            self.__stat             = (stat.st_size, stat.st_mtime_ns)
+            self.__npoints          = 0
+
+            if _indexIsValid(filename, indexFile):
+                try:
+                    self.import_index(indexFile)
+                    self.__npoints = self.__countPoints()
+                    log.debug('Loaded gzip index for %s from %s (%i seek '
+                              'points)', filename, indexFile, self.__npoints)
+                except Exception as e:
+                    log.warning('Could not load gzip index for %s from '
+                                '%s: %s', filename, indexFile, e)
+
+        def __countPoints(self):
+            """Returns the number of seek points in the index. """
+            return sum(1 for _ in self.seek_points())
+
+        def close(self):
+            """Saves the index to file (if it has grown since it was loaded,
+            and the ``gzip`` file has not been modified), then closes the file.
+            """
+
+            if self.closed:
+                return
+
+            try:
+                stat = os.stat(self.__gzfilename)
+                stat = (stat.st_size, stat.st_mtime_ns)
+
+                if stat == self.__stat and \
+                   self.__countPoints() > self.__npoints:
+                    dirname = op.dirname(self.__indexFile)
+                    os.makedirs(dirname, exist_ok=True)
+                    self.export_index(self.__indexFile)
+                    log.debug('Saved gzip index for %s to %s',
+                              self.__gzfilename, self.__indexFile)
+
+            except Exception as e:
+                log.warning('Could not save gzip index for %s to %s: %s',
+                            self.__gzfilename, self.__indexFile, e)
+
+            super().close()
+
+    return _PersistentIndexedGzipFile
+
+
+_PersistentIndexedGzipFile = _makePersistentClass()
+
+
+class SeekPoint(object):
+    """Used by the :class:`SeekableGzipFile` class to represent a single seek
+    point in a ``gzip`` file.
+    """
+
+    def __init__(self, uoffset, coffset, decomp, fresh):
+        """Create a ``SeekPoint``.
+
+        :arg uoffset: Offset into the uncompressed data
+        :arg coffset: Offset into the compressed data, i.e. the location of
+                      the next byte to be passed to ``decomp``.
+        :arg decomp:  A ``zlib.Decompress`` object containing the state of
+                      the decompressor at this location.
+        :arg fresh:   ``True`` if the seek point is located at the beginning
+                      of a ``gzip`` stream.
+        """
+        self.uoffset = uoffset
+        self.coffset = coffset
+        self.decomp  = decomp
+        self.fresh   = fresh
+
+
+class SeekableGzipFile(io.RawIOBase):
+    """A read-only, seekable file-like object which provides access to the
+    uncompressed contents of a ``gzip`` file.
+
+    The ``SeekableGzipFile`` is a pure-Python alternative to the
+    ``indexed_gzip.IndexedGzipFile`` class. As the file is read through, a
+    copy of the ``zlib`` decompressor state is saved every ``spacing`` bytes
+    (of uncompressed data). When a read is requested from a location that
+    has already been passed, decompression is started from the nearest
+    preceding seek point, rather than from the beginning of the file.
+
+    Files which contain multiple concatenated ``gzip`` streams are supported.
+    The underlying file is only kept open while data is being read from it.
+    If the file is replaced or modified in the meantime (e.g. when an image
+    is saved over it - see :func:`.image.saveNibImageAtomic`), the index is
+    discarded and rebuilt from the new file.
+
+    The index cannot be persisted, as ``zlib`` decompressor objects cannot be
+    serialised.
+    """
+
+
+    def __init__(self, filename, spacing=None):
+        """Create a ``SeekableGzipFile``.
+
+        :arg filename: Path to the ``gzip`` file.
+        :arg spacing:  Spacing, in bytes of uncompressed data, between seek
+                       points. Defaults to :attr:`SPACING`.
+        """
+
+        if spacing is None:
+            spacing = SPACING
+
+        super().__init__()
+
+        self.__filename = filename
+        self.__spacing  = max(int(spacing), 32768)
+        self.__lock     = threading.RLock()
+
+        # Current position, as
+        # seen by the caller
+        self.__pos = 0
+
+        # Uncompressed size - only
+        # known once the decompressor
+        # has reached the end of file
+        self.__size = None
+
+        # The seek point index. Seek point i
+        # is located at uncompressed offset
+        # i * spacing. The first seek point
+        # is at the start of the file.
+        self.__points = [SeekPoint(0, 0, zlib.decompressobj(GZIP_WBITS), True)]
+
+        # Decompressor state - the decompressor,
+        # the compressed offset of the next byte
+        # to be fed to it, the uncompressed
+        # offset of the next byte it will output,
+        # compressed data which has been read but
+        # not yet consumed, and whether we are at
+        # the beginning of a gzip stream.
+        self.__decomp  = None
+        self.__coffset = 0
+        self.__uoffset = 0
+        self.__input   = b''
+        self.__fresh   = True
+        self.__restore(self.__points[0])
+
+        # Make sure that the file exists
+        # and is actually a gzip file, and
+        # record its identity, so we can
+        # tell if it has been replaced.
+        with open(filename, 'rb') as f:
+            if f.read(2) != b'\x1f\x8b':
+                raise OSError('{} is not a gzip file'.format(filename))
+            self.__ident = SeekableGzipFile.__fileIdentity(f)
+
+
+    @property
+    def name(self):
+        """Returns the name of the ``gzip`` file. """
+        return self.__filename
+
+
+    @property
+    def spacing(self):
+        """Returns the spacing between seek points. """
+        return self.__spacing
+
+
+    def seek_points(self):
+        """Generator which yields ``(uncompressed, compressed)`` offsets for
+        each seek point that is currently in the index.
+        """
+        for point in list(self.__points):
+            yield (point.uoffset, point.coffset)
+
+
+    def readable(self):
+        """Returns ``True``. """
+        return True
+
+
+    def seekable(self):
+        """Returns ``True``. """
+        return True
+
+
+    def writable(self):
+        """Returns ``False``. """
+        return False
+
+
+    def tell(self):
+        """Returns the current position in the uncompressed data. """
+        return self.__pos
+
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Seek to a new location in the uncompressed data. No data is
+        decompressed until a read is requested.
+        """
+
+        if   whence == io.SEEK_SET: pos = offset
+        elif whence == io.SEEK_CUR: pos = self.__pos + offset
+        elif whence == io.SEEK_END: pos = self.__getSize() + offset
+        else: raise ValueError('Invalid whence: {}'.format(whence))
+
+        if pos < 0:
+            raise OSError('Invalid offset: {}'.format(pos))
+
+        self.__pos = pos
+        return pos
+
+
+    def readinto(self, buf):
+        """Read data from the current position into ``buf``. Returns the
+        number of bytes that were read.
+        """
+
+        buf   = memoryview(buf).cast('B')
+        nread = 0
+
+        with self.__lock, self.__open() as f:
+
+            self.__seekTo(f, self.__pos)
+
+            while nread < len(buf):
+                chunk = self.__inflate(f, len(buf) - nread)
+                if len(chunk) == 0:
+                    break
+                buf[nread:nread + len(chunk)] = chunk
+                nread                        += len(chunk)
+
+        self.__pos += nread
+        return nread
+
+
+    def read(self, size=-1):
+        """Read ``size`` bytes from the current position, or all remaining
+        bytes if ``size`` is negative.
+        """
+        if size is None or size < 0:
+            size = max(0, self.__getSize() - self.__pos)
+        buf   = bytearray(size)
+        nread = self.readinto(buf)
+        return bytes(buf[:nread])
+
+
+    def __getSize(self):
+        """Returns the size of the uncompressed data, decompressing the
+        entire file if necessary.
+        """
+        if self.__size is None:
+            with self.__lock, self.__open() as f:
+                self.__seekTo(f, self.__points[-1].uoffset)
+                while len(self.__inflate(f, self.__spacing)) > 0:
+                    pass
+        return self.__size
+
+
+    @staticmethod
+    def __fileIdentity(f):
+        """Returns a tuple which identifies the contents of the open file
+        ``f`` - its device, inode, size, and modification time.
+        """
+        st = os.fstat(f.fileno())
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+    def __open(self):
+        """Opens and returns the ``gzip`` file. If the file has been replaced
+        or modified since it was last opened, the index is discarded, as its
+        seek points are no longer valid. Must be called with the lock held.
+        """
+        f = open(self.__filename, 'rb')
+
+        try:
+            ident = SeekableGzipFile.__fileIdentity(f)
+        except Exception:
+            f.close()
+            raise
+
+        if ident != self.__ident:
+            log.debug('%s has changed - discarding index', self.__filename)
+            self.__ident  = ident
+            self.__size   = None
+            self.__points = [SeekPoint(0, 0, zlib.decompressobj(GZIP_WBITS),
+                                       True)]
+            self.__restore(self.__points[0])
+
+        return f
+
+
+    def __restore(self, point):
+        """Restores the decompressor state from the given :class:`SeekPoint`.
+        """
+        self.__decomp  = point.decomp.copy()
+        self.__coffset = point.coffset
+        self.__uoffset = point.uoffset
+        self.__input   = b''
+        self.__fresh   = point.fresh
+
+
+    def __seekTo(self, f, offset):
+        """Moves the decompressor state to the given uncompressed ``offset``,
+        using the nearest seek point, and decompressing (and discarding) data
+        as necessary.
+        """
+
+        index = min(offset // self.__spacing, len(self.__points) - 1)
+        point = self.__points[index]
+
+        # Restore from a seek point if we are
+        # already past the requested offset, or
+        # if the seek point is closer than the
+        # current decompressor position.
+        if self.__uoffset > offset or point.uoffset > self.__uoffset:
+            self.__restore(point)
+
+        while self.__uoffset < offset:
+            if len(self.__inflate(f, offset - self.__uoffset)) == 0:
+                break
+
+
+    def __inflate(self, f, maxlen):
+        """Decompresses and returns up to ``maxlen`` bytes from the current
+        decompressor position, adding seek points to the index as
+        necessary. Returns an empty ``bytes`` object at end of file.
+        """
+
+        while True:
+
+            if len(self.__input) == 0:
+                f.seek(self.__coffset)
+                self.__input = f.read(READ_SIZE)
+
+            # End of file. There may be null
+            # padding after the last gzip stream,
+            # which we also interpret as end of file.
+            if len(self.__input) == 0 or \
+               (self.__fresh and self.__input[:1] == b'\x00'):
+                self.__size = self.__uoffset
+                return b''
+
+            # Never decompress past the location of the
+            # next seek point, so that we stop exactly
+            # on it, and can add it to the index.
+            nextPoint = len(self.__points) * self.__spacing
+            if self.__uoffset < nextPoint:
+                nbytes = min(maxlen, nextPoint - self.__uoffset)
+            else:
+                nbytes = maxlen
+
+            ninput = len(self.__input)
+            data   = self.__decomp.decompress(self.__input, nbytes)
+
+            if self.__decomp.eof: remaining = self.__decomp.unused_data
+            else:                 remaining = self.__decomp.unconsumed_tail
+
+            self.__coffset += ninput - len(remaining)
+            self.__uoffset += len(data)
+            self.__input    = remaining
+            self.__fresh    = False
+
+            # Reached the end of a gzip
+            # stream - there may be another
+            # one after it.
+            if self.__decomp.eof:
+                self.__decomp = zlib.decompressobj(GZIP_WBITS)
+                self.__fresh  = True
+
+            if self.__uoffset == nextPoint:
+                self.__points.append(SeekPoint(self.__uoffset,
+                                               self.__coffset,
+                                               self.__decomp.copy(),
+                                               self.__fresh))
+
+            if len(data) > 0:
+                return data
@@ -44,6 +44,8 @@ Thread tasks
    run
    wait
    TaskThread
+   TaskPool
+   TaskPoolOwner
 
 
 The :func:`run` function simply runs a task in a separate thread.  This
@@ -64,6 +66,13 @@ the task (via :func:`idle`).
 The :class:`TaskThread` class is a simple thread which runs a queue of tasks.
 
 
+The :class:`TaskPool` class runs tasks on behalf of many *owners* on a
+bounded pool of threads, so that (for example) many objects can run
+background tasks without each needing their own ``TaskThread``. The
+:class:`TaskPoolOwner` class provides a ``TaskThread``-like interface to the
+tasks of a single owner of a ``TaskPool``.
+
+
 Other facilities
 ----------------
 
@@ -74,11 +83,13 @@ The ``mutex`` decorator uses the :class:`MutexFactory` class to do its work.
 """
 
 
+import os
 import time
 import atexit
 import logging
 import functools
 import threading
+import collections
 from   contextlib  import contextmanager
 from   collections import abc
 
@@ -959,6 +970,377 @@ class TaskThread(threading.Thread):
         log.debug('Task thread finished')
 
 
+class TaskPool(object):
+    """The ``TaskPool`` runs tasks on a bounded pool of threads. Every task
+    is associated with an *owner* - a hashable key which identifies the
+    object on whose behalf the task is run. The ``TaskPool`` guarantees
+    that:
+
+      - The tasks of each owner are run one at a time, in the order in which
+        they were enqueued, so the tasks of one owner do not need to be
+        thread-safe with respect to each other.
+
+      - A task is not enqueued if a task with the same owner and name is
+        already queued (but not yet running) - see :meth:`enqueue`.
+
+      - Owners with *priority* (see :meth:`enqueue`) are serviced before
+        other owners. Otherwise, owners are serviced in turn, one task at a
+        time.
+
+    Threads are created as needed, up to the limit given when the
+    ``TaskPool`` is created, and wait (without polling) when there is no
+    work to do.
+    """
+
+
+    def __init__(self, nthreads=None, name='TaskPool'):
+        """Create a ``TaskPool``.
+
+        :arg nthreads: Maximum number of threads. Defaults to the number of
+                       CPUs.
+        :arg name:     Name used as a prefix for thread names.
+        """
+
+        if nthreads is None:
+            nthreads = os.cpu_count() or 1
+
+        self.__nthreads = nthreads
+        self.__name     = name
+        self.__threads  = []
+        self.__idle     = 0
+        self.__cond     = threading.Condition()
+
+        # Queued tasks, as { owner : deque }
+        # mappings, in servicing order, the
+        # names of all queued tasks, as
+        # { owner : { name : count } }, the
+        # priority function for each owner,
+        # the number of threads waiting on
+        # each owner, the owners which are
+        # currently running a task, and the
+        # number of queued/running tasks for
+        # each owner.
+        self.__queues   = collections.OrderedDict()
+        self.__names    = collections.defaultdict(collections.Counter)
+        self.__priority = {}
+        self.__waiting  = collections.Counter()
+        self.__running  = set()
+        self.__pending  = collections.Counter()
+
+
+    @property
+    def nthreads(self):
+        """Returns the maximum number of threads used by this ``TaskPool``.
+        """
+        return self.__nthreads
+
+
+    def enqueue(self, owner, func, *args, **kwargs):
+        """Enqueue a task to be executed on behalf of ``owner``.
+
+        :arg owner:    Hashable key identifying the task owner.
+
+        :arg func:     The task function.
+
+        :arg taskName: Task name. Must be specified as a keyword argument. If
+                       a task with the same ``owner`` and ``taskName`` is
+                       already queued, the new task is not enqueued.
+
+        :arg onFinish: An optional function to be called (via :func:`idle`)
+                       when the task function has finished. Must be provided
+                       as a keyword argument. If the ``func`` raises a
+                       :class:`TaskThreadVeto` error, this function will not
+                       be called.
+
+        :arg priority: An optional function which returns ``True`` if the
+                       tasks of ``owner`` should be run before those of other
+                       owners, ``False`` otherwise. Must be provided as a
+                       keyword argument. It is called whenever the next task
+                       is selected, and replaces any function previously
+                       given for the same ``owner``.
+
+        All other arguments are passed through to the task function when it is
+        executed.
+
+        :returns: ``True`` if the task was enqueued, ``False`` if it was
+                  coalesced with an already queued task.
+        """
+
+        name     = kwargs.pop('taskName', None)
+        onFinish = kwargs.pop('onFinish', None)
+        priority = kwargs.pop('priority', None)
+        task     = Task(name, func, onFinish, args, kwargs)
+
+        with self.__cond:
+
+            if priority is not None:
+                self.__priority[owner] = priority
+
+            if name is not None and self.__names[owner][name] > 0:
+                log.debug('Task already queued: {} [{}]'.format(name, owner))
+                return False
+
+            log.debug('Enqueueing task: {} [{}]'.format(
+                name, getattr(func, '__name__', '<unknown>')))
+
+            if owner not in self.__queues:
+                self.__queues[owner] = collections.deque()
+
+            self.__queues[owner].append(task)
+            self.__pending[owner] += 1
+
+            if name is not None:
+                self.__names[owner][name] += 1
+
+            # Start a new thread if
+            # all threads are busy
+            if self.__idle == 0 and len(self.__threads) < self.__nthreads:
+                thread = threading.Thread(
+                    target=self.__run,
+                    name='{}-{}'.format(self.__name, len(self.__threads)))
+                thread.daemon = True
+                self.__threads.append(thread)
+                thread.start()
+
+            # Threads in waitUntilIdle also wait
+            # on the condition, so we wake all
+            # threads to be sure that a worker
+            # is woken
+            self.__cond.notify_all()
+
+        return True
+
+
+    def isQueued(self, owner, name):
+        """Returns ``True`` if a task with the given ``owner`` and ``name``
+        is queued (and not yet running), ``False`` otherwise.
+        """
+        with self.__cond:
+            return self.__names.get(owner, {}).get(name, 0) > 0
+
+
+    def isIdle(self, owner=None):
+        """Returns ``True`` if there are no queued or running tasks for the
+        given ``owner``, or for any owner if ``owner is None``.
+        """
+        with self.__cond:
+            if owner is None: return sum(self.__pending.values()) == 0
+            else:             return self.__pending[owner]        == 0
+
+
+    def waitUntilIdle(self, owner=None, timeout=None):
+        """Causes the calling thread to block until all queued and running
+        tasks of the given ``owner`` (or of all owners, if ``owner is None``)
+        have completed.
+
+        While a thread is waiting on an ``owner``, the ``owner`` is given
+        priority over other owners.
+
+        :arg owner:   Owner to wait on.
+        :arg timeout: Maximum number of seconds to wait.
+        :returns:     ``True`` if the tasks completed, ``False`` if the
+                      ``timeout`` elapsed.
+        """
+
+        with self.__cond:
+
+            self.__waiting[owner] += 1
+
+            try:
+                return self.__cond.wait_for(lambda: self.isIdle(owner),
+                                            timeout)
+            finally:
+                self.__waiting[owner] -= 1
+                if self.__waiting[owner] == 0:
+                    self.__waiting.pop(owner)
+
+
+    def __hasPriority(self, owner):
+        """Returns ``True`` if the given ``owner`` has priority. Must be
+        called with the lock held.
+        """
+
+        if self.__waiting[owner] > 0:
+            return True
+
+        priority = self.__priority.get(owner)
+
+        if priority is None:
+            return False
+
+        try:
+            return bool(priority())
+        except Exception as e:
+            log.warning('Priority function crashed: {}: {}'.format(
+                type(e).__name__, str(e)), exc_info=True)
+            return False
+
+
+    def __next(self):
+        """Selects the next task to run, or returns ``(None, None)`` if there
+        are no runnable tasks. Must be called with the lock held.
+        """
+
+        candidates = [o for o in self.__queues if o not in self.__running]
+
+        if len(candidates) == 0:
+            return None, None
+
+        owner = candidates[0]
+        for candidate in candidates:
+            if self.__hasPriority(candidate):
+                owner = candidate
+                break
+
+        queue = self.__queues.pop(owner)
+        task  = queue.popleft()
+
+        # Owners are serviced in turn, so
+        # this owner goes to the back of
+        # the queue if it has more tasks
+        if len(queue) > 0:
+            self.__queues[owner] = queue
+
+        if task.name is not None:
+            names             = self.__names[owner]
+            names[task.name] -= 1
+            if names[task.name] == 0:
+                names.pop(task.name)
+
+        self.__running.add(owner)
+
+        return owner, task
+
+
+    def __finish(self, owner):
+        """Called when a task of the given ``owner`` has finished. Must be
+        called with the lock held.
+        """
+
+        self.__running.discard(owner)
+        self.__pending[owner] -= 1
+
+        if self.__pending[owner] == 0:
+            self.__pending .pop(owner)
+            self.__names   .pop(owner, None)
+            self.__priority.pop(owner, None)
+
+        self.__cond.notify_all()
+
+
+    def __run(self):
+        """Run by each thread in the pool. Runs tasks until the program
+        exits.
+        """
+
+        while True:
+
+            with self.__cond:
+                self.__idle += 1
+                owner, task = self.__next()
+                while task is None:
+                    self.__cond.wait()
+                    owner, task = self.__next()
+                self.__idle -= 1
+
+            log.debug('Running task: {} [{}]'.format(
+                task.name,
+                getattr(task.func, '__name__', '<unknown>')))
+
+            try:
+                task.func(*task.args, **task.kwargs)
+
+                if task.onFinish is not None:
+                    idle(task.onFinish)
+
+            except TaskThreadVeto:
+                log.debug('Task completed (vetoed onFinish): {} [{}]'.format(
+                    task.name,
+                    getattr(task.func, '__name__', '<unknown>')))
+
+            except Exception as e:
+                log.warning('Task crashed: {} [{}]: {}: {}'.format(
+                    task.name,
+                    getattr(task.func, '__name__', '<unknown>'),
+                    type(e).__name__,
+                    str(e)),
+                    exc_info=True)
+
+            # Clear the ref to the task, so
+            # that it does not keep its
+            # function (and owner) alive
+            task = None
+
+            with self.__cond:
+                self.__finish(owner)
+
+
+class TaskPoolOwner(object):
+    """Provides a :class:`TaskThread`-like interface to the tasks of one
+    owner of a :class:`TaskPool`. This allows code which was written to use
+    a ``TaskThread`` to use a ``TaskPool`` instead - all methods operate
+    only on the tasks of the owner.
+
+    The :meth:`TaskThread.dequeue` and :meth:`TaskThread.stop` methods are
+    not supported.
+    """
+
+
+    def __init__(self, pool, owner, priority=None):
+        """Create a ``TaskPoolOwner``.
+
+        :arg pool:     The :class:`TaskPool`.
+        :arg owner:    Hashable key identifying the task owner.
+        :arg priority: Priority function, passed to :meth:`TaskPool.enqueue`
+                       for every task which is enqueued.
+        """
+        self.__pool     = pool
+        self.__owner    = owner
+        self.__priority = priority
+
+
+    @property
+    def pool(self):
+        """Returns the :class:`TaskPool`. """
+        return self.__pool
+
+
+    @property
+    def owner(self):
+        """Returns the task owner. """
+        return self.__owner
+
+
+    def enqueue(self, func, *args, **kwargs):
+        """Enqueue a task to be executed. See :meth:`TaskThread.enqueue`. """
+        if self.__priority is not None:
+            kwargs.setdefault('priority', self.__priority)
+        return self.__pool.enqueue(self.__owner, func, *args, **kwargs)
+
+
+    def isQueued(self, name):
+        """Returns ``True`` if a task with the given name is enqueued,
+        ``False`` otherwise.
+        """
+        return self.__pool.isQueued(self.__owner, name)
+
+
+    def isIdle(self):
+        """Returns ``True`` if there are no queued or running tasks. """
+        return self.__pool.isIdle(self.__owner)
+
+
+    def waitUntilIdle(self, timeout=None):
+        """Causes the calling thread to block until all queued and running
+        tasks have completed.
+
+        :arg timeout: Maximum number of seconds to wait.
+        :returns:     ``True`` if the tasks completed, ``False`` if the
+                      ``timeout`` elapsed.
+        """
+        return self.__pool.waitUntilIdle(self.__owner, timeout)
+
+
 def mutex(*args, **kwargs):
     """Decorator for use on methods of a class, which makes the method
     call mutually exclusive.
@@ -6,10 +6,15 @@
 #
 """This module provides the :func:`roi` function, which can be used to extract
 a region-of-interest from, or expand the field-of-view of, an :class:`.Image`.
+
+The :func:`roi` function can either copy the ROI into a new ``Image``, or
+return an ``Image`` which is a *view* into the original ``Image``, via a
+:class:`ROIProxy`.
 """
 
 
-import numpy as np
+import numpy   as np
+import nibabel as nib
 
 import fsl.data.image       as fslimage
 import fsl.transform.affine as affine
@@ -47,7 +52,7 @@ def _normaliseBounds(shape, bounds):
     return bounds
 
 
-def roi(image, bounds):
+def roi(image, bounds, view=False):
     """Extract an ROI from the given ``image`` according to the given
     ``bounds``.
 
@@ -62,6 +67,13 @@ def roi(image, bounds):
                  and the high bound is *exclusive*. For 4D images, the bounds
                  for the fourth dimension are optional.
 
+    :arg view:   If ``False`` (the default), the ROI is copied into a new
+                 in-memory array. Otherwise, the returned ``Image`` is a
+                 view into ``image`` - data is read from ``image`` (which
+                 may not be loaded into memory) only when it is accessed,
+                 via a :class:`ROIProxy`. Changes to the data of the view
+                 are not propagated back to ``image``.
+
     :returns:    A new :class:`.Image` object containing the region specified
                  by the ``bounds``.
     """
@@ -88,10 +100,6 @@ def roi(image, bounds):
     oldslc = tuple(oldslc)
     newslc = tuple(newslc)
 
-    # Copy the ROI into the new data array
-    newdata         = np.zeros(newshape, dtype=image.dtype)
-    newdata[newslc] = image.data[oldslc]
-
     # Create a new affine for the ROI,
     # with an appropriate offset along
     # each spatial dimension
@@ -99,8 +107,176 @@ def roi(image, bounds):
     offset = [lo for lo, hi in bounds[:3]]
     offset = affine.scaleOffsetXform([1, 1, 1], offset)
     newaff = affine.concat(oldaff, offset)
+    name   = image.name + '_roi'
+
+    if view:
+        return _roiView(image, bounds, newaff, name)
+
+    # Copy the ROI into the new data array
+    newdata         = np.zeros(newshape, dtype=image.dtype)
+    newdata[newslc] = image.data[oldslc]
 
     return fslimage.Image(newdata,
                           xform=newaff,
                           header=image.header,
-                          name=image.name + '_roi')
+                          name=name)
+
+
+def _roiView(image, bounds, xform, name):
+    """Used by :func:`roi`. Creates an :class:`.Image` which accesses the
+    data of ``image`` through a :class:`ROIProxy`.
+    """
+
+    proxy  = ROIProxy(image, bounds)
+    header = image.header.copy()
+
+    # The proxy returns data as
+    # it is returned by the image,
+    # i.e. with scaling applied.
+    header.set_data_dtype(proxy.dtype)
+    header.set_slope_inter(1, 0)
+
+    if   isinstance(header, nib.nifti2.Nifti2Header): ctr = nib.Nifti2Image
+    elif isinstance(header, nib.nifti1.Nifti1Header): ctr = nib.Nifti1Image
+    else:                                            ctr = nib.AnalyzeImage
+
+    return fslimage.Image(ctr(proxy, xform, header=header),
+                          name=name,
+                          loadData=False,
+                          calcRange=False)
+
+
+class ROIProxy(object):
+    """Array-like object which provides access to a region of an
+    :class:`.Image`. The ``ROIProxy`` is used as the ``nibabel`` ``dataobj``
+    of views created by the :func:`roi` function.
+
+    When data is read from a ``ROIProxy``, only the part of the region
+    which is within the field-of-view of the image is read from the image.
+    Any parts which are outside of the image field-of-view are filled with
+    zeros.
+    """
+
+
+    def __init__(self, image, bounds):
+        """Create a ``ROIProxy``.
+
+        :arg image:  The :class:`.Image`
+        :arg bounds: Sequence of ``(lo, hi)`` bounds, one for each image
+                     dimension, as passed to :func:`roi`.
+        """
+        self.__image  = image
+        self.__bounds = [tuple(b) for b in bounds]
+        self.__shape  = tuple(hi - lo for lo, hi in bounds)
+        self.__dtype  = image.dtype
+
+
+    @property
+    def image(self):
+        """Returns the :class:`.Image` that this ``ROIProxy`` is accessing.
+        """
+        return self.__image
+
+
+    @property
+    def shape(self):
+        """Returns the ROI shape. """
+        return self.__shape
+
+
+    @property
+    def ndim(self):
+        """Returns the number of ROI dimensions. """
+        return len(self.__shape)
+
+
+    @property
+    def dtype(self):
+        """Returns the data type. """
+        return self.__dtype
+
+
+    @property
+    def is_proxy(self):
+        """Always returns ``True`` - this tells ``nibabel`` that the data is
+        not in memory.
+        """
+        return True
+
+
+    def __array__(self, dtype=None):
+        """Reads and returns all of the ROI data. A copy is always returned,
+        even if the image data is in memory.
+        """
+        return np.array(self[(slice(None),) * self.ndim], dtype=dtype)
+
+
+    def __getitem__(self, sliceobj):
+        """Reads data from the image. ``sliceobj`` may contain integers,
+        ``slice`` objects, ``Ellipsis`` and ``None``.
+        """
+
+        sliceobj = nib.fileslice.canonical_slicers(sliceobj, self.__shape)
+        image    = self.__image
+        imgshape = image.shape
+
+        # Indices into the ROI and the image
+        # of the parts of the region which
+        # are inside the image, and the shape
+        # of the region, for each dimension
+        roiidxs  = []
+        imgidxs  = []
+        outshape = []
+        post     = []
+
+        for slc in sliceobj:
+            if   slc is None:          post.append(np.newaxis)
+            elif isinstance(slc, int): post.append(0)
+            else:                      post.append(slice(None))
+
+        sliceobj = [slc for slc in sliceobj if slc is not None]
+
+        for dim, slc in enumerate(sliceobj):
+            lo     = self.__bounds[dim][0]
+            idxs   = np.atleast_1d(np.arange(self.__shape[dim])[slc]) + lo
+            imglen = imgshape[dim] if dim < len(imgshape) else 1
+            inside = (idxs >= 0) & (idxs < imglen)
+
+            roiidxs .append(np.flatnonzero(inside))
+            imgidxs .append(idxs[inside])
+            outshape.append(len(idxs))
+
+        outshape = tuple(outshape)
+
+        # Entirely outside of the image
+        if any(len(i) == 0 for i in imgidxs):
+            return np.zeros(outshape, dtype=self.__dtype)[tuple(post)]
+
+        # Read the bounding box of the
+        # region from the image - the
+        # image may have fewer dimensions
+        # than the ROI (e.g. trailing
+        # dimensions of length 1).
+        box  = tuple(slice(int(i.min()), int(i.max()) + 1) for i in imgidxs)
+        data = image[box[:len(imgshape)]]
+        data = data.reshape([b.stop - b.start for b in box])
+
+        # The region may have a step,
+        # or be flipped, in which case
+        # we need to extract it from
+        # the bounding box.
+        contiguous = all(len(i) == b.stop - b.start and
+                         (len(i) < 2 or i[1] > i[0])
+                         for i, b in zip(imgidxs, box))
+
+        if not contiguous:
+            data = data[np.ix_(*[i - b.start for i, b in zip(imgidxs, box)])]
+
+        # And pad it, if it is
+        # partially outside the image
+        if data.shape != outshape:
+            padded = np.zeros(outshape, dtype=data.dtype)
+            padded[np.ix_(*roiidxs)] = data
+            data   = padded
+
+        return data[tuple(post)]
@@ -136,7 +136,7 @@ def imcp(src,
                                     'exists ({})'.format(dest))
 
         img = nib.load(src)
-        nib.save(img, dest)
+        fslimage.saveNibImage(img, dest)
         img = None
 
         if move:
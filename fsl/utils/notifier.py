@@ -374,6 +374,21 @@ class Notifier(object):
             else:                    callback(           self, topic, value)
 
 
+    def hasListeners(self, topic=None):
+        """Returns ``True`` if there are any enabled listeners which would
+        be notified on the given ``topic``, ``False`` otherwise.
+
+        :arg topic: Topic to check. If ``None``, only listeners registered on
+                    the default topic are considered.
+        """
+
+        for listener in self.__getListeners(topic):
+            if listener.enabled and listener.callback is not None:
+                return True
+
+        return False
+
+
     def __getListeners(self, topic):
         """Called by :meth:`notify`. Returns all listeners which should be
         notified for the specified ``topic``.
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+#
+# pgzip.py - Multi-threaded gzip compression.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module provides the :class:`GzipWriter` class, a write-only file-like
+object which compresses data into the ``gzip`` format using multiple threads.
+
+
+``gzip`` compression with the standard library ``gzip`` module (which is what
+``nibabel`` uses) is single-threaded, and dominates the time taken to save
+large ``.nii.gz`` files. The :class:`GzipWriter` uses the approach taken by
+`pigz <https://zlib.net/pigz/>`_ - the data is split into fixed-size blocks,
+which are deflated independently and in parallel, each block being primed
+with the last 32 kilobytes of the preceding block so that the compression
+ratio is not much worse than single-threaded compression. Each block is
+terminated with a ``zlib`` *sync flush*, so the compressed blocks can simply
+be concatenated to form a single, standard ``gzip`` stream, which can be read
+by any ``gzip`` decompressor.
+
+
+The :attr:`THREADS`, :attr:`LEVEL` and :attr:`BLOCKSIZE` module-level
+attributes control the default behaviour of all :class:`GzipWriter`
+instances.
+"""
+
+
+import                    io
+import                    os
+import                    zlib
+import                    struct
+import                    collections
+import concurrent.futures as futures
+
+
+THREADS = os.cpu_count() or 1
+"""Default number of threads used to compress data. """
+
+
+LEVEL = 1
+"""Default compression level. The default value of ``1`` is the same as that
+used by ``nibabel``.
+"""
+
+
+BLOCKSIZE = 1048576
+"""Default size, in bytes of uncompressed data, of each independently
+compressed block.
+"""
+
+
+WINDOW = 32768
+"""Size of the ``deflate`` window - the last ``WINDOW`` bytes of each block
+are used to prime the compression of the next block.
+"""
+
+
+def compressBlock(data, level, zdict=None, last=False):
+    """Compresses one block of data into a raw ``deflate`` stream, returning
+    the compressed bytes.
+
+    :arg data:  Data to compress
+    :arg level: Compression level
+    :arg zdict: Preset dictionary - the data which precedes ``data`` in the
+                stream (only the last :attr:`WINDOW` bytes are used).
+    :arg last:  If ``True``, the stream is terminated. Otherwise it is
+                ended with a sync flush, so that the output of the next
+                block can be appended to it.
+    """
+
+    kwargs = {}
+    if zdict is not None and len(zdict) > 0:
+        kwargs['zdict'] = zdict[-WINDOW:]
+
+    comp = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, **kwargs)
+    out  = comp.compress(data)
+
+    if last: out += comp.flush(zlib.Z_FINISH)
+    else:    out += comp.flush(zlib.Z_SYNC_FLUSH)
+
+    return out
+
+
+class GzipWriter(io.RawIOBase):
+    """Write-only file-like object which compresses the data written to it
+    in parallel, and writes it out in ``gzip`` format. Data is compressed in
+    blocks of ``blocksize`` bytes, and a limited number of blocks are kept
+    in memory at any one time.
+
+    Seeking is only supported in the forward direction, by writing zeros (as
+    is required when ``nibabel`` writes an image header). Call :meth:`close`
+    (or use the ``GzipWriter`` as a context manager) to make sure that all
+    data is written to file.
+    """
+
+
+    def __init__(self,
+                 filename=None,
+                 fileobj=None,
+                 level=None,
+                 threads=None,
+                 blocksize=None):
+        """Create a ``GzipWriter``.
+
+        :arg filename:  File to write to. Ignored if ``fileobj`` is provided.
+        :arg fileobj:   File-like object to write to. It is not closed when
+                        this ``GzipWriter`` is closed.
+        :arg level:     Compression level. Defaults to :attr:`LEVEL`.
+        :arg threads:   Number of threads to use. Defaults to :attr:`THREADS`.
+        :arg blocksize: Block size in bytes. Defaults to :attr:`BLOCKSIZE`.
+        """
+
+        if level     is None: level     = LEVEL
+        if threads   is None: threads   = THREADS
+        if blocksize is None: blocksize = BLOCKSIZE
+
+        if filename is None and fileobj is None:
+            raise ValueError('One of filename or fileobj must be specified')
+
+        super().__init__()
+
+        if fileobj is None:
+            fileobj    = open(filename, 'wb')
+            ownsFile   = True
+        else:
+            ownsFile   = False
+            filename   = getattr(fileobj, 'name', None)
+
+        self.__name      = filename
+        self.__fobj      = fileobj
+        self.__ownsFile  = ownsFile
+        self.__level     = int(level)
+        self.__threads   = max(1, int(threads))
+        self.__blocksize = max(WINDOW, int(blocksize))
+        self.__crc       = 0
+        self.__size      = 0
+        self.__buffer    = bytearray()
+        self.__prev      = b''
+        self.__pending   = collections.deque()
+        self.__finished  = False
+
+        if self.__threads > 1:
+            self.__pool = futures.ThreadPoolExecutor(self.__threads)
+        else:
+            self.__pool = None
+
+        self.__writeHeader()
+
+
+    @property
+    def name(self):
+        """Returns the name of the file being written to, if known. """
+        return self.__name
+
+
+    def writable(self):
+        """Returns ``True``. """
+        return True
+
+
+    def readable(self):
+        """Returns ``False``. """
+        return False
+
+
+    def seekable(self):
+        """Returns ``False`` - see :meth:`seek`. """
+        return False
+
+
+    def tell(self):
+        """Returns the number of (uncompressed) bytes written so far. """
+        return self.__size
+
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Seeks forward to ``offset``, by writing zeros. Seeking backwards
+        is not possible, and results in an ``io.UnsupportedOperation`` error.
+        """
+
+        if   whence == io.SEEK_SET: pass
+        elif whence == io.SEEK_CUR: offset = self.__size + offset
+        else: raise io.UnsupportedOperation('GzipWriter only supports '
+                                            'forward seeks')
+
+        if offset < self.__size:
+            raise io.UnsupportedOperation('GzipWriter only supports '
+                                          'forward seeks')
+
+        if offset > self.__size:
+            self.write(bytes(offset - self.__size))
+
+        return self.__size
+
+
+    def write(self, data):
+        """Write ``data`` to the file. Returns the number of bytes written. """
+
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+        data   = memoryview(data).cast('B')
+        nbytes = len(data)
+
+        bsize  = self.__blocksize
+        offset = 0
+
+        self.__crc   = zlib.crc32(data, self.__crc)
+        self.__size += nbytes
+
+        # Top up any partial block
+        # left over from a prior write
+        if len(self.__buffer) > 0:
+            offset = min(nbytes, bsize - len(self.__buffer))
+            self.__buffer.extend(data[:offset])
+            if len(self.__buffer) < bsize:
+                return nbytes
+            self.__submit(bytes(self.__buffer), False)
+            self.__buffer = bytearray()
+
+        while nbytes - offset >= bsize:
+            self.__submit(bytes(data[offset:offset + bsize]), False)
+            offset += bsize
+
+        self.__buffer.extend(data[offset:])
+
+        return nbytes
+
+
+    def flush(self):
+        """Writes all compressed data which is currently available to the
+        output file. Data which has not yet been compressed (less than one
+        block) is held back.
+        """
+        if self.closed or self.__finished:
+            return
+        while len(self.__pending) > 0:
+            self.__writeBlock()
+        self.__fobj.flush()
+
+
+    def close(self):
+        """Compresses and writes all remaining data, writes the ``gzip``
+        trailer, and closes the file (if it was opened by this
+        ``GzipWriter``).
+        """
+
+        if self.closed:
+            return
+
+        try:
+            self.__submit(bytes(self.__buffer), True)
+            self.__buffer = bytearray()
+            while len(self.__pending) > 0:
+                self.__writeBlock()
+
+            self.__fobj.write(struct.pack('<II',
+                                          self.__crc & 0xffffffff,
+                                          self.__size & 0xffffffff))
+            self.__fobj.flush()
+
+        finally:
+            self.__finished = True
+            if self.__pool is not None:
+                self.__pool.shutdown()
+            if self.__ownsFile:
+                self.__fobj.close()
+            super().close()
+
+
+    def __writeHeader(self):
+        """Writes the ``gzip`` member header. """
+
+        if   self.__level == 9: xfl = 2
+        elif self.__level == 1: xfl = 4
+        else:                   xfl = 0
+
+        # magic, compression method (deflate),
+        # flags, modification time (not set),
+        # extra flags, OS (unknown)
+        self.__fobj.write(struct.pack('<BBBBIBB',
+                                      0x1f, 0x8b, 8, 0, 0, xfl, 255))
+
+
+    def __submit(self, block, last):
+        """Queues ``block`` for compression, writing out completed blocks if
+        too many are pending.
+        """
+
+        args        = (block, self.__level, self.__prev, last)
+        self.__prev = block[-WINDOW:]
+
+        if self.__pool is None:
+            self.__pending.append(compressBlock(*args))
+        else:
+            self.__pending.append(self.__pool.submit(compressBlock, *args))
+
+        # Limit the number of blocks
+        # held in memory at once
+        while len(self.__pending) > 2 * self.__threads:
+            self.__writeBlock()
+
+
+    def __writeBlock(self):
+        """Waits for the oldest pending block to be compressed, and writes it
+        to the output file.
+        """
+        block = self.__pending.popleft()
+        if isinstance(block, futures.Future):
+            block = block.result()
+        self.__fobj.write(block)
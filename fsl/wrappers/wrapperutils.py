@@ -1052,7 +1052,7 @@ def fileOrImage(*args, **kwargs):
             if infile is None:
                 hd, infile = tempfile.mkstemp(fslimage.defaultExt())
                 os.close(hd)
-                val.to_filename(infile)
+                fslimage.saveNibImage(val, infile)
 
         return infile
 
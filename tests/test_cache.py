@@ -8,6 +8,8 @@
 import time
 import pytest
 
+import numpy as np
+
 import fsl.utils.cache as cache
 
 
@@ -146,3 +148,58 @@ def test_lru():
     c[3]
     c[4]
     assert len(c) == 3
+
+
+def test_maxbytes():
+    c = cache.Cache(maxsize=None, maxbytes=100, sizeof=len)
+
+    c.put('a', 'a' * 40)
+    c.put('b', 'b' * 40)
+    assert c.nbytes == 80
+
+    # oldest items are dropped to make room
+    c.put('c', 'c' * 40)
+    assert c.nbytes == 80
+    assert 'a' not in c
+    assert 'b' in c and 'c' in c
+
+    # replacing an item
+    c.put('b', 'b' * 10)
+    assert c.nbytes == 50
+    assert c.get('b') == 'b' * 10
+
+    # items which are too big are not stored
+    c.put('d', 'd' * 101)
+    assert 'd' not in c
+    assert c.nbytes == 50
+    c.put('b', 'b' * 101)
+    assert 'b' not in c
+    assert c.nbytes == 40
+
+    assert c.pop('c')       == 'c' * 40
+    assert c.pop('c', 'no') == 'no'
+    assert c.nbytes         == 0
+
+    # default size is nbytes or sys.getsizeof
+    c = cache.Cache(maxbytes=1000)
+    c.put('a', np.zeros(100, dtype=np.uint8))
+    assert c.nbytes == 100
+    c.put('b', np.zeros(1000, dtype=np.uint8))
+    assert c.nbytes == 1000
+    assert 'a' not in c
+    c.clear()
+    assert c.nbytes == 0
+
+
+def test_hits_misses():
+    c = cache.Cache()
+    c.put(1, 'a')
+
+    c.get(1)
+    c.get(2, None)
+    c.get(1, default=None)
+    with pytest.raises(KeyError):
+        c.get(3)
+
+    assert c.hits   == 2
+    assert c.misses == 2
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# test_chunkedimage.py -
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import os.path as op
+
+import numpy   as np
+import nibabel as nib
+import h5py
+
+import fsl.data.image        as fslimage
+import fsl.data.chunkedimage as chunkedimage
+from fsl.utils.tempdir import tempdir
+
+
+def _make_image(fname, ctr=nib.Nifti1Image, scaled=False):
+    data   = np.random.randint(0, 1000, (20, 21, 22, 5)).astype(np.int16)
+    affine = np.diag([2, 3, 4, 1])
+    affine[:3, 3] = [10, -20, 30]
+    img    = ctr(data, affine)
+    if scaled:
+        img.header.set_slope_inter(2, 1)
+        data = data * 2.0 + 1
+    nib.save(img, fname)
+    return data, affine
+
+
+def test_defaultChunks():
+    dc = chunkedimage.defaultChunks
+    assert dc((10, 10),        4)      == (10, 10)
+    assert dc((10, 10, 10),    4)      == (10, 10, 10)
+    assert dc((10, 10, 10, 5), 4)      == (10, 10, 10, 1)
+    assert dc((10, 10, 10, 5), 4, 800) == (10, 10, 2, 1)
+    assert dc((10, 10, 10, 5), 4, 1)   == (10, 10, 1, 1)
+
+
+def test_save_load():
+    for ctr in (nib.Nifti1Image, nib.Nifti2Image):
+        for scaled in (False, True):
+            with tempdir():
+                data, affine = _make_image('image.nii', ctr, scaled)
+                chunkedimage.niftiToChunked('image.nii', 'image.h5')
+
+                with h5py.File('image.h5', 'r') as f:
+                    assert f['data'].chunks == (20, 21, 22, 1)
+
+                nibimg = chunkedimage.loadChunkedImage('image.h5')
+                proxy  = nibimg.dataobj
+
+                assert isinstance(nibimg, ctr)
+                assert isinstance(proxy, chunkedimage.ChunkedProxy)
+                assert nib.is_proxy(proxy)
+                assert proxy.shape == data.shape
+                assert proxy.dtype == data.dtype
+                assert np.all(nibimg.header.get_best_affine() == affine)
+                assert np.all(np.asarray(proxy) == data)
+                proxy.close()
+
+                chunkedimage.chunkedToNifti('image.h5', 'copy.nii.gz')
+                copy = nib.load('copy.nii.gz')
+                assert np.all(copy.get_fdata() == data)
+                assert np.all(copy.affine      == affine)
+
+
+def test_ChunkedProxy_slicing():
+    with tempdir():
+        data, _ = _make_image('image.nii')
+        fslimage.Image('image.nii').save('image.h5')
+
+        proxy = chunkedimage.loadChunkedImage('image.h5', True).dataobj
+
+        slices = [
+            (slice(None), 3, slice(2, 7, 2), -1),
+            (Ellipsis, 2),
+            (slice(None, None, -1), None, slice(1, 10, 3), 4),
+            (slice(15, 2, -3), slice(None), 0),
+            data > 500]
+
+        for slc in slices:
+            assert np.all(proxy[slc] == data[slc])
+
+        for slc in slices:
+            values    = np.random.randint(0, 100, data[slc].shape)
+            data[ slc] = values
+            proxy[slc] = values
+            assert np.all(proxy[slc] == values)
+            assert np.all(np.asarray(proxy) == data)
+
+        # floats are rounded/clipped
+        proxy[0, 0, 0, 0] = 1.6
+        proxy[0, 0, 1, 0] = 1e6
+        assert proxy[0, 0, 0, 0] == 2
+        assert proxy[0, 0, 1, 0] == np.iinfo(np.int16).max
+        proxy.close()
+
+
+def test_Image():
+    with tempdir():
+        data, affine = _make_image('image.nii.gz', scaled=True)
+
+        img = fslimage.Image('image.nii.gz')
+        img.save('image.h5')
+        assert img.dataSource == op.abspath('image.h5')
+        assert img.saveState
+
+        img = fslimage.Image('image.h5')
+        assert img.name                 == 'image'
+        assert img.shape                == data.shape
+        assert np.all(img.voxToWorldMat == affine)
+        assert np.all(img[:]            == data)
+        assert img.dataRange            == (data.min(), data.max())
+        img.nibImage.dataobj.close()
+
+        # in-memory modifications, saved to a new chunked file
+        img = fslimage.Image('image.nii.gz')
+        img[..., 0] = np.zeros(data.shape[:3])
+        img.save('modified.h5')
+        data[..., 0] = 0
+        assert np.all(fslimage.Image('modified.h5')[:] == data)
+
+
+def test_Image_writeThrough():
+    with tempdir():
+        data, affine = _make_image('image.nii')
+        fslimage.Image('image.nii').save('image.h5')
+
+        img = fslimage.Image('image.h5', writeThrough=True)
+
+        assert img.getImageWrapper().writeThrough
+        assert isinstance(img.getImageWrapper().backend,
+                          chunkedimage.ChunkedProxy)
+        assert not img.getImageWrapper().inMemory
+
+        img[..., 2]  = np.zeros(data.shape[:3])
+        data[..., 2] = 0
+        img.header['descrip'] = b'chunked'
+        img.save()
+
+        assert img.saveState
+        assert img.dataRange == (0, data.max())
+        img.nibImage.dataobj.close()
+
+        with h5py.File('image.h5', 'r') as f:
+            assert np.all(f['data'][()] == data)
+
+        img = fslimage.Image('image.h5')
+        assert np.all(img[:] == data)
+        assert img.header['descrip'] == b'chunked'
+        assert np.all(img.voxToWorldMat == affine)
+        img.nibImage.dataobj.close()
+
+
+
+def test_Image_save_closeFile():
+    with tempdir():
+        data, _ = _make_image('image.nii')
+        fslimage.Image('image.nii').save('image.h5')
+
+        # The old file is closed on save, even
+        # if the old nibabel image is still alive
+        img = fslimage.Image('image.h5')
+        old = img.nibImage
+        img.save('copy.h5')
+        wimg = fslimage.Image('image.h5', writeThrough=True)
+        wimg[..., 0] = np.zeros(data.shape[:3])
+        data[..., 0] = 0
+
+        # write-through image saved to a new file
+        old = wimg.nibImage
+        wimg.save('moved.h5')
+        img = fslimage.Image('image.h5')
+        assert np.all(img[:] == data)
+        assert np.all(wimg[:] == data)
+
+        # in-memory data, saved over the file
+        # which it was loaded from, and re-opened
+        img[..., 1]  = np.zeros(data.shape[:3])
+        data[..., 1] = 0
+        img.save('image.h5')
+        img.save('image.h5')
+        rimg = fslimage.Image('image.h5', writeThrough=True)
+        assert np.all(rimg[:] == data)
+        assert np.all(img[:]  == data)
+        del old
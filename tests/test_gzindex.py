@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+#
+# test_gzindex.py -
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+
+import os.path as op
+import            os
+import            gzip
+import            random
+
+import mock
+import pytest
+
+import numpy as np
+
+import fsl.utils.gzindex as gzindex
+from fsl.utils.tempdir import tempdir
+
+
+def _make_gzip(filename, data, nstreams=1, padding=0):
+    """Write data to a gzip file, split across nstreams concatenated gzip
+    streams, optionally followed by null padding.
+    """
+    bounds = np.linspace(0, len(data), nstreams + 1).astype(int)
+    with open(filename, 'wb') as f:
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            f.write(gzip.compress(data[start:end]))
+        f.write(b'\0' * padding)
+
+
+def test_SeekableGzipFile():
+
+    data = np.random.randint(0, 50, 5000000, dtype=np.uint8).tobytes()
+
+    for nstreams, padding in [(1, 0), (3, 0), (3, 100)]:
+        with tempdir():
+            _make_gzip('data.gz', data, nstreams, padding)
+
+            f = gzindex.SeekableGzipFile('data.gz', spacing=262144)
+
+            assert f.seekable()
+            assert f.readable()
+            assert not f.writable()
+
+            # index is built lazily
+            assert len(list(f.seek_points())) == 1
+
+            # read from the end, then from
+            # random locations behind it
+            f.seek(len(data) - 1000)
+            assert f.read(1000) == data[-1000:]
+            assert f.tell()     == len(data)
+            assert f.read(10)   == b''
+
+            npoints = len(list(f.seek_points()))
+            assert npoints == len(data) // 262144 + 1
+
+            for _ in range(50):
+                offset = random.randint(0, len(data))
+                nbytes = random.randint(0, 1000000)
+                f.seek(offset)
+                assert f.read(nbytes) == data[offset:offset + nbytes]
+
+            # no new seek points created
+            assert len(list(f.seek_points())) == npoints
+
+            # readinto, relative seeks
+            buf = bytearray(100)
+            f.seek(1000)
+            f.seek(500, os.SEEK_CUR)
+            assert f.readinto(buf) == 100
+            assert bytes(buf) == data[1500:1600]
+            assert f.seek(-100, os.SEEK_END) == len(data) - 100
+            assert f.read() == data[-100:]
+
+            f.seek(0)
+            assert f.read() == data
+
+
+def test_SeekableGzipFile_size_unknown():
+    data = np.random.randint(0, 50, 1000000, dtype=np.uint8).tobytes()
+    with tempdir():
+        _make_gzip('data.gz', data)
+
+        f = gzindex.SeekableGzipFile('data.gz', spacing=65536)
+        assert f.seek(0, os.SEEK_END) == len(data)
+
+        f = gzindex.SeekableGzipFile('data.gz', spacing=65536)
+        f.seek(1000)
+        assert f.read() == data[1000:]
+
+
+def test_SeekableGzipFile_replaced():
+    data1 = np.random.randint(0, 50,  1000000, dtype=np.uint8).tobytes()
+    data2 = np.random.randint(0, 250, 1000000, dtype=np.uint8).tobytes()
+    with tempdir():
+        _make_gzip('data.gz', data1)
+
+        f = gzindex.SeekableGzipFile('data.gz', spacing=65536)
+        f.seek(500000)
+        assert f.read(1000) == data1[500000:501000]
+        assert len(list(f.seek_points())) > 1
+
+        # the index is rebuilt when the
+        # file is replaced with a new file
+        _make_gzip('new.gz', data2, nstreams=3)
+        os.replace('new.gz', 'data.gz')
+
+        f.seek(500000)
+        assert f.read(1000) == data2[500000:501000]
+        f.seek(0)
+        assert f.read() == data2
+
+
+def test_SeekableGzipFile_notgzip():
+    with tempdir():
+        with open('data.gz', 'wb') as f:
+            f.write(b'abcdefg')
+        with pytest.raises(OSError):
+            gzindex.SeekableGzipFile('data.gz')
+
+
+def test_indexFilePath():
+
+    with tempdir() as td:
+        fname = op.join(td, 'image.nii.gz')
+
+        assert gzindex.indexFilePath(fname) == fname + '.gzidx'
+
+        path = gzindex.indexFilePath(fname, op.join(td, 'cache'))
+        assert op.dirname(path) == op.join(td, 'cache')
+        assert path.endswith('.gzidx')
+
+        with mock.patch('fsl.utils.gzindex.INDEX_DIR', op.join(td, 'cache')):
+            assert gzindex.indexFilePath(fname) == path
+
+
+def test_openIndexed_no_igzip():
+    data = np.random.randint(0, 50, 1000000, dtype=np.uint8).tobytes()
+    with tempdir():
+        _make_gzip('data.gz', data)
+        with mock.patch.dict('sys.modules', indexed_gzip=None):
+            f = gzindex.openIndexed('data.gz', spacing=65536, persist=True)
+            assert isinstance(f, gzindex.SeekableGzipFile)
+            f.seek(500000)
+            assert f.read(1000) == data[500000:501000]
+        assert not op.exists('data.gz.gzidx')
+
+
+@pytest.mark.igziptest
+def test_openIndexed_persist():
+
+    igzip = pytest.importorskip('indexed_gzip')
+
+    data = np.random.randint(0, 50, 4000000, dtype=np.uint8).tobytes()
+
+    with tempdir() as td:
+        _make_gzip('data.gz', data)
+        cache = op.join(td, 'cache')
+        idx   = gzindex.indexFilePath('data.gz', cache)
+
+        # not persisted
+        f = gzindex.openIndexed('data.gz', spacing=262144)
+        assert isinstance(f, igzip.IndexedGzipFile)
+        f.seek(3000000)
+        assert f.read(1000) == data[3000000:3001000]
+        f.close()
+        assert not op.exists(idx)
+
+        # persisted
+        f = gzindex.openIndexed('data.gz', spacing=262144,
+                                persist=True, indexDir=cache)
+        f.seek(3000000)
+        assert f.read(1000) == data[3000000:3001000]
+        npoints = len(list(f.seek_points()))
+        f.close()
+        assert op.exists(idx)
+
+        # index is re-loaded
+        f = gzindex.openIndexed('data.gz', spacing=262144,
+                                persist=True, indexDir=cache)
+        assert len(list(f.seek_points())) == npoints
+        f.seek(2000000)
+        assert f.read(1000) == data[2000000:2001000]
+        f.close()
+
+        # stale indices are ignored
+        _make_gzip('data.gz', data[::-1])
+        st = os.stat(idx)
+        os.utime('data.gz', ns=(st.st_atime_ns, st.st_mtime_ns + 1000000))
+        f = gzindex.openIndexed('data.gz', spacing=262144,
+                                persist=True, indexDir=cache)
+        assert len(list(f.seek_points())) <= 1
+        f.seek(2000000)
+        assert f.read(1000) == data[::-1][2000000:2001000]
+        f.close()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#
+# test_headercache.py -
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import os.path as op
+import            os
+import            json
+
+import numpy   as np
+import nibabel as nib
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+import fsl.utils.settings   as fslsettings
+import fsl.utils.bids       as fslbids
+import fsl.data.image       as fslimage
+import fsl.data.imageheader as imageheader
+import fsl.data.headercache as headercache
+from fsl.utils.tempdir import tempdir
+
+
+def _touch(path, offset=1):
+    """Bump the mtime of path, so the change is seen even on file systems
+    with coarse timestamps.
+    """
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + offset * 10 ** 9))
+
+
+def test_HeaderCache():
+    with tempdir():
+
+        with open('file.txt', 'wt') as f:
+            f.write('abc')
+        os.mkdir('dir')
+
+        cache = headercache.HeaderCache(op.join('cachedir', 'cache.db'))
+
+        assert cache.lookup('file.txt', 'thing') is None
+        cache.store('file.txt', 'thing', {'a' : 1}, deps=['dir'])
+        cache.store('file.txt', 'other', [1, 2, 3])
+        assert cache.lookup('file.txt', 'thing') == {'a' : 1}
+        assert cache.lookup('file.txt', 'other') == [1, 2, 3]
+        assert (cache.hits, cache.misses) == (2, 1)
+
+        # shared with other connections/processes
+        cache2 = headercache.HeaderCache(op.join('cachedir', 'cache.db'))
+        assert cache2.lookup(op.abspath('file.txt'), 'thing') == {'a' : 1}
+        cache2.close()
+
+        # entries are invalidated
+        # when a dependency changes
+        _touch('dir')
+        assert cache.lookup('file.txt', 'thing') is None
+        assert cache.lookup('file.txt', 'other') == [1, 2, 3]
+
+        # or when the file changes
+        with open('file.txt', 'wt') as f:
+            f.write('abcd')
+        assert cache.lookup('file.txt', 'other') is None
+
+        # non-existent files are not stored
+        cache.store('nofile.txt', 'thing', 1)
+        assert cache.lookup('nofile.txt', 'thing') is None
+
+        cache.store('file.txt', 'thing', 1)
+        cache.clear()
+        assert (cache.hits, cache.misses) == (0, 0)
+        assert cache.lookup('file.txt', 'thing') is None
+        cache.close()
+
+
+def test_enable_disable():
+    with tempdir() as td:
+        assert headercache.getCache() is None
+
+        # settings not initialised
+        with mock.patch('fsl.utils.settings.filePath', return_value=None):
+            with pytest.raises(ValueError):
+                headercache.enable()
+
+        cache = headercache.enable('cache.db')
+        try:
+            assert headercache.getCache() is cache
+            assert cache.filename == 'cache.db'
+        finally:
+            headercache.disable()
+        assert headercache.getCache() is None
+
+        with fslsettings.use(fslsettings.Settings('fslpy', cfgdir=td,
+                                                  writeOnExit=False)):
+            cache = headercache.enable()
+            try:
+                assert cache.filename == op.join(td, headercache.DEFAULT_FILE)
+            finally:
+                headercache.disable()
+
+
+def test_readHeader_cached():
+    with tempdir():
+        data = np.random.random((10, 11, 12)).astype(np.float32)
+        nib.save(nib.Nifti1Image(data, np.eye(4)), 'image.nii.gz')
+
+        headercache.enable('cache.db')
+        try:
+            cache = headercache.getCache()
+            hdr1  = imageheader.readHeader('image.nii.gz')
+            hdr2  = imageheader.readHeader('image')
+            assert (cache.hits, cache.misses) == (1, 1)
+            assert hdr1.binaryblock == hdr2.binaryblock
+
+            # file changes - cache is invalidated
+            nib.save(nib.Nifti1Image(data[:5], np.eye(4)), 'image.nii.gz')
+            _touch('image.nii.gz')
+            hdr3 = imageheader.readHeader('image.nii.gz')
+            assert hdr3.get_data_shape() == (5, 11, 12)
+            assert (cache.hits, cache.misses) == (1, 2)
+        finally:
+            headercache.disable()
+
+
+def test_loadMetadata_cached():
+    with tempdir():
+        data = np.random.random((10, 11, 12)).astype(np.float32)
+        nib.save(nib.Nifti1Image(data, np.eye(4)), 'image.nii.gz')
+
+        headercache.enable('cache.db')
+        try:
+            cache = headercache.getCache()
+            img   = fslimage.Image('image', loadData=False, calcRange=False)
+
+            assert fslimage.loadMetadata(img) == {}
+            assert fslimage.loadMetadata(img) == {}
+            assert (cache.hits, cache.misses) == (1, 1)
+
+            # new sidecar file
+            with open('image.json', 'wt') as f:
+                json.dump({'a' : 1}, f)
+            _touch('.')
+            assert fslimage.loadMetadata(img) == {'a' : 1}
+            assert fslimage.loadMetadata(img) == {'a' : 1}
+            assert (cache.hits, cache.misses) == (2, 2)
+
+            # sidecar file modified
+            with open('image.json', 'wt') as f:
+                json.dump({'a' : 2}, f)
+            _touch('image.json')
+            assert fslimage.loadMetadata(img) == {'a' : 2}
+        finally:
+            headercache.disable()
+
+
+def test_loadMetadata_bids_cached():
+    with tempdir():
+        os.makedirs(op.join('data', 'sub-01', 'func'))
+        with open(op.join('data', 'dataset_description.json'), 'wt') as f:
+            json.dump({}, f)
+        with open(op.join('data', 'task-rest_bold.json'), 'wt') as f:
+            json.dump({'a' : 1, 'b' : 1}, f)
+
+        fname = op.join('data', 'sub-01', 'func', 'sub-01_task-rest_bold')
+        data  = np.random.random((10, 11, 12)).astype(np.float32)
+        nib.save(nib.Nifti1Image(data, np.eye(4)), fname + '.nii.gz')
+
+        headercache.enable('cache.db')
+        try:
+            cache = headercache.getCache()
+            img   = fslimage.Image(fname, loadData=False, calcRange=False)
+
+            assert fslimage.loadMetadata(img) == {'a' : 1, 'b' : 1}
+            assert fslimage.loadMetadata(img) == {'a' : 1, 'b' : 1}
+            assert (cache.hits, cache.misses) == (1, 1)
+
+            # new file in a sub-directory
+            with open(fname + '.json', 'wt') as f:
+                json.dump({'b' : 2}, f)
+            _touch(op.dirname(fname))
+            assert fslimage.loadMetadata(img) == {'a' : 1, 'b' : 2}
+
+            # modified file in dataset root (JSON
+            # files are also memoized by the bids
+            # module, so we have to clear that)
+            with open(op.join('data', 'task-rest_bold.json'), 'wt') as f:
+                json.dump({'a' : 3, 'b' : 1}, f)
+            _touch(op.join('data', 'task-rest_bold.json'))
+            fslbids.loadMetadataFile.invalidate()
+            assert fslimage.loadMetadata(img) == {'a' : 3, 'b' : 2}
+            assert (cache.hits, cache.misses) == (1, 3)
+        finally:
+            headercache.disable()
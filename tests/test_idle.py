@@ -683,6 +683,127 @@ def test_TaskThread_TaskVeto():
     assert not onFinishCalled[0]
 
 
+def test_TaskPool():
+
+    pool    = idle.TaskPool(2)
+    order   = []
+    running = set()
+    overlap = [False]
+    lock    = threading.Lock()
+
+    def task(owner, i):
+        with lock:
+            if owner in running:
+                overlap[0] = True
+            running.add(owner)
+        time.sleep(0.01)
+        with lock:
+            running.discard(owner)
+            order.append((owner, i))
+
+    for i in range(10):
+        for owner in 'abc':
+            assert pool.enqueue(owner, task, owner, i)
+
+    assert pool.waitUntilIdle(timeout=10)
+    assert pool.isIdle()
+    assert len(order) == 30
+    assert not overlap[0]
+
+    # tasks of each owner are run in order
+    for owner in 'abc':
+        assert [i for o, i in order if o == owner] == list(range(10))
+
+
+def test_TaskPool_coalesce():
+
+    pool   = idle.TaskPool(1)
+    called = []
+    event  = threading.Event()
+
+    pool.enqueue('a', event.wait)
+    assert     pool.enqueue('a', called.append, 1, taskName='task')
+    assert not pool.enqueue('a', called.append, 2, taskName='task')
+    assert     pool.enqueue('b', called.append, 3, taskName='task')
+    assert     pool.isQueued('a', 'task')
+    assert not pool.isIdle('a')
+
+    event.set()
+    assert pool.waitUntilIdle(timeout=10)
+    assert sorted(called) == [1, 3]
+    assert not pool.isQueued('a', 'task')
+
+
+def test_TaskPool_priority():
+
+    pool   = idle.TaskPool(1)
+    called = []
+    event  = threading.Event()
+
+    pool.enqueue('blocker', event.wait)
+    pool.enqueue('a', called.append, 'a')
+    pool.enqueue('b', called.append, 'b', priority=lambda: True)
+    pool.enqueue('c', called.append, 'c', priority=lambda: False)
+    event.set()
+
+    assert pool.waitUntilIdle(timeout=10)
+    assert called == ['b', 'a', 'c']
+
+
+def test_TaskPool_waitUntilIdle():
+
+    pool  = idle.TaskPool(1)
+    event = threading.Event()
+
+    pool.enqueue('a', event.wait)
+    assert not pool.waitUntilIdle('a', timeout=0.1)
+    assert     pool.waitUntilIdle('b', timeout=0.1)
+    event.set()
+    assert     pool.waitUntilIdle('a', timeout=10)
+
+
+def test_TaskPool_crash():
+
+    pool   = idle.TaskPool(1)
+    called = []
+
+    def crash():
+        raise RuntimeError()
+
+    pool.enqueue('a', crash)
+    pool.enqueue('a', called.append, 1)
+
+    assert pool.waitUntilIdle(timeout=10)
+    assert called == [1]
+
+
+def test_TaskPoolOwner():
+
+    pool   = idle.TaskPool(2)
+    a      = idle.TaskPoolOwner(pool, 'a', priority=lambda: True)
+    b      = idle.TaskPoolOwner(pool, 'b')
+    called = []
+    event  = threading.Event()
+
+    assert a.pool  is pool
+    assert a.owner == 'a'
+
+    # TaskThread.enqueue signature
+    b.enqueue(event.wait)
+    assert     a.enqueue(called.append, 1, taskName='task',
+                         onFinish=lambda: None)
+    assert not b.isIdle()
+
+    # waitUntilIdle only waits on the owner's tasks
+    assert     a.waitUntilIdle(timeout=10)
+    assert not b.waitUntilIdle(timeout=0.1)
+    assert     called == [1]
+    assert not a.isQueued('task')
+    event.set()
+    assert     b.waitUntilIdle(timeout=10)
+    assert     b.isIdle()
+
+
 def test_mutex():
 
     class Thing(object):
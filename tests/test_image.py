@@ -8,21 +8,25 @@
 
 
 import              os
+import              asyncio
 import              json
+import              gzip
 import os.path   as op
 import itertools as it
 
 import pytest
 
-import numpy        as np
-import numpy.linalg as npla
-import nibabel      as nib
+import numpy         as np
+import numpy.linalg  as npla
+import nibabel       as nib
+import scipy.ndimage as ndimage
 
 from nibabel.spatialimages import ImageFileError
 
 import fsl.data.constants   as constants
 import fsl.data.image       as fslimage
 import fsl.utils.path       as fslpath
+import fsl.utils.gzindex    as gzindex
 import fsl.transform.affine as affine
 
 from fsl.utils.tempdir import tempdir
@@ -1524,3 +1528,571 @@ def test_adjust():
         imgb = affine.axisBounds(img.shape, img.voxToWorldMat)
         adjb = affine.axisBounds(adj.shape, adj.voxToWorldMat)
         assert np.all(np.isclose(imgb, adjb, rtol=1e-5, atol=1e-5))
+
+
+def test_iterVolumes():
+
+    with tempdir():
+        make_image('image.nii.gz', dims=(10, 11, 12, 7), pixdims=(1, 1, 1, 1))
+        data = np.asanyarray(nib.load('image.nii.gz').dataobj)
+
+        img  = fslimage.Image('image.nii.gz', loadData=False, calcRange=False)
+        vols = list(img.iterVolumes())
+
+        assert len(vols) == 7
+        for i, (slc, vol) in enumerate(vols):
+            assert slc == (slice(None), slice(None), slice(None), i)
+            assert vol.shape == (10, 11, 12)
+            assert np.all(vol == data[..., i])
+
+        assert img.getImageWrapper().covered
+        assert np.all(np.isclose(img.dataRange, (data.min(), data.max())))
+
+        # 3D images are returned as one volume
+        make_image('image3d.nii.gz', dims=(10, 11, 12))
+        img  = fslimage.Image('image3d.nii.gz', loadData=False)
+        vols = list(img.iterVolumes())
+        assert len(vols) == 1
+        assert vols[0][1].shape == (10, 11, 12)
+
+
+def test_prefetch():
+
+    with tempdir():
+        make_image('image.nii.gz', dims=(10, 11, 12, 7), pixdims=(1, 1, 1, 1))
+        data = np.asanyarray(nib.load('image.nii.gz').dataobj)
+        img  = fslimage.Image('image.nii.gz', loadData=False, calcRange=False)
+
+        fs = img.prefetch([(Ellipsis, 1), (slice(2, 5), 3, Ellipsis)])
+        assert np.all(fs[0].result() == data[..., 1])
+        assert np.all(fs[1].result() == data[2:5, 3])
+
+        # equivalent slices are retrieved from the
+        # read-ahead buffer, but only once
+        assert img.prefetch([(slice(None),) * 3 + (1,)])[0] is fs[0]
+        assert np.all(img[:, :, :, 1] == data[..., 1])
+        assert img.prefetch([(Ellipsis, 1)])[0] is not fs[0]
+
+        # prefetched data is discarded on writes
+        fs = img.prefetch([(Ellipsis, 2)])
+        fs[0].result()
+        img[..., 2]  = np.zeros(data.shape[:3])
+        data[..., 2] = 0
+        assert np.all(img[..., 2] == 0)
+
+        # buffer size is limited
+        fs = img.prefetch([(Ellipsis, i) for i in range(7)] +
+                          [(i, Ellipsis) for i in range(10)])
+        assert len(fs) == 17
+        assert np.all(fs[-1].result() == data[9])
+        assert len(img._Image__prefetched) <= fslimage.PREFETCH_BUFFER_SIZE
+
+        # advanced indexing is supported, but not buffered
+        mask = data > 0.5
+        fs   = img.prefetch([mask])
+        assert np.all(fs[0].result() == data[mask])
+
+        async def aread():
+            return await img.aread((Ellipsis, 4))
+
+        # asyncio.run requires python >= 3.7
+        loop = asyncio.new_event_loop()
+        try:
+            img.prefetch([(Ellipsis, 4)])
+            assert np.all(loop.run_until_complete(aread()) == data[..., 4])
+            assert np.all(loop.run_until_complete(aread()) == data[..., 4])
+        finally:
+            loop.close()
+
+        # read-ahead in iterVolumes
+        data = np.asanyarray(nib.load('image.nii.gz').dataobj)
+        img  = fslimage.Image('image.nii.gz', loadData=False, calcRange=False)
+        vols = list(img.iterVolumes(prefetch=2))
+        assert len(vols) == 7
+        for i, (slc, vol) in enumerate(vols):
+            assert slc == (slice(None), slice(None), slice(None), i)
+            assert np.all(vol == data[..., i])
+        assert img.getImageWrapper().covered
+
+
+def test_iterSlabs():
+
+    with tempdir():
+        make_image('image.nii.gz', dims=(10, 11, 12, 7), pixdims=(1, 1, 1, 1))
+        data = np.asanyarray(nib.load('image.nii.gz').dataobj)
+
+        # one z slice of a float32 4D image
+        slcbytes = 10 * 11 * 7 * 4
+
+        img = fslimage.Image('image.nii.gz', loadData=False, calcRange=False)
+
+        slabs = list(img.iterSlabs(nbytes=slcbytes * 5))
+        assert [s[0][2] for s in slabs] == [slice(0, 5),
+                                            slice(5, 10),
+                                            slice(10, 12)]
+        for slc, slab in slabs:
+            assert slab.nbytes <= slcbytes * 5
+            assert np.all(slab == data[slc])
+
+        assert img.getImageWrapper().covered
+        assert np.all(np.isclose(img.dataRange, (data.min(), data.max())))
+
+        # slabs of volumes, at least one
+        # slice per slab regardless of size
+        img   = fslimage.Image('image.nii.gz', loadData=False)
+        slabs = list(img.iterSlabs(axis=3, nbytes=1))
+        assert len(slabs) == 7
+        for slc, slab in slabs:
+            assert np.all(slab == data[slc])
+
+
+def test_maskedData():
+
+    with tempdir():
+        make_image('image.nii.gz', dims=(10, 11, 12, 7), pixdims=(1, 1, 1, 1))
+        make_image('image.nii',    dims=(10, 11, 12, 7), pixdims=(1, 1, 1, 1))
+        make_image('image2d.nii',  dims=(10, 11),        pixdims=(1, 1))
+
+        mask    = np.random.random((10, 11, 12)) > 0.8
+        mask4d  = np.random.random((10, 11, 12, 7)) > 0.8
+        maskimg = fslimage.Image(mask.astype(np.uint8))
+
+        for fname in ['image.nii.gz', 'image.nii']:
+            data = np.asanyarray(nib.load(fname).dataobj)
+
+            for loadData in [False, True]:
+                img = fslimage.Image(fname, loadData=loadData)
+                assert np.all(img.maskedData(mask, nbytes=1) == data[mask])
+                assert np.all(img.maskedData(maskimg)        == data[mask])
+
+                # fancy indexing on disk-backed images
+                assert np.all(img[mask4d] == data[mask4d])
+                assert img.getImageWrapper().inMemory == loadData
+
+            with pytest.raises(ValueError):
+                img.maskedData(mask[:5])
+
+        # canonical shape != real shape
+        img  = fslimage.Image('image2d.nii', loadData=False)
+        data = np.asanyarray(nib.load('image2d.nii').dataobj)
+        mask = np.random.random((10, 11, 1)) > 0.5
+        assert img.shape == (10, 11, 1)
+        assert np.all(img.maskedData(mask) == data[mask[..., 0]])
+
+
+def test_Image_volumeCache():
+
+    with tempdir():
+        make_image('image.nii', dims=(10, 11, 12, 5), pixdims=(1, 1, 1, 1))
+        data    = np.asanyarray(nib.load('image.nii').dataobj)
+        volsize = data[..., 0].nbytes
+
+        img    = fslimage.Image('image.nii',
+                                writeThrough=True,
+                                calcRange=False,
+                                volumeCache=volsize * 5)
+        vcache = img.getImageWrapper().volumeCache
+
+        assert np.all(img[..., 1:4] == data[..., 1:4])
+        assert np.all(img[..., 2]   == data[..., 2])
+        assert len(vcache)  == 3
+        assert vcache.hits  == 1
+
+        # modified volumes are dropped
+        # and re-read after a write
+        with mock.patch.object(img.getImageWrapper(),
+                               'clearVolumeCache',
+                               wraps=img.getImageWrapper().clearVolumeCache) \
+             as clear:
+            img[..., 2]  = np.zeros(data.shape[:3])
+            data[..., 2] = 0
+            assert list(clear.call_args[0][0]) == [2]
+
+        assert np.all(img[..., 1:4] == data[..., 1:4])
+        assert len(vcache) == 3
+
+        # cached volumes are dropped on save,
+        # and the cache is retained
+        img.save('copy.nii')
+        assert img.getImageWrapper().volumeCache is vcache
+        assert len(vcache) == 0
+        assert np.all(img[..., 2] == 0)
+        assert len(vcache) == 1
+
+
+def test_Image_lazyScaling():
+
+    with tempdir():
+        data  = np.random.randint(0, 1000, (10, 11, 12, 5)).astype(np.int16)
+        image = nib.Nifti1Image(data, np.eye(4))
+        image.header.set_slope_inter(0.5, 3)
+        nib.save(image, 'image.nii.gz')
+
+        expected = data * np.float32(0.5) + np.float32(3)
+        img      = fslimage.Image('image.nii.gz', lazyScaling=True)
+
+        assert img.getImageWrapper().lazyScaling
+        assert img.dtype     == np.float32
+        assert img.dataRange == (expected.min(), expected.max())
+        assert np.all(img[:]                  == expected)
+        assert np.all(img.maskedData(data > 500) == expected[data > 500])
+
+        # the scaled data is not retained after saving
+        img.save('copy.nii.gz')
+        assert img.getImageWrapper().lazyScaling
+        assert not img.nibImage.in_memory
+        assert np.allclose(fslimage.Image('copy.nii.gz')[:], expected,
+                           atol=0.5)
+
+        # Image.data returns a read-only scaled copy,
+        # so in-place modifications fail loudly
+        with pytest.raises(ValueError):
+            img.data[0, 0, 0, 0] = 1
+        with pytest.raises(ValueError):
+            img.data += 1
+        assert np.all(img.data == expected)
+
+        # which is not the case when the
+        # data is not being lazily scaled
+        img[0, 0, 0, 0] = 1
+        assert not img.getImageWrapper().lazyScaling
+        img.data[0, 0, 0, 1] = 2
+        assert img[0, 0, 0, 1] == 2
+
+
+def test_sample():
+
+    with tempdir():
+        data   = np.random.random((20, 21, 22, 4)).astype(np.float32)
+        xform  = affine.compose((2, 3, 4), (5, -7, 9), (0.1, 0.2, 0.3))
+        nib.save(nib.Nifti1Image(data, xform), 'image.nii.gz')
+
+        vox    = np.random.uniform(-0.49, [19.49, 20.49, 21.49], (500, 3))
+        world  = affine.transform(vox, xform)
+        near   = np.floor(vox + 0.5).astype(int)
+        expnn  = data[near[:, 0], near[:, 1], near[:, 2]]
+        explin = np.stack([ndimage.map_coordinates(data[..., t], vox.T,
+                                                   order=1, mode='nearest')
+                           for t in range(4)], axis=1)
+
+        for loadData in [False, True]:
+            img = fslimage.Image('image.nii.gz', loadData=loadData)
+
+            assert np.allclose(img.sample(world),                 expnn)
+            assert np.allclose(img.sample(vox, 'voxel'),          expnn)
+            assert np.allclose(img.sample(world, order=1),        explin,
+                               atol=1e-5)
+            assert np.allclose(img.sample(vox, 'voxel', order=1), explin,
+                               atol=1e-5)
+            assert img.getImageWrapper().inMemory == loadData
+
+        # points outside the image
+        outside = [[-1, 0, 0], [0, 20.5, 0], [19.6, 0, 0]]
+        result  = img.sample(outside + [[0, 0, 0]], 'voxel')
+        assert result.shape == (4, 4)
+        assert np.all(np.isnan(result[:3]))
+        assert np.all(result[3] == data[0, 0, 0])
+        assert np.all(img.sample(outside, 'voxel', fill=-1) == -1)
+
+        # 3D image
+        img = fslimage.Image(data[..., 0], xform=xform)
+        assert img.sample(world).shape == (500,)
+        assert np.allclose(img.sample(world), expnn[:, 0])
+
+        with pytest.raises(ValueError):
+            img.sample(world, order=3)
+        with pytest.raises(ValueError):
+            img.sample(world[:, :2])
+        with pytest.raises(ValueError):
+            img.sample(world, space='scaled')
+
+
+def test_Image_writeThrough():
+
+    with tempdir():
+
+        data = np.random.randint(0, 100, (10, 10, 10, 5)).astype(np.int16)
+        nimg = nib.Nifti1Image(data, np.eye(4))
+        nimg.header.set_slope_inter(2, 10)
+        nib.save(nimg, 'image.nii')
+
+        img = fslimage.Image('image.nii', writeThrough=True)
+        assert img.getImageWrapper().writeThrough
+        assert np.all(np.isclose(img.dataRange,
+                                 (data.min() * 2 + 10, data.max() * 2 + 10)))
+
+        # values are written straight to the
+        # file, with scaling inverted
+        img[1, 2, 3, 4] = 1000
+        img[2, 3, 4, :] = [-1000] * 5
+        img.getImageWrapper().flush()
+
+        ondisk = np.asanyarray(nib.load('image.nii').dataobj)
+        assert ondisk[1, 2, 3, 4] == 1000
+        assert np.all(ondisk[2, 3, 4, :] == -1000)
+        assert img[1, 2, 3, 4] == 1000
+        assert np.all(np.isclose(img.dataRange, (-1000, 1000)))
+        assert not img.saveState
+
+        # saving to the same file just flushes
+        # the data and updates the header
+        xform       = np.eye(4)
+        xform[:, 3] = [1, 2, 3, 1]
+        img.voxToWorldMat = xform
+        img.save()
+        assert img.saveState
+        assert img.getImageWrapper().writeThrough
+        assert np.all(np.isclose(nib.load('image.nii').affine, xform))
+
+        # write-through mode is only
+        # available for uncompressed files
+        img.save('image.nii.gz')
+        assert not img.getImageWrapper().writeThrough
+        with pytest.raises(ValueError):
+            fslimage.Image('image.nii.gz', writeThrough=True)
+        with pytest.raises(ValueError):
+            fslimage.Image(data, writeThrough=True)
+
+
+def test_Image_seekIndex():
+
+    with tempdir():
+
+        data = np.random.randint(0, 100, (10, 10, 10, 5)).astype(np.int16)
+        nimg = nib.Nifti1Image(data, np.eye(4))
+        nimg.header.set_slope_inter(2, 10)
+        nib.save(nimg, 'image.nii.gz')
+        nib.save(nib.Nifti2Image(data, np.eye(4)), 'image2.nii.gz')
+        expect = data * 2 + 10
+
+        with mock.patch.dict('sys.modules', indexed_gzip=None):
+            img  = fslimage.Image('image',  loadData=False, seekIndex=True)
+            img2 = fslimage.Image('image2', loadData=False, seekIndex=True)
+
+            assert isinstance(img.nibImage,  nib.Nifti1Image)
+            assert isinstance(img2.nibImage, nib.Nifti2Image)
+            assert isinstance(img.nibImage.dataobj.file_like,
+                              gzindex.SeekableGzipFile)
+
+            assert np.all(img[..., 4]  == expect[..., 4])
+            assert np.all(img[..., 1]  == expect[..., 1])
+            assert np.all(img2[..., 3] == data[..., 3])
+            assert np.all(img[:]       == expect)
+
+            # Indexed access is restored after saving
+            img.save('copy.nii.gz')
+            assert isinstance(img.nibImage.dataobj.file_like,
+                              gzindex.SeekableGzipFile)
+            assert np.allclose(img[..., 2], expect[..., 2], atol=0.1)
+
+        # Not used when loading into memory,
+        # or by default (nibabel's own opener
+        # is used)
+        img = fslimage.Image('image', seekIndex=True)
+        assert isinstance(img.nibImage.dataobj.file_like, str)
+        img = fslimage.Image('image', loadData=False)
+        assert isinstance(img.nibImage.dataobj.file_like, str)
+        assert np.all(img[..., 4] == expect[..., 4])
+        img.save('copy.nii.gz')
+        assert isinstance(img.nibImage.dataobj.file_like, str)
+
+
+def test_Image_save_threaded_compression():
+
+    with tempdir():
+
+        data = np.random.randint(0, 100, (20, 20, 20, 10)).astype(np.int16)
+        img  = fslimage.Image(data, xform=np.diag([2, 2, 2, 1]))
+
+        with mock.patch('fsl.utils.pgzip.BLOCKSIZE', 32768):
+            img.save('image.nii.gz', threads=4, level=6)
+
+        # standard gzip stream
+        with gzip.open('image.nii.gz', 'rb') as f:
+            f.read()
+
+        nimg = nib.load('image.nii.gz')
+        assert np.all(np.asanyarray(nimg.dataobj) == data)
+        assert np.all(nimg.affine == np.diag([2, 2, 2, 1]))
+        assert np.all(img[:] == data)
+
+        # nibabel image is left in a usable state
+        nimg = nib.Nifti1Image(data, np.eye(4))
+        fslimage.saveNibImage(nimg, 'direct.nii.gz', threads=2)
+        assert nimg.file_map['image'].fileobj is None
+        assert nimg.get_filename() == 'direct.nii.gz'
+        assert np.all(np.asanyarray(nib.load('direct.nii.gz').dataobj) == data)
+
+        # image pairs are saved via nibabel
+        img.save('pair.img.gz', threads=4)
+        assert np.all(np.asanyarray(nib.load('pair.img.gz').dataobj) == data)
+
+
+def test_Image_save_atomic():
+
+    with tempdir():
+
+        data = np.random.random((10, 10, 10, 5)).astype(np.float32)
+        img  = fslimage.Image(data)
+        img.calcRange()
+
+        wrapper = img.getImageWrapper()
+        drange  = img.dataRange
+
+        # data is not re-loaded from
+        # file after being saved
+        with mock.patch('nibabel.load', side_effect=RuntimeError):
+            img.save('image.nii.gz')
+
+        assert img.getImageWrapper() is wrapper
+        assert img.dataRange == drange
+        assert wrapper.covered
+        assert img.saveState
+        assert img.dataSource == op.abspath('image.nii.gz')
+        assert sorted(os.listdir()) == ['image.nii.gz']
+        assert np.all(np.asanyarray(nib.load('image.nii.gz').dataobj) == data)
+
+        # modify and save over the same file
+        data[..., 2] = 5
+        img[..., 2] = data[..., 2]
+        img.save()
+        assert img.dataRange == (np.min(data), 5)
+        assert sorted(os.listdir()) == ['image.nii.gz']
+        assert np.all(np.asanyarray(nib.load('image.nii.gz').dataobj) == data)
+
+        # both files of a pair are replaced
+        img.save('pair.hdr')
+        data[..., 3] = 7
+        img[..., 3] = data[..., 3]
+        img.save()
+        assert sorted(os.listdir()) == ['image.nii.gz', 'pair.hdr', 'pair.img']
+        assert np.all(np.asanyarray(nib.load('pair.img').dataobj) == data)
+
+        # images which have not been loaded into
+        # memory are re-opened from the new file
+        img = fslimage.Image('pair', loadData=False)
+        img[..., 0]
+        img.save('copy.nii')
+        assert not img.getImageWrapper().inMemory
+        assert img.nibImage.get_filename() == op.abspath('copy.nii')
+        assert np.all(img[:] == data[:])
+
+        # temp files are cleaned up on failure,
+        # and the existing file is untouched
+        before = sorted(os.listdir())
+        img[..., 0] = np.zeros(data.shape[:3])
+        with mock.patch('fsl.data.image.saveNibImage',
+                        side_effect=[RuntimeError]):
+            with pytest.raises(RuntimeError):
+                img.save('copy.nii')
+        assert sorted(os.listdir()) == before
+        assert not img.saveState
+        assert np.all(np.asanyarray(nib.load('copy.nii').dataobj) == data)
+
+
+def test_Image_save_symlink():
+
+    with tempdir():
+
+        data = np.random.random((10, 10, 10, 5)).astype(np.float32)
+        os.mkdir('real')
+        os.mkdir('other')
+        fslimage.Image(data).save(op.join('real', 'image.nii.gz'))
+        os.symlink(op.join('real', 'image.nii.gz'), 'link.nii.gz')
+
+        # the file that the link points
+        # to is replaced, not the link
+        img          = fslimage.Image('link.nii.gz')
+        data[..., 2] = 5
+        img[..., 2]  = data[..., 2]
+        img.save()
+
+        assert op.islink('link.nii.gz')
+        assert sorted(os.listdir('real')) == ['image.nii.gz']
+        assert np.all(fslimage.Image('real/image.nii.gz')[:] == data)
+
+        # an indexed image opened on the old
+        # file sees the new file after it has
+        # been replaced
+        old = fslimage.Image('real/image.nii.gz', loadData=False)
+        old[..., 0]
+        data[..., 4] = 7
+        img[..., 4]  = data[..., 4]
+        img.save()
+        assert np.all(old[..., 4] == data[..., 4])
+
+        # both files of a pair are written
+        # through their links, even when
+        # they are in different directories
+        fslimage.Image(data).save(op.join('real', 'pair.hdr'))
+        os.rename(op.join('real', 'pair.img'), op.join('other', 'pair.img'))
+        os.symlink(op.join('real',  'pair.hdr'), 'pair.hdr')
+        os.symlink(op.join('other', 'pair.img'), 'pair.img')
+        img          = fslimage.Image('pair', loadData=False)
+        data[..., 0] = 3
+        img[..., 0]  = data[..., 0]
+        img.save()
+
+        assert op.islink('pair.hdr') and op.islink('pair.img')
+        assert sorted(os.listdir('other')) == ['pair.img']
+        assert np.all(fslimage.Image('pair')[:] == data)
+
+
+def test_Image_batchUpdate():
+
+    with tempdir():
+        data = np.random.random((10, 10, 10, 4)).astype(np.float32)
+        fslimage.Image(data).save('image.nii.gz')
+        img  = fslimage.Image('image.nii.gz')
+
+        notified = {}
+        def onData(i, topic, value):
+            notified.setdefault('data', []).append(value)
+        def onSaveState(*a):
+            notified['saveState'] = notified.get('saveState', 0) + 1
+        def onDataRange(*a):
+            notified['dataRange'] = notified.get('dataRange', 0) + 1
+
+        img.register('name1', onData,      'data')
+        img.register('name2', onSaveState, 'saveState')
+        img.register('name3', onDataRange, 'dataRange')
+
+        with img.batchUpdate():
+            img[1, 2, 3, 1]    = 5
+            img[2:4, 5, 5, 2]  = [-5, -6]
+            with img.batchUpdate():
+                img[4, 0, 6, 1] = 0.5
+            assert notified == {}
+            assert img.dataRange == (data.min(), data.max())
+
+        data[1, 2, 3, 1]   = 5
+        data[2:4, 5, 5, 2] = [-5, -6]
+        data[4, 0, 6, 1]   = 0.5
+
+        assert np.all(img[:] == data)
+        assert img.dataRange          == (-6, 5)
+        assert notified['data']       == [(slice(1, 5, 1), slice(0, 6, 1),
+                                            slice(3, 7, 1), slice(1, 3, 1))]
+        assert notified['saveState']  == 1
+        assert notified['dataRange']  == 1
+
+        # no changes, no notifications
+        notified.clear()
+        with img.batchUpdate():
+            pass
+        assert notified == {}
+
+        # range unchanged - no dataRange notification
+        with img.batchUpdate():
+            img[0, 0, 0, 0] = 0.5
+            img[0, 0, 1, 0] = 0.5
+        assert len(notified['data']) == 1
+        assert 'saveState' not in notified
+        assert 'dataRange' not in notified
+
+        # fancy slices cover the whole image
+        notified.clear()
+        with img.batchUpdate():
+            img[data < 0] = 0
+        assert notified['data'] == [tuple(slice(0, s, 1) for s in data.shape)]
+        assert img.dataRange == (0, 5)
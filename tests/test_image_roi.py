@@ -5,12 +5,16 @@
 # Author: Paul McCarthy <pauldmccarthy@gmail.com>
 #
 
+import itertools as it
+
 import pytest
 
-import numpy as np
+import numpy   as np
+import nibabel as nib
 
 import fsl.data.image as fslimage
 import fsl.utils.image.roi as roi
+from fsl.utils.tempdir import tempdir
 
 
 def test_roi():
@@ -45,11 +49,13 @@ def test_roi():
         ([10, 10, 10], [(-5, 15), ( 3, 7),  ( 0, 10)], [20,  4, 10], [-5,  3,  0]),
     ]
 
-    for inshape, bounds, outshape, offset in tests:
+    for (inshape, bounds, outshape, offset), view in it.product(tests,
+                                                                 [False,
+                                                                  True]):
         data  = np.random.randint(1, 10, inshape)
         image = fslimage.Image(data, xform=np.eye(4))
 
-        result = roi.roi(image, bounds)
+        result = roi.roi(image, bounds, view)
 
         expaff        = np.eye(4)
         expaff[:3, 3] = offset
@@ -94,3 +100,44 @@ def test_roi():
     with pytest.raises(ValueError): roi.roi(image, [(0, 10), (6,  5), (0, 10)])
     with pytest.raises(ValueError): roi.roi(image, [(0, 10), (0, 10), (5,  5)])
     with pytest.raises(ValueError): roi.roi(image, [(0, 10), (0, 10), (6,  5)])
+
+
+def test_roi_view():
+
+    with tempdir():
+        data = np.random.random((20, 21, 22, 5)).astype(np.float32)
+        nib.save(nib.Nifti1Image(data, np.eye(4)), 'image.nii.gz')
+
+        image  = fslimage.Image('image.nii.gz', loadData=False)
+        bounds = [(-3, 10), (5, 25), (4, 8)]
+        view   = roi.roi(image, bounds, view=True)
+        copy   = roi.roi(fslimage.Image('image.nii.gz'), bounds)
+        proxy  = view.nibImage.dataobj
+
+        assert isinstance(proxy, roi.ROIProxy)
+        assert proxy.image is image
+        assert view.shape == copy.shape == (13, 20, 4, 5)
+        assert np.all(np.isclose(view.voxToWorldMat, copy.voxToWorldMat))
+        assert not view.getImageWrapper().inMemory
+
+        expected = copy[:]
+        assert np.all(view[:, :, 1, 2] == expected[:, :, 1, 2])
+        assert np.all(view[3:5, 0]     == expected[3:5, 0])
+        assert np.all(view[0]          == 0)
+
+        # the proxy also supports
+        # steps and new axes
+        for slc in [(slice(None, None, -2), 1),
+                    (slice(1, 12, 3), slice(18, 2, -4), 2, 0),
+                    (None, 4),
+                    (Ellipsis, 3)]:
+            assert np.all(proxy[slc] == expected[slc])
+
+        # The source image has not
+        # been loaded into memory
+        assert not image.getImageWrapper().inMemory
+
+        # changes are not propagated
+        view[:] = np.zeros(view.shape)
+        assert np.all(view[:] == 0)
+        assert np.all(image[:] == data)
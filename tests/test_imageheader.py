@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# test_imageheader.py -
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import gzip
+
+import numpy   as np
+import nibabel as nib
+import pytest
+
+import fsl.data.image       as fslimage
+import fsl.data.imageheader as imageheader
+from fsl.utils.tempdir import tempdir
+
+
+def _make_images():
+
+    data   = np.random.random((20, 21, 22, 3)).astype(np.float32)
+    affine = np.diag([2, 3, 4, 1])
+    affine[:3, 3] = [10, -20, 30]
+
+    nib.save(nib.Nifti1Image(data, affine), 'n1.nii')
+    nib.save(nib.Nifti1Image(data, affine), 'n1.nii.gz')
+    nib.save(nib.Nifti2Image(data, affine), 'n2.nii.gz')
+    nib.save(nib.Nifti1Pair( data, affine), 'n1pair.hdr')
+    nib.save(nib.Nifti2Pair( data, affine), 'n2pair.hdr.gz')
+    nib.save(nib.AnalyzeImage(data[..., 0].astype(np.int16), affine),
+             'analyze.hdr')
+
+    hdr = nib.Nifti1Header(endianness='>')
+    hdr.set_data_dtype(np.int16)
+    nib.save(nib.Nifti1Image(data.astype(np.int16), affine, hdr),
+             'bigendian.nii.gz')
+
+    return ['n1.nii', 'n1.nii.gz', 'n2.nii.gz', 'n1pair.hdr',
+            'n2pair.hdr.gz', 'analyze.hdr', 'bigendian.nii.gz']
+
+
+def _check(fname, got):
+
+    # the header of a nibabel image may
+    # differ from the header in the file
+    # (e.g. vox_offset), so we compare the
+    # raw bytes against the file header.
+    expected = nib.load(fname).header
+    base, ext = fslimage.splitExt(fname)
+    with nib.openers.ImageOpener(base + ext.replace('.img', '.hdr')) as f:
+        raw = type(expected).from_fileobj(f, check=False)
+
+    assert type(got)                        == type(expected)
+    assert got.endianness                   == expected.endianness
+    assert got.binaryblock                  == raw.binaryblock
+    assert got.get_data_shape()             == expected.get_data_shape()
+    assert got.get_zooms()                  == expected.get_zooms()
+    assert got.get_data_dtype()             == expected.get_data_dtype()
+    assert np.all(got.get_best_affine()     == expected.get_best_affine())
+
+
+def test_readHeader():
+    with tempdir():
+        for fname in _make_images():
+            hdr = imageheader.readHeader(fname)
+            _check(fname, hdr)
+
+            nifti = fslimage.Nifti(hdr)
+            img   = fslimage.Image(fname)
+            assert nifti.shape        == img.shape
+            assert nifti.pixdim       == img.pixdim
+            assert nifti.niftiVersion == img.niftiVersion
+            assert np.all(nifti.voxToWorldMat == img.voxToWorldMat)
+
+        # no extension / .img of a pair
+        _check('n2.nii.gz', imageheader.readHeader('n2'))
+        _check('n1pair.hdr', imageheader.readHeader('n1pair.img'))
+        _check('n2pair.hdr.gz', imageheader.readHeader('n2pair.img.gz'))
+
+
+def test_readHeader_partial_gzip():
+
+    # Only the start of the gzip stream
+    # should need to be decompressed
+    with tempdir():
+        data = np.random.random((50, 50, 50)).astype(np.float32)
+        nib.save(nib.Nifti1Image(data, np.eye(4)), 'image.nii.gz')
+
+        with open('image.nii.gz', 'rb') as f:
+            compressed = f.read()
+        with open('truncated.nii.gz', 'wb') as f:
+            f.write(compressed[:len(compressed) // 4])
+
+        _check('image.nii.gz', imageheader.readHeader('truncated.nii.gz'))
+
+
+def test_readHeader_bad():
+    with tempdir():
+        with open('short.nii', 'wb') as f:
+            f.write(b'\0' * 100)
+        with open('bad.nii', 'wb') as f:
+            f.write(b'\0' * 1000)
+        with gzip.open('bad.nii.gz', 'wb') as f:
+            f.write(b'\0' * 1000)
+
+        for fname in ['short.nii', 'bad.nii', 'bad.nii.gz']:
+            with pytest.raises(ValueError):
+                imageheader.readHeader(fname)
+
+        with pytest.raises(fslimage.PathError):
+            imageheader.readHeader('nonexistent')
+
+
+def test_readHeaders():
+    with tempdir():
+        fnames  = _make_images() * 5
+        headers = imageheader.readHeaders(fnames, nthreads=4)
+        assert len(headers) == len(fnames)
+        for fname, hdr in zip(fnames, headers):
+            _check(fname, hdr)
+
+        with open('bad.nii', 'wb') as f:
+            f.write(b'\0' * 1000)
+        with pytest.raises(ValueError):
+            imageheader.readHeaders(fnames + ['bad.nii', 'n1.nii.gz'])
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+#
+# test_imagesummary.py -
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import itertools as it
+
+import numpy as np
+import pytest
+
+import fsl.data.image        as fslimage
+import fsl.data.imagesummary as imagesummary
+from fsl.utils.tempdir import tempdir
+
+
+def _random_region(shape):
+    slc = []
+    for s in shape:
+        lo = np.random.randint(0, s)
+        hi = np.random.randint(lo + 1, s + 1)
+        slc.append(slice(lo, hi))
+    return tuple(slc)
+
+
+def _stats(data):
+    data = data[np.isfinite(data)]
+    if data.size == 0:
+        return np.nan, np.nan, 0, 0
+    return data.min(), data.max(), data.sum(), data.size
+
+
+def _check(summary, data, region):
+    expmin, expmax, expsum, expcount = _stats(data[region])
+    gotmin, gotmax, gotsum, gotcount = summary.query(region)
+    assert gotcount == expcount
+    assert np.allclose(gotsum, expsum)
+    assert np.isclose(gotmin, expmin, equal_nan=True)
+    assert np.isclose(gotmax, expmax, equal_nan=True)
+
+
+def test_blockStats():
+    data   = np.random.random((10, 7, 5))
+    data[0, 0, 0] = np.nan
+    data[9, 6, 4] = np.inf
+    mins, maxs, sums, counts = imagesummary.blockStats(data, (4, 4, 2))
+
+    assert mins.shape == (3, 2, 3)
+
+    for i, j, k in it.product(range(3), range(2), range(3)):
+        block = data[i * 4:(i + 1) * 4, j * 4:(j + 1) * 4, k * 2:(k + 1) * 2]
+        exp   = _stats(block)
+        assert np.isclose(mins[  i, j, k], exp[0])
+        assert np.isclose(maxs[  i, j, k], exp[1])
+        assert np.isclose(sums[  i, j, k], exp[2])
+        assert        counts[i, j, k] == exp[3]
+
+
+def test_ImageSummary():
+
+    for shape, dtype in [((20, 30, 17),    np.float32),
+                         ((33, 12, 9, 4),  np.int16),
+                         ((9, 9, 9),       np.uint8)]:
+
+        data  = np.random.randint(0, 100, shape).astype(dtype)
+        if dtype == np.float32:
+            data[np.random.random(shape) < 0.05] = np.nan
+        image   = fslimage.Image(data)
+        summary = imagesummary.ImageSummary(image, blockShape=4)
+
+        assert summary.nlevels > 1
+        assert summary.blocks(summary.nlevels - 1)[0].size == 1
+
+        _check(summary, data, (slice(None),) * len(shape))
+        assert summary.range() == (np.nanmin(data), np.nanmax(data))
+        assert np.isclose(summary.mean(), np.nanmean(data))
+        assert summary.count() == np.isfinite(data).sum()
+
+        for _ in range(20):
+            _check(summary, data, _random_region(shape))
+
+        # negative/integer indices
+        _check(summary, data, (slice(-5, None), 3))
+        _check(summary, data, (Ellipsis, -1))
+
+        # approximate queries are calculated
+        # on all intersecting blocks
+        region = _random_region(shape)
+        rmin, rmax = summary.range(region, exact=False)
+        bmin, bmax = _stats(data[region])[:2]
+        assert rmin <= bmin
+        assert rmax >= bmax
+
+        with pytest.raises(ValueError):
+            summary.query(data > 50)
+        with pytest.raises(ValueError):
+            summary.query(np.s_[::2])
+
+        summary.destroy()
+
+
+def test_ImageSummary_update():
+
+    data    = np.random.random((20, 20, 20, 3)).astype(np.float32)
+    image   = fslimage.Image(data.copy())
+    summary = imagesummary.ImageSummary(image, blockShape=(5, 5, 5, 1))
+
+    for _ in range(10):
+        region = _random_region(data.shape)
+        values = np.random.random(data[region].shape).astype(np.float32) * 10
+        values = values - 5
+        data[ region] = values
+        image[region] = values
+        for _ in range(5):
+            _check(summary, data, _random_region(data.shape))
+        _check(summary, data, (slice(None),) * 4)
+
+    # boolean mask
+    mask          = np.zeros(data.shape, dtype=bool)
+    mask[3, 4, 5] = True
+    data[ mask]   = 100
+    image[mask]   = 100
+    assert summary.range()[1] == 100
+    _check(summary, data, (slice(None),) * 4)
+
+    # no updates after destroy
+    summary.destroy()
+    image[0, 0, 0, 0] = [1000]
+    assert summary.range()[1] == 100
+
+
+def test_ImageSummary_save_load():
+
+    data  = np.random.random((10, 11, 12))
+    image = fslimage.Image(data)
+    summ  = imagesummary.ImageSummary(image, blockShape=3)
+
+    with tempdir():
+        summ.save('summary.npz')
+
+        loaded = imagesummary.ImageSummary(image,
+                                           blockShape=3,
+                                           filename='summary.npz')
+        assert loaded.nlevels == summ.nlevels
+        for level in range(summ.nlevels):
+            for a, b in zip(summ.blocks(level), loaded.blocks(level)):
+                assert np.array_equal(a, b, equal_nan=True)
+
+        region = _random_region(data.shape)
+        assert loaded.query(region) == summ.query(region)
+
+        with pytest.raises(ValueError):
+            imagesummary.ImageSummary(image,
+                                      blockShape=4,
+                                      filename='summary.npz')
+        with pytest.raises(ValueError):
+            imagesummary.ImageSummary(fslimage.Image(data[:5]),
+                                      blockShape=3,
+                                      filename='summary.npz')
+
+
+def test_ImageSummary_bad_args():
+    with pytest.raises(ValueError):
+        imagesummary.ImageSummary(fslimage.Image(np.zeros((5, 5, 5))),
+                                  blockShape=(2, 2))
+    with pytest.raises(ValueError):
+        imagesummary.ImageSummary(fslimage.Image(np.zeros((5, 5, 5))),
+                                  blockShape=(2, 0, 2))
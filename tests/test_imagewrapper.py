@@ -9,6 +9,9 @@ from __future__ import print_function
 
 import              collections
 import              random
+import              threading
+import              time
+import              mock
 import itertools as it
 import numpy     as np
 import nibabel   as nib
@@ -16,6 +19,7 @@ import              pytest
 
 import fsl.utils.naninfrange as nir
 import fsl.data.imagewrapper as imagewrap
+from fsl.utils.tempdir import tempdir
 
 from . import random_voxels
 
@@ -338,6 +342,255 @@ def test_sliceTupleToSliceObj():
             assert func(slices) == sliceobj
 
 
+def test_chunkSlices():
+
+    func = imagewrap.chunkSlices
+    all_ = slice(None)
+
+    # 10*10 float64 = 800 bytes per z slice
+    chunks = list(func((10, 10, 10), 2, 2400, 8))
+    assert chunks == [(all_, all_, slice(0,  3)),
+                      (all_, all_, slice(3,  6)),
+                      (all_, all_, slice(6,  9)),
+                      (all_, all_, slice(9, 10))]
+
+    # at least one slice per chunk
+    chunks = list(func((10, 10, 10, 4), -1, 1, 8))
+    assert chunks == [(all_, all_, all_, slice(i, i + 1)) for i in range(4)]
+
+    # everything in one chunk
+    chunks = list(func((10, 10, 10), 0, 10 ** 6, 8))
+    assert chunks == [(slice(0, 10), all_, all_)]
+
+
+def test_maskedData():
+
+    class Proxy(object):
+        """Records the regions that are read. """
+        def __init__(self, data):
+            self.data  = data
+            self.shape = data.shape
+            self.reads = []
+        def __getitem__(self, slc):
+            self.reads.append(slc)
+            return self.data[slc]
+
+    func  = imagewrap.maskedData
+    data  = np.random.random((10, 11, 12, 5))
+    mask  = np.zeros((10, 11, 12), dtype=bool)
+    mask[2:4, 3:7, 1:3] = True
+    mask[5,   8,   9]   = True
+    proxy = Proxy(data)
+
+    # 3D mask applied to 4D data - the mask
+    # bounding box is 4*6 voxels in x/y, and
+    # touches z slices 1, 2 and 9, so we get
+    # three slabs of one slice, or two slabs
+    # of (up to) four slices
+    slcbytes = 4 * 6 * 5 * 8
+    for nbytes, nreads in [(slcbytes, 3), (slcbytes * 4, 2)]:
+        proxy.reads = []
+        result      = func(proxy, mask, nbytes, 8)
+        assert result.shape == (mask.sum(), 5)
+        assert np.all(result == data[mask])
+        assert len(proxy.reads) == nreads
+
+    # only the bounding box of each slab is read
+    assert proxy.reads[0] == (slice(2, 4), slice(3, 7), slice(1, 3),
+                              slice(None))
+    assert proxy.reads[1] == (slice(5, 6), slice(8, 9), slice(9, 10),
+                              slice(None))
+
+    # full mask, and empty mask
+    mask4d = data > 0.5
+    assert np.all(func(proxy, mask4d, 1, 8) == data[mask4d])
+    result = func(proxy, np.zeros(mask.shape, dtype=bool), 1, 8)
+    assert result.shape == (0, 5)
+
+
+def test_volumeCache():
+
+    with tempdir():
+
+        for shape in [(10, 11, 12, 6), (10, 11, 12, 6, 1), (10, 11, 12)]:
+
+            data = np.random.random(shape).astype(np.float32)
+            nib.save(nib.Nifti1Image(data, np.eye(4)), 'image.nii.gz')
+
+            if len(shape) > 4: data = data[..., 0]
+            ndim    = data.ndim
+            volsize = data[..., 0].nbytes
+            wrapper = imagewrap.ImageWrapper(nib.load('image.nii.gz'),
+                                             volumeCache=volsize * 3)
+            vcache  = wrapper.volumeCache
+            reads   = []
+            proxy   = type(wrapper._ImageWrapper__image.dataobj)
+            getitem = proxy.__getitem__
+
+            def record(self, slc):
+                reads.append(slc)
+                return getitem(self, slc)
+
+            with mock.patch.object(proxy, '__getitem__', record):
+
+                # first read of a volume is a miss
+                # which reads the whole volume
+                slc = (slice(2, 5), 1, slice(None))[:ndim - 1] + (1,)
+                vox = (3, 4, 5)[:ndim - 1] + (1,)
+                assert np.all(wrapper[..., 1] == data[..., 1])
+                assert np.all(wrapper[slc]    == data[slc])
+                assert wrapper[vox]           == data[vox]
+                assert vcache.misses == 1
+                assert vcache.hits   == 2
+                assert len(reads)    == 1
+
+                # multi-volume reads
+                slc = (2, 3, slice(None))[:ndim - 1] + (slice(0, 3),)
+                assert np.all(wrapper[slc]      == data[slc])
+                assert np.all(wrapper[..., 1:3]     == data[..., 1:3])
+                assert len(reads)    == 3
+                assert vcache.nbytes == volsize * 3
+
+                # least recently used volumes are dropped
+                assert np.all(wrapper[..., 4] == data[..., 4])
+                assert np.all(wrapper[..., 0] == data[..., 0])
+                assert len(reads)             == 5
+
+                # reads which do not fit bypass the cache
+                nreads = len(reads)
+                assert np.all(wrapper[:] == data)
+                assert len(reads) == nreads + 1
+
+                # cached data is read only
+                with pytest.raises(ValueError):
+                    wrapper[..., 4][0, 0] = 1
+
+                # cache is cleared on write
+                slc          = (slice(None),) * (ndim - 1) + (4,)
+                wrapper[slc] = np.zeros(data.shape[:-1])
+                data[   ..., 4] = 0
+                assert vcache.nbytes == 0
+                assert np.all(wrapper[:] == data)
+
+            # cache may be shared
+            vcache  = imagewrap.cache.Cache(maxsize=None, maxbytes=volsize * 2)
+            data1   = np.asanyarray(nib.load('image.nii.gz').dataobj)
+            if len(shape) > 4: data1 = data1[..., 0]
+            wrapper1 = imagewrap.ImageWrapper(nib.load('image.nii.gz'),
+                                              volumeCache=vcache)
+            wrapper2 = imagewrap.ImageWrapper(nib.load('image.nii.gz'),
+                                              volumeCache=vcache)
+            assert np.all(wrapper1[..., 0] == data1[..., 0])
+            assert np.all(wrapper2[..., 0] == data1[..., 0])
+            assert vcache.misses == 2
+            assert len(vcache)   == 2
+            wrapper1.clearVolumeCache()
+            assert len(vcache)   == 1
+            assert np.all(wrapper2[..., 0] == data1[..., 0])
+            assert vcache.hits   == 1
+
+            # cache is cleared when the image is replaced
+            wrapper2.setImage(nib.load('image.nii.gz'))
+            assert len(vcache) == 0
+
+
+def test_lazyScaling():
+
+    data = np.random.randint(-1000, 1000, (10, 11, 12, 5)).astype(np.int16)
+
+    for slope, inter in [(0.5, 3), (-2, 1)]:
+
+        with tempdir():
+            image = nib.Nifti1Image(data, np.eye(4))
+            image.header.set_slope_inter(slope, inter)
+            nib.save(image, 'image.nii.gz')
+
+            expected = data * np.float32(slope) + np.float32(inter)
+            explo    = expected.min()
+            exphi    = expected.max()
+
+            # data range calculated on read
+            # and on calcRange, from raw data
+            for calc in [False, True]:
+                wrapper = imagewrap.ImageWrapper(nib.load('image.nii.gz'),
+                                                 loadData=True,
+                                                 lazyScaling=True)
+
+                assert wrapper.lazyScaling
+                assert wrapper.inMemory
+
+                if calc:
+                    wrapper.calcRange()
+                else:
+                    assert np.all(wrapper[..., 2] == expected[..., 2])
+                    assert wrapper.dataRange == (expected[..., 2].min(),
+                                                 expected[..., 2].max())
+                    wrapper[:]
+
+                assert wrapper.dataRange == (explo, exphi)
+
+            assert wrapper[:].dtype  == np.float32
+            assert wrapper[1, 2, 3, 4] == expected[1, 2, 3, 4]
+            assert np.all(wrapper[:] == expected)
+
+            # scaled on first write
+            wrapper[0, 0, 0, 0] = 0.25
+            expected[0, 0, 0, 0] = 0.25
+            assert not wrapper.lazyScaling
+            assert np.all(wrapper[:] == expected)
+
+            # no effect on unscaled images,
+            # or if not requested
+            wrapper = imagewrap.ImageWrapper(nib.load('image.nii.gz'),
+                                             loadData=True)
+            assert not wrapper.lazyScaling
+            assert wrapper[:].dtype == np.float64
+
+        image   = nib.Nifti1Image(data, np.eye(4))
+        wrapper = imagewrap.ImageWrapper(image,
+                                         loadData=True,
+                                         lazyScaling=True)
+        assert not wrapper.lazyScaling
+        assert wrapper[:].dtype == np.int16
+
+
+def test_voxelData():
+
+    data   = np.random.random((10, 11, 12, 5))
+    coords = [np.random.randint(0, s, 100) for s in data.shape[:3]]
+    image  = nib.Nifti1Image(data, np.eye(4))
+
+    # coordinates in any order, and with
+    # duplicates, read in one or many slabs
+    for nbytes in [1, 10 ** 6]:
+        result = imagewrap.voxelData(image.dataobj, coords, nbytes, 8)
+        assert np.all(result == data[tuple(coords)])
+
+    for loadData in [False, True]:
+        wrapper = imagewrap.ImageWrapper(image, loadData=loadData)
+        assert np.all(wrapper.voxelData(coords) == data[tuple(coords)])
+        with pytest.raises(IndexError):
+            wrapper.voxelData([[10], [0], [0]])
+
+
+
+def test_volumeRanges():
+
+    for dtype in [np.int16, np.uint8, np.float32, np.float64]:
+        data = np.random.randint(0, 100, (10, 11, 12, 5)).astype(dtype)
+
+        if np.issubdtype(dtype, np.floating):
+            data[0, 0, 0, 1] = np.nan
+            data[0, 0, 0, 2] = np.inf
+            data[0, 0, 0, 3] = -np.inf
+            data[..., 4]     = np.nan
+
+        for arr in [data, np.asfortranarray(data)]:
+            exp = [nir.naninfrange(arr[..., v]) for v in range(5)]
+            got = imagewrap.volumeRanges(arr)
+            assert got.shape == (5, 2)
+            assert np.all(np.isclose(got, exp, equal_nan=True))
+
 
 def test_adjustCoverage():
 
@@ -361,6 +614,48 @@ def test_adjustCoverage():
         assert np.all(imagewrap.adjustCoverage(coverage, expansion) == result)
 
 
+def test_adjustCoverage_multiVolume():
+
+    n        = np.nan
+    coverage = np.array([[[3, n, 0],
+                          [2, n, 0]],
+                         [[5, n, 9],
+                          [6, n, 9]]], dtype=float)
+    expected = np.array([[[3, 4, 0],
+                          [1, 1, 0]],
+                         [[7, 7, 9],
+                          [8, 8, 9]]], dtype=float)
+
+    result = imagewrap.adjustCoverage(coverage, [(4, 7), (1, 8), (0, 3)])
+
+    assert np.all(result == expected)
+    assert np.all(np.isnan(coverage[:, :, 1]))
+
+
+def test_coverageGroups():
+
+    n        = np.nan
+    coverage = np.full((2, 2, 6), n)
+
+    coverage[:, :, 1] = [[0, 0], [5, 5]]
+    coverage[:, :, 3] = [[0, 0], [5, 5]]
+    coverage[:, :, 4] = [[0, 1], [5, 5]]
+
+    groups, inverse = imagewrap.coverageGroups(coverage)
+
+    assert len(groups) == 3
+    assert inverse[0] == inverse[2] == inverse[5]
+    assert inverse[1] == inverse[3]
+    assert len(set(inverse[[0, 1, 4]])) == 3
+
+    for vol, group in enumerate(inverse):
+        assert np.array_equal(groups[group], coverage[:, :, vol],
+                              equal_nan=True)
+
+    groups, inverse = imagewrap.coverageGroups(np.zeros((2, 2, 0)))
+    assert groups == [] and len(inverse) == 0
+
+
 def test_sliceOverlap(niters):
 
     # A bunch of random coverages
@@ -572,6 +867,158 @@ def test_calcExpansion(niters):
             _test_expansion(coverage, slices, vols, exps)
 
 
+def test_calcExpansion_mixedCoverage(niters):
+
+    # Expansions for volumes with different
+    # coverage should be the same as those
+    # calculated for each volume separately
+    for _ in range(niters):
+
+        ndims      = random.choice((2, 3, 4)) - 1
+        shape      = np.random.randint(5, 60, size=ndims + 1)
+        shape[-1]  = 12
+        coverages  = [random_coverage(shape)[:, :, :1] for _ in range(3)]
+        coverages += [np.full((2, ndims, 1), np.nan)]
+        coverage   = np.concatenate(
+            [random.choice(coverages) for _ in range(shape[-1])], axis=2)
+
+        for _ in range(niters):
+            slices     = random_slices(coverages[0], shape, 'overlap')
+            vols, exps = imagewrap.calcExpansion(slices, coverage)
+
+            expvols = []
+            expexps = []
+            for vol in range(*slices[ndims]):
+                volslices = list(slices)
+                volslices[ndims] = (0, 1)
+                vv, ve = imagewrap.calcExpansion(
+                    volslices, coverage[:, :, vol:vol + 1])
+                expvols.extend([vol] * len(vv))
+                expexps.extend([e[:ndims] + [(vol, vol + 1)] for e in ve])
+
+            assert vols == expvols
+            assert [[tuple(r) for r in e] for e in exps] == \
+                   [[tuple(r) for r in e] for e in expexps]
+
+
+@pytest.mark.longtest
+def test_coverage_benchmark():
+
+    # Planning time for a data range update
+    # should not grow much faster than the
+    # number of volumes
+    ncalls = 10
+    nexps  = set()
+
+    for nvols in (100, 500, 2000):
+
+        shape    = (64, 64, 30, nvols)
+        coverage = np.full((2, 3, nvols), np.nan)
+
+        # First half of volumes partially covered
+        coverage[0, :, :nvols // 2] = 0
+        coverage[1, :, :nvols // 2] = [[32], [32], [15]]
+
+        slices = [(0, 64), (0, 64), (10, 20), (0, nvols)]
+        start  = time.perf_counter()
+        for _ in range(ncalls):
+            _, exps = imagewrap.calcExpansion(slices, coverage)
+            exps    = imagewrap.collapseExpansions(exps, 3)
+            imagewrap.sliceOverlap(slices, coverage)
+            imagewrap.sliceCovered(slices, coverage)
+            imagewrap.adjustCoverage(coverage, slices)
+        elapsed = (time.perf_counter() - start) / ncalls
+
+        print('{:5d} volumes: {:0.2f}ms ({} expansions)'.format(
+            nvols, elapsed * 1000, len(exps)))
+
+        wrapper = imagewrap.ImageWrapper(
+            nib.Nifti1Image(np.zeros(shape, dtype=np.float32), np.eye(4)),
+            loadData=True)
+        start = time.perf_counter()
+        wrapper[:, :, 3, :]
+        print('{:5d} volumes: first read {:0.2f}ms'.format(
+            nvols, (time.perf_counter() - start) * 1000))
+        nexps.add(len(exps))
+
+    # Equivalent expansions for adjacent
+    # volumes are collapsed together
+    assert len(nexps) == 1
+
+
+@pytest.mark.longtest
+def test_coverage_reuse_benchmark():
+
+    # Data which has been read by __getitem__
+    # is re-used when the coverage is expanded,
+    # rather than being read from the image again
+    shape = (64, 64, 32, 20)
+    data  = np.random.random(shape).astype(np.float32)
+    keys  = [(Ellipsis, 3),
+             (slice(None), slice(None), 10, 5),
+             (slice(None), slice(None), 20, 5),
+             slice(None)]
+    names = ['[..., 3]', '[:, :, 10, 5]', '[:, :, 20, 5]', '[:]']
+
+    origGetitem = nib.arrayproxy.ArrayProxy.__getitem__
+    origExpand  = imagewrap.ImageWrapper._ImageWrapper__expandCoverage
+
+    def run(reuse):
+
+        nbytes = [0]
+
+        def getitem(self, sliceobj):
+            result     = origGetitem(self, sliceobj)
+            nbytes[0] += result.nbytes
+            return result
+
+        # The old behaviour - everything
+        # is read from the image again
+        def expand(self, slices, data=None):
+            if not reuse:
+                data = None
+            return origExpand(self, slices, data)
+
+        wrapper = imagewrap.ImageWrapper(nib.load('image.nii.gz'))
+        results = []
+
+        with mock.patch.object(nib.arrayproxy.ArrayProxy,
+                               '__getitem__', getitem), \
+             mock.patch.object(imagewrap.ImageWrapper,
+                               '_ImageWrapper__expandCoverage', expand):
+            for key in keys:
+                nbytes[0] = 0
+                start     = time.perf_counter()
+                returned  = wrapper[key].nbytes
+                elapsed   = time.perf_counter() - start
+                results.append((returned, nbytes[0], elapsed))
+
+        assert wrapper.dataRange == (data.min(), data.max())
+        return results
+
+    with tempdir():
+        nib.save(nib.Nifti1Image(data, np.eye(4)), 'image.nii.gz')
+        before = run(False)
+        after  = run(True)
+
+    print()
+    print('{:<14s} {:>9s} {:>19s} {:>19s}'.format(
+        'key', 'returned', 'read (no re-use)', 'read (re-use)'))
+    for name, (returned, rbefore, tbefore), (_, rafter, tafter) in \
+            zip(names, before, after):
+        print('{:<14s} {:9d} {:9d} {:7.1f}ms {:9d} {:7.1f}ms'.format(
+            name, returned, rbefore, tbefore * 1000, rafter, tafter * 1000))
+
+        assert rafter <= rbefore
+
+    # When the coverage does not need to be
+    # expanded beyond what was read, nothing
+    # needs to be read a second time
+    for i in (0, 1, 3):
+        assert after[i][1] == after[i][0]
+        assert after[i][1] <  before[i][1]
+
+
 def _ImageWraper_busy_wait(wrapper, v=0):
     tt = wrapper.getTaskThread()
     if tt is not None:
@@ -673,6 +1120,190 @@ def _test_ImageWrapper_read(niters, seed, threaded, addnans=False):
                 else:             assert     wrapper.covered
 
 
+def test_ImageWrapper_calcRange_threaded(seed):
+    _test_ImageWrapper_calcRange(True)
+def test_ImageWrapper_calcRange_unthreaded(seed):
+    _test_ImageWrapper_calcRange(False)
+def _test_ImageWrapper_calcRange(threaded):
+
+    # (shape, index of volume dimension)
+    shapes = [((10, 11, 12, 13), 3),
+              ((10, 11, 12),     2),
+              ((10, 11),         1),
+              ((10, 11, 12, 1),  2)]
+
+    for (shape, volDim), nthreads, addnans in it.product(shapes,
+                                                         [1, 4],
+                                                         [False, True]):
+
+        data = np.random.randint(-100, 100, shape).astype(np.float32)
+
+        if addnans:
+            data[data < -80] = np.nan
+            data[data >  80] = np.inf
+
+        img     = nib.Nifti1Image(data, np.eye(4))
+        wrapper = imagewrap.ImageWrapper(img, threaded=threaded)
+        nvols    = wrapper.shape[volDim]
+        notified = [False]
+
+        def rangeChanged(*a):
+            notified[0] = True
+
+        wrapper.register('listener', rangeChanged)
+
+        # partially covered, with the first
+        # and a middle volume fully covered
+        if volDim == 3:
+            wrapper[..., 0]
+            wrapper[:5, :5, :5, nvols // 2]
+        elif volDim == 2:
+            wrapper[..., 0]
+            wrapper[:5, :5, nvols // 2]
+        else:
+            wrapper[:, 0, 0]
+            wrapper[:5, nvols // 2, 0]
+        _ImageWraper_busy_wait(wrapper)
+
+        assert not wrapper.covered
+
+        wrapper.calcRange(nthreads)
+        _ImageWraper_busy_wait(wrapper)
+
+        assert notified[0]
+        assert wrapper.covered
+        assert np.all(np.isclose(wrapper.dataRange, nir.naninfrange(data)))
+
+        for vol in range(nvols):
+            cov = wrapper.coverage(vol)
+            assert np.all(cov[0] == 0)
+            assert np.all(cov[1] == wrapper.shape[:volDim])
+
+        # no-op when already covered
+        notified[0] = False
+        wrapper.calcRange(nthreads)
+        _ImageWraper_busy_wait(wrapper)
+        assert not notified[0]
+
+
+def test_ImageWrapper_read_reuses_data_threaded():
+    _test_ImageWrapper_read_reuses_data(True)
+def test_ImageWrapper_read_reuses_data_unthreaded():
+    _test_ImageWrapper_read_reuses_data(False)
+def _test_ImageWrapper_read_reuses_data(threaded):
+
+    # Make sure that data passed through to the range
+    # calculation is re-used, rather than being read
+    # from disk again
+    nbytes = [0]
+    origGetItem = nib.arrayproxy.ArrayProxy.__getitem__
+    def getitem(self, slc):
+        data       = origGetItem(self, slc)
+        nbytes[0] += data.nbytes
+        return data
+
+    with tempdir():
+        data = np.random.random((20, 20, 20, 10)).astype(np.float32)
+        nib.save(nib.Nifti1Image(data, np.eye(4)), 'image.nii')
+
+        img     = nib.load('image.nii')
+        wrapper = imagewrap.ImageWrapper(img, threaded=threaded)
+        volsize = data[..., 0].nbytes
+
+        with mock.patch('nibabel.arrayproxy.ArrayProxy.__getitem__', getitem):
+
+            # a whole volume - no extra reads
+            wrapper[..., 3]
+            _ImageWraper_busy_wait(wrapper)
+            assert nbytes[0] == volsize
+            assert wrapper.dataRange == nir.naninfrange(data[..., 3])
+
+            # Two disjoint regions - the coverage
+            # has to expand to encompass both, so
+            # the region between them has to be
+            # read, but neither region is read
+            # more than once.
+            nbytes[0] = 0
+            wrapper[ 2:5,   2:5,   2:5,  5]
+            wrapper[10:15, 10:15, 10:15, 5]
+            _ImageWraper_busy_wait(wrapper)
+            bbox = data[2:15, 2:15, 2:15, 5]
+            assert nbytes[0] == bbox.nbytes
+            assert np.all(np.isclose(
+                wrapper.dataRange,
+                nir.naninfrange(np.concatenate((data[..., 3].flat,
+                                                bbox.flat)))))
+
+            # Everything
+            nbytes[0] = 0
+            wrapper[:]
+            _ImageWraper_busy_wait(wrapper)
+            assert nbytes[0] == data.nbytes
+            assert wrapper.covered
+            assert wrapper.dataRange == nir.naninfrange(data)
+
+
+def test_ImageWrapper_write_keeps_coverage_threaded():
+    _test_ImageWrapper_write_keeps_coverage(True)
+def test_ImageWrapper_write_keeps_coverage_unthreaded():
+    _test_ImageWrapper_write_keeps_coverage(False)
+def _test_ImageWrapper_write_keeps_coverage(threaded):
+
+    data = np.random.randint(10, 90, (10, 10, 10, 4)).astype(np.float32)
+    data[1, 1, 1, 2] = 0
+    data[8, 8, 8, 2] = 100
+
+    img     = nib.Nifti1Image(data, np.eye(4))
+    wrapper = imagewrap.ImageWrapper(img, threaded=threaded)
+
+    wrapper[:]
+    _ImageWraper_busy_wait(wrapper)
+    assert wrapper.covered
+    assert wrapper.dataRange == (0, 100)
+
+    # Count the number of expansions which
+    # need to read data from the image
+    nreads    = [0]
+    origRange = imagewrap.volumeRanges
+    def volumeRanges(d):
+        nreads[0] += 1
+        return origRange(d)
+
+    with mock.patch('fsl.data.imagewrapper.volumeRanges', volumeRanges):
+
+        # Writes which don't touch the
+        # extremes, or extend the range.
+        wrapper[3:5, 3:5, 3:5, 2] = np.full((2, 2, 2), 50)
+        wrapper[3:5, 3:5, 3:5, 2] = np.full((2, 2, 2), 120)
+        wrapper[0,   0,   0,   0] = -5
+        _ImageWraper_busy_wait(wrapper)
+
+        assert wrapper.covered
+        assert wrapper.dataRange == (-5, 120)
+
+        # Each write needs the range of the
+        # old and new data, but nothing else
+        assert nreads[0] == 6
+
+        # A write over the maximum will
+        # cause the range to be recalculated
+        nreads[0] = 0
+        wrapper[3:5, 3:5, 3:5, 2] = np.full((2, 2, 2), 60)
+        _ImageWraper_busy_wait(wrapper)
+        assert nreads[0] > 2
+        assert wrapper.covered
+        assert wrapper.dataRange == (-5, 100)
+
+        # Boolean mask writes always
+        # cause a recalculation
+        mask = np.zeros(data.shape, dtype=bool)
+        mask[0, 0, 0, 0] = True
+        wrapper[mask] = [50]
+        _ImageWraper_busy_wait(wrapper)
+        assert wrapper.covered
+        assert wrapper.dataRange == (0, 100)
+
+
 @pytest.mark.longtest
 def test_ImageWrapper_write_out_threaded(niters, seed):
     _test_ImageWrapper_write_out(niters, seed, True)
@@ -1381,3 +2012,310 @@ def test_4D_indexing(shape=None, img=None):
     img[:, 0, :, :] = [[[999] * shape[0]] * shape[2]] * shape[3]
     img[:, :, 0, :] = [[[999] * shape[0]] * shape[1]] * shape[3]
     img[:, :, :, 0] = [[[999] * shape[0]] * shape[1]] * shape[2]
+
+
+def test_setImage():
+
+    data    = np.random.random((10, 10, 10, 4)).astype(np.float32)
+    nimg    = nib.Nifti1Image(data, np.eye(4))
+    wrapper = imagewrap.ImageWrapper(nimg, loadData=True)
+    wrapper[:]
+
+    assert wrapper.inMemory
+    assert wrapper.covered
+
+    # same data, real shape differs from canonical
+    # shape - data and coverage are retained
+    newimg = nib.Nifti1Image(data[..., np.newaxis], np.eye(4))
+    wrapper.setImage(newimg)
+    assert wrapper.covered
+    assert wrapper.dataRange == (data.min(), data.max())
+    assert np.all(wrapper[:] == data)
+    assert wrapper[..., 2].shape == (10, 10, 10)
+
+    with pytest.raises(ValueError):
+        wrapper.setImage(nib.Nifti1Image(data[..., :2], np.eye(4)))
+
+    with tempdir():
+        nib.save(nimg, 'image.nii')
+        wrapper = imagewrap.ImageWrapper(nib.load('image.nii'),
+                                         writeThrough=True)
+        assert not wrapper.inMemory
+        with pytest.raises(ValueError):
+            wrapper.setImage(nib.load('image.nii'))
+
+
+@pytest.mark.parametrize('threaded', [False, True])
+def test_batchUpdate(threaded):
+
+    data    = np.random.random((10, 10, 10, 4)).astype(np.float32)
+    nimg    = nib.Nifti1Image(data.copy(), np.eye(4))
+    wrapper = imagewrap.ImageWrapper(nimg, loadData=True, threaded=threaded)
+    wrapper[:]
+
+    if threaded:
+        wrapper.getTaskThread().waitUntilIdle()
+
+    assert wrapper.dataRange == (data.min(), data.max())
+
+    maxmask = data == data.max()
+
+    with wrapper.batchUpdate():
+        wrapper[1, 1, 1, 1] = 5
+        with wrapper.batchUpdate():
+            wrapper[2, 2, 2, 2] = -5
+            wrapper[3, 3, 3, 1] = -3
+
+        # range is not updated until
+        # the outermost context exits
+        assert wrapper.dataRange == (data.min(), data.max())
+
+        # overwrite the range maximum
+        wrapper[maxmask] = 0.5
+
+    if threaded:
+        wrapper.getTaskThread().waitUntilIdle()
+
+    data[1, 1, 1, 1] = 5
+    data[2, 2, 2, 2] = -5
+    data[3, 3, 3, 1] = -3
+    data[maxmask]    = 0.5
+    assert np.all(wrapper[:] == data)
+    assert wrapper.dataRange == (data.min(), data.max())
+
+    # range of written volumes is recalculated
+    with wrapper.batchUpdate():
+        wrapper[1, 1, 1, 1] = 0.5
+        wrapper[2, 2, 2, 2] = 0.5
+
+    if threaded:
+        wrapper.getTaskThread().waitUntilIdle()
+
+    data[1, 1, 1, 1] = 0.5
+    data[2, 2, 2, 2] = 0.5
+    assert np.all(wrapper[:] == data)
+    assert wrapper.dataRange == (data.min(), data.max())
+
+    # range is updated even if an error occurs
+    with pytest.raises(ValueError):
+        with wrapper.batchUpdate():
+            wrapper[0, 0, 0, 0] = 10
+            raise ValueError()
+
+    if threaded:
+        wrapper.getTaskThread().waitUntilIdle()
+
+    assert wrapper.dataRange == (data.min(), 10)
+
+
+def test_unionSlices():
+    assert imagewrap.unionSlices([(0, 5), (2, 4)], [(3, 8), (0, 1)]) == \
+        ((0, 8), (0, 4))
+    assert imagewrap.unionSlices([(2, 3)], [(2, 3)]) == ((2, 3),)
+
+
+def test_threaded_taskPool():
+
+    data     = np.random.random((10, 10, 10, 4)).astype(np.float32)
+    wrappers = [imagewrap.ImageWrapper(nib.Nifti1Image(data, np.eye(4)),
+                                       loadData=True,
+                                       threaded=True)
+                for _ in range(10)]
+
+    # all wrappers share one pool
+    pool = imagewrap.rangeTaskPool()
+    assert all(w.getTaskPool() is pool for w in wrappers)
+    assert pool.nthreads == imagewrap.RANGE_THREADS
+
+    for w in wrappers:
+        w[..., 0]
+        w.calcRange()
+
+    assert imagewrap.waitUntilIdle(timeout=30)
+    for w in wrappers:
+        assert w.covered
+        assert w.dataRange == (data.min(), data.max())
+
+    w = wrappers[0]
+    w[0, 0, 0, 0] = 10
+    assert w.waitUntilIdle(timeout=30)
+    assert w.dataRange == (data.min(), 10)
+
+    # unthreaded wrappers don't use the pool
+    w = imagewrap.ImageWrapper(nib.Nifti1Image(data, np.eye(4)))
+    assert w.getTaskPool() is None
+    assert w.waitUntilIdle()
+
+
+def test_threaded_priority():
+
+    data = np.random.random((10, 10, 10, 4)).astype(np.float32)
+
+    def listener(*a):
+        pass
+
+    # by default, wrappers with listeners have priority
+    w1 = imagewrap.ImageWrapper(nib.Nifti1Image(data, np.eye(4)),
+                                threaded=True)
+    w2 = imagewrap.ImageWrapper(nib.Nifti1Image(data, np.eye(4)),
+                                threaded=True)
+    w2.register('listener', listener)
+
+    assert not w1._ImageWrapper__hasPriority()
+    assert     w2._ImageWrapper__hasPriority()
+
+    # or priority can be determined by a function
+    called = []
+    def prio():
+        called.append(True)
+        return True
+
+    w = imagewrap.ImageWrapper(nib.Nifti1Image(data, np.eye(4)),
+                               threaded=True,
+                               priority=prio)
+    assert w._ImageWrapper__hasPriority()
+    assert len(called) == 1
+    w.calcRange()
+    assert w.waitUntilIdle(timeout=30)
+    assert w.covered
+
+
+def test_threaded_getTaskThread():
+
+    data   = np.random.random((10, 10, 10, 4)).astype(np.float32)
+    w1     = imagewrap.ImageWrapper(nib.Nifti1Image(data, np.eye(4)),
+                                    threaded=True)
+    w2     = imagewrap.ImageWrapper(nib.Nifti1Image(data, np.eye(4)),
+                                    threaded=True)
+    event  = threading.Event()
+    called = []
+    tt1    = w1.getTaskThread()
+    tt2    = w2.getTaskThread()
+
+    # the deprecated TaskThread interface
+    # only operates on the tasks of its
+    # own wrapper
+    assert tt1.pool is w1.getTaskPool()
+    assert tt1.owner == id(w1)
+    tt2.enqueue(event.wait, taskName='block')
+    assert not tt2.isIdle()
+    tt1.enqueue(called.append, 1, taskName='task')
+    assert     tt1.waitUntilIdle(timeout=30)
+    assert not tt2.waitUntilIdle(timeout=0.1)
+    assert called == [1]
+    event.set()
+    assert tt2.waitUntilIdle(timeout=30)
+
+    w = imagewrap.ImageWrapper(nib.Nifti1Image(data, np.eye(4)))
+    assert w.getTaskThread() is None
+
+
+def test_isSimpleSliceObj():
+
+    shape = (10, 11, 12)
+    simple = [
+        5,
+        -1,
+        np.int64(3),
+        (1, 2, 3),
+        (1, slice(None), 3),
+        (slice(2, 5), slice(None, 11), slice(0, 12, 1)),
+        (slice(3, 3),),
+        ()]
+    notsimple = [
+        10,
+        -11,
+        True,
+        (1, 2, 3, 0),
+        (1, 2, 30),
+        (slice(0, 5, 2),),
+        (slice(-3, None),),
+        (slice(0, 20),),
+        (slice(5, 2),),
+        (Ellipsis, 1),
+        (None, 1),
+        (1.0, 2, 3),
+        [1, 2, 3],
+        np.ones(shape, dtype=bool)]
+
+    for s in simple:
+        assert imagewrap.isSimpleSliceObj(s, shape)
+    for s in notsimple:
+        assert not imagewrap.isSimpleSliceObj(s, shape)
+
+
+@pytest.mark.parametrize('lazyScaling', [False, True])
+def test_getitem_fastPath(lazyScaling):
+
+    data = np.random.randint(0, 1000, (10, 11, 12, 5)).astype(np.int16)
+    nimg = nib.Nifti1Image(data, np.eye(4))
+    nimg.header.set_slope_inter(2, 1)
+
+    with tempdir():
+        nib.save(nimg, 'image.nii.gz')
+        fast = imagewrap.ImageWrapper(nib.load('image.nii.gz'),
+                                      loadData=True,
+                                      lazyScaling=lazyScaling)
+        fast.calcRange()
+
+        slow = imagewrap.ImageWrapper(nib.load('image.nii.gz'),
+                                      loadData=True,
+                                      lazyScaling=lazyScaling)
+        slow.calcRange()
+
+        keys = [(1, 2, 3, 4),
+                (1, 2, 3),
+                (-1, -2, -3, -4),
+                (np.int32(1), 2, 3, 0),
+                (1,),
+                1,
+                (slice(None), 2, 3, 4),
+                (1, 2, 3, slice(None)),
+                (slice(2, 5), slice(3, 4), 0),
+                (slice(2, 2), 0, 0, 0),
+                (Ellipsis, 1)]
+
+        with mock.patch('fsl.data.imagewrapper.isSimpleSliceObj',
+                        return_value=False):
+            expected = [slow[k] for k in keys]
+
+        for key, exp in zip(keys, expected):
+            got = fast[key]
+            assert type(got) == type(exp)
+            assert np.all(np.asarray(got) == np.asarray(exp))
+            assert np.asarray(got).shape == np.asarray(exp).shape
+            assert np.asarray(got).dtype == np.asarray(exp).dtype
+
+        # fast path is not used until the
+        # data range has been calculated
+        wrapper = imagewrap.ImageWrapper(nib.load('image.nii.gz'),
+                                         loadData=True)
+        assert not wrapper.covered
+        assert wrapper[1, 2, 3, 4] == data[1, 2, 3, 4] * 2 + 1
+        assert wrapper.dataRange == (data[1, 2, 3, 4] * 2 + 1,) * 2
+
+
+@pytest.mark.longtest
+def test_getitem_fastPath_benchmark():
+
+    data    = np.random.random((91, 109, 91, 10)).astype(np.float32)
+    wrapper = imagewrap.ImageWrapper(nib.Nifti1Image(data, np.eye(4)),
+                                     loadData=True)
+    wrapper.calcRange()
+    ncalls  = 10000
+
+    def latency(key):
+        start = time.perf_counter()
+        for _ in range(ncalls):
+            wrapper[key]
+        return (time.perf_counter() - start) / ncalls
+
+    for key in [(45, 54, 45, 5), (45, 54, 45, slice(None))]:
+        fast = latency(key)
+        with mock.patch('fsl.data.imagewrapper.isSimpleSliceObj',
+                        return_value=False):
+            slow = latency(key)
+
+        print('{}: fast path {:0.2f}us, normal path {:0.2f}us'.format(
+            key, fast * 1e6, slow * 1e6))
+        assert fast < slow
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+#
+# test_imagewriter.py -
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import                 gzip
+import                 glob
+import                 os
+import unittest.mock as mock
+
+import numpy   as np
+import nibabel as nib
+import pytest
+
+import fsl.data.image       as fslimage
+import fsl.data.imageheader as imageheader
+import fsl.data.imagewriter as imagewriter
+from fsl.utils.tempdir import tempdir
+
+
+@pytest.mark.parametrize('ext', ['.nii', '.nii.gz'])
+def test_ImageWriter_append(ext):
+
+    data   = np.random.random((10, 11, 12, 5)).astype(np.float32)
+    xform  = np.diag([2, 3, 4, 1])
+    ref    = fslimage.Image(data[..., 0], xform=xform)
+    ref.header.set_slope_inter(2, 1)
+
+    with tempdir():
+        with imagewriter.ImageWriter('out' + ext, ref) as writer:
+            for vol in range(5):
+                writer.append(data[..., vol])
+                assert writer.nvols == vol + 1
+                if vol == 0: assert writer.shape == (10, 11, 12)
+                else:        assert writer.shape == (10, 11, 12, vol + 1)
+
+        # only the output file is left
+        assert glob.glob('.*') + glob.glob('*') == ['out' + ext]
+
+        img = fslimage.Image('out' + ext)
+        hdr = imageheader.readHeader('out' + ext)
+
+        assert img.shape == (10, 11, 12, 5)
+        assert hdr.get_data_shape() == (10, 11, 12, 5)
+        assert np.all(img.voxToWorldMat == xform)
+        assert np.all(img[:] == data)
+        nimg = nib.load('out' + ext)
+        assert np.all(nimg.get_fdata() == data)
+        assert (nimg.dataobj.slope, nimg.dataobj.inter) == (1, 0)
+        assert np.isclose(img.header['cal_min'], data.min())
+        assert np.isclose(img.header['cal_max'], data.max())
+
+
+@pytest.mark.parametrize('outtype, ext', [('NIFTI',    '.nii'),
+                                          ('NIFTI_GZ', '.nii.gz')])
+def test_ImageWriter_defaultExt(outtype, ext):
+
+    data = np.random.random((10, 11, 12)).astype(np.float32)
+    ref  = fslimage.Image(data)
+
+    with tempdir(), \
+         mock.patch.dict(os.environ, FSLOUTPUTTYPE=outtype):
+        with imagewriter.ImageWriter('out', ref) as writer:
+            assert writer.filename.endswith(ext)
+            writer.append(data)
+        assert glob.glob('*') == ['out' + ext]
+        assert np.all(fslimage.Image('out')[:] == data)
+
+    # Other file types are not supported
+    with tempdir(), \
+         mock.patch.dict(os.environ, FSLOUTPUTTYPE='NIFTI2_PAIR_GZ'):
+        with pytest.raises(ValueError):
+            imagewriter.ImageWriter('out', ref)
+
+
+def test_ImageWriter_cast():
+
+    data = np.array([[-1e6, -2.6, -0.5, 0.4],
+                     [2.5,  2.7,  40000, np.pi]]).reshape((2, 4, 1))
+    exp  = np.array([[-32768, -3, 0, 0],
+                     [2, 3, 32767, 3]]).reshape((2, 4, 1))
+    ref  = fslimage.Image(data)
+
+    with tempdir():
+        for ext in ('.nii', '.nii.gz'):
+            with imagewriter.ImageWriter('out' + ext, ref,
+                                         dtype=np.int16) as writer:
+                writer.append(data)
+                assert writer.dataRange == (-32768, 32767)
+
+            img = fslimage.Image('out' + ext)
+            assert img.dtype == np.int16
+            assert np.all(img[:] == exp)
+            assert img.header['cal_min'] == -32768
+            assert img.header['cal_max'] == 32767
+
+
+def test_ImageWriter_compressed():
+
+    data = np.random.randint(0, 100, (10, 11, 12, 6)).astype(np.int16)
+    ref  = fslimage.Image(data)
+
+    # .nii.gz file is a valid gzip file
+    # containing the same bytes as the .nii
+    with tempdir():
+        for ext in ('.nii', '.nii.gz'):
+            with imagewriter.ImageWriter('out' + ext, ref, threads=2) as w:
+                for slc, vol in ref.iterVolumes():
+                    w.write(slc, vol)
+
+        with open('out.nii', 'rb') as f:
+            raw = f.read()
+        with gzip.open('out.nii.gz', 'rb') as f:
+            assert f.read() == raw
+
+
+@pytest.mark.parametrize('ext', ['.nii', '.nii.gz'])
+def test_ImageWriter_write(ext):
+
+    data     = np.random.random((10, 11, 12, 4)).astype(np.float32)
+    expected = np.copy(data)
+    ref      = fslimage.Image(data)
+
+    expected[..., 1]     = 0
+    expected[..., 5, 2]  = 7
+    expected[..., 6:, 2] = 0
+
+    with tempdir():
+        with imagewriter.ImageWriter('out' + ext, ref) as writer:
+
+            # slab within a volume, and
+            # a scalar broadcast to a slice
+            writer.write((slice(None),) * 3 + (slice(0, 1),), data[..., :1])
+            writer.write((slice(None), slice(None), slice(0, 5), 2),
+                         data[:, :, :5, 2])
+            writer.write((slice(None), slice(None), 5, 2), 7)
+
+            # gaps are filled with zeros
+            writer.write((slice(None),) * 3 + (slice(3, 4),), data[..., 3:])
+
+            # regions must be contiguous
+            with pytest.raises(IndexError):
+                writer.write((0, slice(None), slice(None), 3), 0)
+            with pytest.raises(IndexError):
+                writer.write((slice(None),) * 3 + (slice(2, None),), 0)
+            with pytest.raises(ValueError):
+                writer.append(np.zeros((10, 11)))
+
+            # .nii.gz files must be written in order
+            if ext == '.nii.gz':
+                with pytest.raises(ValueError):
+                    writer.write((slice(None),) * 3 + (0,), data[..., 0])
+            else:
+                writer.write((slice(None),) * 3 + (1,), 0)
+
+        img = fslimage.Image('out' + ext)
+        assert img.shape == (10, 11, 12, 4)
+        assert np.all(img[:] == expected)
+
+
+def test_ImageWriter_3D():
+
+    data = np.random.randint(0, 100, (10, 11, 12)).astype(np.uint8)
+    ref  = fslimage.Image(data)
+
+    with tempdir():
+        with imagewriter.ImageWriter('out3d.nii.gz', ref) as writer:
+            writer.append(data)
+        with imagewriter.ImageWriter('out4d.nii.gz', ref,
+                                     dtype=np.float64) as writer:
+            writer.append(data)
+            writer.append(data)
+
+        img3d = fslimage.Image('out3d.nii.gz')
+        img4d = fslimage.Image('out4d.nii.gz')
+
+        assert img3d.shape == (10, 11, 12)
+        assert img4d.shape == (10, 11, 12, 2)
+        assert img3d.dtype == np.uint8
+        assert img4d.dtype == np.float64
+        assert np.all(img3d[:] == data)
+        assert np.all(img4d[..., 1] == data)
+
+
+def test_ImageWriter_abort():
+
+    data = np.random.random((10, 11, 12, 3)).astype(np.float32)
+    ref  = fslimage.Image(data)
+
+    with tempdir():
+        ref.save('out.nii.gz')
+
+        with pytest.raises(RuntimeError):
+            with imagewriter.ImageWriter('out.nii.gz', ref) as writer:
+                writer.append(np.zeros((10, 11, 12)))
+                raise RuntimeError()
+
+        assert writer.closed
+        assert glob.glob('.*') == []
+        assert np.all(fslimage.Image('out.nii.gz')[:] == data)
+
+        writer = imagewriter.ImageWriter('new.nii', ref)
+        writer.abort()
+        assert glob.glob('*') == ['out.nii.gz']
+        assert glob.glob('.*') == []
+
+        with pytest.raises(ValueError):
+            imagewriter.ImageWriter('out.hdr', ref)
+
+
+def test_ImageWriter_symlink():
+
+    data = np.random.random((10, 11, 12, 3)).astype(np.float32)
+    ref  = fslimage.Image(data)
+
+    with tempdir():
+        os.mkdir('real')
+        ref.save(os.path.join('real', 'out.nii.gz'))
+        os.symlink(os.path.join('real', 'out.nii.gz'), 'out.nii.gz')
+
+        with imagewriter.ImageWriter('out.nii.gz', ref) as writer:
+            for vol in range(3):
+                writer.append(data[..., vol] * 2)
+
+        assert os.path.islink('out.nii.gz')
+        assert os.listdir('real') == ['out.nii.gz']
+        assert np.all(fslimage.Image('out.nii.gz')[:] == data * 2)
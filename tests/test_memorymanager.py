@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+#
+# test_memorymanager.py -
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import                 gc
+import                 threading
+import unittest.mock as mock
+
+import numpy   as np
+import nibabel as nib
+
+import fsl.data.image         as fslimage
+import fsl.data.imagewrapper  as imagewrapper
+import fsl.data.memorymanager as memorymanager
+from fsl.utils.tempdir import tempdir
+
+
+def _make_images(n, shape=(10, 10, 10)):
+    data = []
+    for i in range(n):
+        d = np.random.random(shape).astype(np.float32)
+        nib.save(nib.Nifti1Image(d, np.eye(4)), 'image{}.nii.gz'.format(i))
+        data.append(d)
+    return data
+
+
+def test_enable_disable():
+    try:
+        mgr = memorymanager.enable(1000)
+        assert memorymanager.getManager() is mgr
+        assert mgr.limit == 1000
+        memorymanager.disable()
+        assert memorymanager.getManager() is None
+    finally:
+        memorymanager.disable()
+
+
+def test_MemoryManager():
+
+    volbytes = 10 * 10 * 10 * 4
+
+    with tempdir():
+        data = _make_images(4)
+
+        try:
+            mgr  = memorymanager.enable(volbytes * 3)
+            imgs = [fslimage.Image('image{}'.format(i)) for i in range(3)]
+
+            assert mgr.residentBytes() == volbytes * 3
+            assert all(i.getImageWrapper().inMemory for i in imgs)
+
+            # image 0 is the least recently used
+            # so is unloaded when image 3 is loaded
+            imgs[1][0, 0, 0]
+            imgs[0][0, 0, 0]
+            imgs[2][0, 0, 0]
+            imgs.append(fslimage.Image('image3'))
+
+            inmem = [i.getImageWrapper().inMemory for i in imgs]
+            assert inmem == [True, False, True, True]
+            assert mgr.residentBytes() == volbytes * 3
+            assert [w for w, _ in mgr.usage()] == \
+                [imgs[i].getImageWrapper() for i in (0, 2, 3)]
+
+            # unloaded data is re-read from
+            # file, and the range is retained
+            wrapper = imgs[1].getImageWrapper()
+            assert np.all(imgs[1][:] == data[1])
+            assert np.isclose(imgs[1].dataRange[0], data[1].min())
+            assert np.isclose(imgs[1].dataRange[1], data[1].max())
+            assert not wrapper.inMemory
+
+            # modified images are never unloaded
+            imgs[0][0, 0, 0] = 5
+            data[0][0, 0, 0] = 5
+            mgr.limit        = 0
+            inmem = [i.getImageWrapper().inMemory for i in imgs]
+            assert inmem == [True, False, False, False]
+            assert mgr.residentBytes() == volbytes
+            assert np.all(imgs[0][:] == data[0])
+
+            # images created from arrays are never unloaded
+            arrimg = fslimage.Image(data[1])
+            mgr.enforce()
+            assert arrimg.getImageWrapper().inMemory
+            assert mgr.residentBytes() == volbytes * 2
+
+            # garbage-collected images are forgotten
+            del imgs
+            del arrimg
+            gc.collect()
+            assert mgr.residentBytes() == 0
+            assert mgr.usage()         == []
+
+        finally:
+            memorymanager.disable()
+
+
+def test_MemoryManager_pinned():
+
+    volbytes = 10 * 10 * 10 * 4
+
+    with tempdir():
+        data = _make_images(2)
+
+        try:
+            mgr  = memorymanager.enable(volbytes)
+            img0 = fslimage.Image('image0')
+            arr  = img0.data
+
+            # data accessed via Image.data is
+            # pinned, as it may be modified
+            # through the returned view
+            assert img0.getImageWrapper().pinned
+            img1 = fslimage.Image('image1')
+            assert img0.getImageWrapper().inMemory
+            assert not img0.getImageWrapper().unloadData()
+
+            arr[0, 0, 0] = -1
+            mgr.limit    = 0
+            assert img0.getImageWrapper().inMemory
+            assert not img1.getImageWrapper().inMemory
+            assert img0[0, 0, 0] == -1
+            assert np.all(img0[1:] == data[0][1:])
+
+            # lazily scaled data is returned
+            # as a read-only copy, so is not
+            # pinned
+            nimg = nib.Nifti1Image(np.ones((10, 10, 10), dtype=np.int16),
+                                   np.eye(4))
+            nimg.header.set_slope_inter(2, 1)
+            nib.save(nimg, 'scaled.nii.gz')
+            img2 = fslimage.Image('scaled', lazyScaling=True)
+            assert np.all(img2.data == 3)
+            assert img2.getImageWrapper().lazyScaling
+            assert not img2.getImageWrapper().pinned
+            assert img2.getImageWrapper().unloadData()
+
+        finally:
+            memorymanager.disable()
+
+
+def test_unloadData_lazyScaling():
+
+    with tempdir():
+        data = np.random.randint(0, 1000, (10, 10, 10)).astype(np.int16)
+        nimg = nib.Nifti1Image(data, np.eye(4))
+        nimg.header.set_slope_inter(2, 1)
+        nib.save(nimg, 'image.nii.gz')
+        data = data * 2 + 1
+
+        img     = fslimage.Image('image.nii.gz', lazyScaling=True)
+        wrapper = img.getImageWrapper()
+
+        assert wrapper.lazyScaling
+        assert wrapper.residentBytes == data.size * 2
+        assert wrapper.unloadData()
+        assert wrapper.residentBytes == 0
+        assert not wrapper.lazyScaling
+        assert np.all(img[:] == data)
+        assert img.dataRange == (data.min(), data.max())
+
+        img.loadData()
+        assert wrapper.lazyScaling
+        assert np.all(img[:] == data)
+
+
+
+def test_unloadData_lazyScaling_threaded():
+
+    with tempdir():
+        data = np.random.randint(0, 1000, (10, 10, 10, 4)).astype(np.int16)
+        nimg = nib.Nifti1Image(data, np.eye(4))
+        nimg.header.set_slope_inter(2, 1)
+        nib.save(nimg, 'image.nii.gz')
+        data = data * 2 + 1
+
+        img     = fslimage.Image('image.nii.gz',
+                                 lazyScaling=True,
+                                 calcRange=False)
+        wrapper = img.getImageWrapper()
+
+        # Unload the data from another thread
+        # (as the memory manager would), after
+        # the wrapper has taken a reference to
+        # the in-memory data, but before it
+        # has been scaled.
+        def unloadInThread(func):
+            def wrapped(*args, **kwargs):
+                t = threading.Thread(target=wrapper.unloadData)
+                t.start()
+                t.join()
+                return func(*args, **kwargs)
+            return wrapped
+
+        # data range calculation on raw data
+        img[0, 0, 0, 0]
+        with mock.patch('fsl.data.imagewrapper.volumeRanges',
+                        unloadInThread(imagewrapper.volumeRanges)):
+            assert wrapper.lazyScaling
+            img.calcRange()
+            assert not wrapper.inMemory
+            assert img.dataRange == (data.min(), data.max())
+
+        # fast path for in-memory reads
+        with mock.patch('fsl.data.imagewrapper.isSimpleSliceObj',
+                        unloadInThread(imagewrapper.isSimpleSliceObj)):
+            for vol in range(data.shape[3]):
+                img.loadData()
+                assert wrapper.lazyScaling
+                assert np.all(img[:, :, :, vol] == data[:, :, :, vol])
+                assert not wrapper.inMemory
+
+        # masked/voxel reads
+        with mock.patch('fsl.data.imagewrapper.ImageWrapper.'
+                        '_ImageWrapper__scale',
+                        unloadInThread(
+                            imagewrapper.ImageWrapper._ImageWrapper__scale)):
+            img.loadData()
+            assert np.all(wrapper.voxelData(([1], [2], [3])) ==
+                          data[1, 2, 3, :])
+            assert not wrapper.inMemory
@@ -6,6 +6,8 @@
 #
 
 
+import gc
+
 import pytest
 
 import fsl.utils.notifier as notifier
@@ -197,3 +199,42 @@ def test_skip():
     t.notify(topic='topic')
     assert default_called[0] == 14
     assert topic_called[  0] == 6
+
+
+def test_hasListeners():
+
+    class Thing(notifier.Notifier):
+        pass
+
+    t = Thing()
+
+    def default_callback(*a):
+        pass
+
+    def topic_callback(*a):
+        pass
+
+    assert not t.hasListeners()
+    assert not t.hasListeners('topic')
+
+    t.register('topic_callback', topic_callback, topic='topic')
+    assert not t.hasListeners()
+    assert     t.hasListeners('topic')
+
+    with t.skip('topic_callback', 'topic'):
+        assert not t.hasListeners('topic')
+
+    t.register('default_callback', default_callback)
+    assert t.hasListeners()
+    assert t.hasListeners('other')
+
+    t.deregister('topic_callback', 'topic')
+    t.deregister('default_callback')
+    assert not t.hasListeners()
+    assert not t.hasListeners('topic')
+
+    # gc'd callbacks are ignored
+    t.register('topic_callback', topic_callback, topic='topic')
+    del topic_callback
+    gc.collect()
+    assert not t.hasListeners('topic')
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# test_pgzip.py -
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+
+import            io
+import            gzip
+import            zlib
+import itertools as it
+
+import pytest
+
+import numpy as np
+
+import fsl.utils.pgzip   as pgzip
+import fsl.utils.gzindex as gzindex
+from fsl.utils.tempdir import tempdir
+
+
+def test_GzipWriter():
+
+    data = np.random.randint(0, 20, 300000, dtype=np.uint8).tobytes()
+
+    threads    = [1, 4]
+    levels     = [1, 6, 9]
+    blocksizes = [32768, 100000, 1048576]
+
+    with tempdir():
+        for nthreads, level, bsize in it.product(threads, levels, blocksizes):
+
+            with pgzip.GzipWriter('data.gz',
+                                  level=level,
+                                  threads=nthreads,
+                                  blocksize=bsize) as f:
+                assert f.writable()
+                assert not f.readable()
+
+                # write in irregularly sized chunks
+                offset = 0
+                while offset < len(data):
+                    nbytes = np.random.randint(1, 50000)
+                    assert f.write(data[offset:offset + nbytes]) == \
+                        len(data[offset:offset + nbytes])
+                    offset += nbytes
+                assert f.tell() == len(data)
+
+            with open('data.gz', 'rb') as f:
+                assert gzip.decompress(f.read()) == data
+
+            # Should be a single gzip stream
+            with open('data.gz', 'rb') as f:
+                dobj = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                assert dobj.decompress(f.read()) == data
+                assert dobj.eof
+                assert dobj.unused_data == b''
+
+            f = gzindex.SeekableGzipFile('data.gz', spacing=65536)
+            f.seek(200000)
+            assert f.read(1000) == data[200000:201000]
+
+
+def test_GzipWriter_empty():
+    with tempdir():
+        with pgzip.GzipWriter('data.gz'):
+            pass
+        with gzip.open('data.gz', 'rb') as f:
+            assert f.read() == b''
+
+
+def test_GzipWriter_fileobj():
+    data = np.random.randint(0, 20, 100000, dtype=np.uint8).tobytes()
+    buf  = io.BytesIO()
+    with pgzip.GzipWriter(fileobj=buf, threads=2, blocksize=40000) as f:
+        f.write(data)
+    assert not buf.closed
+    assert gzip.decompress(buf.getvalue()) == data
+
+    with pytest.raises(ValueError):
+        pgzip.GzipWriter()
+    with pytest.raises(ValueError):
+        f.write(b'abc')
+
+
+def test_GzipWriter_seek():
+    buf = io.BytesIO()
+    with pgzip.GzipWriter(fileobj=buf) as f:
+        f.write(b'abc')
+        assert f.seek(3)  == 3
+        assert f.seek(10) == 10
+        assert f.seek(2, io.SEEK_CUR) == 12
+        f.write(b'def')
+        with pytest.raises(io.UnsupportedOperation):
+            f.seek(5)
+        with pytest.raises(io.UnsupportedOperation):
+            f.seek(0, io.SEEK_END)
+    assert gzip.decompress(buf.getvalue()) == b'abc' + bytes(9) + b'def'
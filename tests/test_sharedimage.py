@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+# test_sharedimage.py -
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import concurrent.futures as futures
+import                       gc
+import multiprocessing    as mp
+import                       pickle
+import unittest.mock      as mock
+
+import numpy   as np
+import nibabel as nib
+import pytest
+
+import fsl.data.image       as fslimage
+import fsl.data.sharedimage as sharedimage
+from fsl.utils.tempdir import tempdir
+
+
+# multiprocessing.shared_memory
+# requires python >= 3.8
+pytest.importorskip('multiprocessing.shared_memory')
+
+
+def _volmean(handle, vol):
+    img = handle.attach()
+    return img[..., vol].mean()
+
+
+def _zero(handle, vol):
+    img = handle.attach(writeable=True)
+    img[..., vol] = np.zeros(img.shape[:3])
+
+
+# Views which outlive the image
+# they were obtained from
+_views = []
+def _keepView(handle):
+    img = handle.attach()
+    _views.append(img[..., 0])
+    del img
+    gc.collect()
+    return handle.memname in sharedimage.ATTACHED, float(_views[-1].mean())
+
+
+def test_SharedImage():
+
+    with tempdir():
+        data  = np.random.randint(0, 1000, (10, 11, 12, 4)).astype(np.int16)
+        nimg  = nib.Nifti1Image(data, np.diag([2, 2, 2, 1]))
+        nimg.header.set_slope_inter(2, 1)
+        nib.save(nimg, 'image.nii.gz')
+        data  = data * 2.0 + 1
+
+        img = fslimage.Image('image.nii.gz', loadData=False)
+        img.setMeta('key', 'value')
+
+        shared = sharedimage.SharedImage(img, nbytes=1000)
+        handle = pickle.loads(pickle.dumps(shared.handle))
+        copy   = handle.attach()
+
+        assert copy.name                 == img.name
+        assert copy.dataSource           == img.dataSource
+        assert copy.shape                == img.shape
+        assert copy.getMeta('key')       == 'value'
+        assert np.all(copy.voxToWorldMat == img.voxToWorldMat)
+        assert np.all(copy[:]            == data)
+        assert copy.dtype                == np.float64
+
+        # read only by default
+        with pytest.raises(ValueError):
+            copy[0, 0, 0, 0] = 1
+
+        # all images attached to a block share its memory
+        wcopy = handle.attach(writeable=True)
+        wcopy[0, 0, 0, 0] = -5
+        assert copy[0, 0, 0, 0] == -5
+
+        # block is opened once per process, and
+        # closed when all images are gone
+        assert sharedimage.ATTACHED[handle.memname][2] == 2
+        del copy
+        del wcopy
+        gc.collect()
+        assert handle.memname not in sharedimage.ATTACHED
+
+        # block is not closed while views
+        # of the image data are alive
+        vol = handle.attach()[..., 2]
+        gc.collect()
+        assert handle.memname in sharedimage.ATTACHED
+        assert np.all(vol == data[..., 2])
+        del vol
+        copy = handle.attach()
+        del copy
+        gc.collect()
+        assert handle.memname not in sharedimage.ATTACHED
+
+        shared.close()
+        assert shared.closed
+        with pytest.raises(FileNotFoundError):
+            handle.attach()
+
+
+def test_SharedImage_processes():
+
+    data = np.random.random((10, 11, 12, 6)).astype(np.float32)
+    img  = fslimage.Image(data)
+
+    with sharedimage.SharedImage(img) as shared, \
+         futures.ProcessPoolExecutor(2) as pool:
+
+        jobs  = [pool.submit(_volmean, shared.handle, v) for v in range(6)]
+        means = [j.result() for j in jobs]
+
+        assert np.all(np.isclose(means, data.mean(axis=(0, 1, 2))))
+
+        jobs = [pool.submit(_zero, shared.handle, v) for v in (1, 3)]
+        for j in jobs:
+            j.result()
+
+        copy = shared.handle.attach()
+        data[..., [1, 3]] = 0
+        assert np.all(copy[:] == data)
+        del copy
+
+    assert shared.closed
+
+
+@pytest.mark.parametrize('method', ['fork', 'spawn'])
+def test_SharedImage_viewOutlivesImage(method, capfd):
+
+    data = np.random.random((10, 11, 12, 2)).astype(np.float32)
+    img  = fslimage.Image(data)
+
+    # The block is left open in the worker
+    # when the image is detached, and no
+    # error is printed when the worker exits
+    with sharedimage.SharedImage(img) as shared, \
+         futures.ProcessPoolExecutor(
+             1, mp_context=mp.get_context(method)) as pool:
+        attached, mean = pool.submit(_keepView, shared.handle).result()
+
+    assert attached
+    assert np.isclose(mean, data[..., 0].mean())
+    assert 'BufferError' not in capfd.readouterr().err
+
+    # The deferred close happens on the next
+    # call to detach, for any image, once the
+    # views have been garbage-collected
+    with sharedimage.SharedImage(img) as shared1, \
+         sharedimage.SharedImage(img) as shared2:
+        vol = shared1.handle.attach()[..., 1]
+        gc.collect()
+        assert shared1.handle.memname in sharedimage.ATTACHED
+
+        # views remain valid after the
+        # owner has released the block
+        shared1.close()
+        assert np.all(vol == data[..., 1])
+
+        del vol
+        copy = shared2.handle.attach()
+        del copy
+        gc.collect()
+        assert shared1.handle.memname not in sharedimage.ATTACHED
+        assert shared2.handle.memname not in sharedimage.ATTACHED
+
+
+def test_SharedImage_noSharedMemory():
+    img = fslimage.Image(np.zeros((5, 5, 5)))
+    with sharedimage.SharedImage(img) as shared, \
+         mock.patch.object(sharedimage, 'shared_memory', None):
+        with pytest.raises(RuntimeError):
+            sharedimage.SharedImage(img)
+        with pytest.raises(RuntimeError):
+            shared.handle.attach()